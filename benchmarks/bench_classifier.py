@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for the line classifier and rule parser
+Compares the per-line checks used before utils.classify (kept verbatim
+below) with the classifier/parser-based helpers, in lines per second.
+
+Usage: python benchmarks/bench_classifier.py [blocklist.txt]
+Without a file a synthetic mix of rule kinds is used.
+"""
+
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'blocklist_manager'))
+
+from utils.classify import classify, is_rule
+from utils.rules import parse_rule, blocked_domain
+from utils.helpers import is_comment, convert_adguard_to_pihole, convert_pihole_to_adguard
+
+SAMPLE = [
+    "! Title: Example list",
+    "# comment",
+    "## Section",
+    "#### Title",
+    "##",
+    "",
+    "||ads.example.com^",
+    "||tracker.example.net^$important",
+    "@@||allowed.example.org^",
+    "example.com##.banner",
+    "/ad[0-9]+\\.js/",
+    "0.0.0.0 ads.example.com",
+    "127.0.0.1\tmetrics.example.com",
+    "plain.example.com",
+    "|https://example.com/ads/",
+]
+
+
+def legacy_is_comment(line):
+    """is_comment() before the classifier"""
+    stripped = line.strip()
+    if not stripped:
+        return True
+    if stripped.startswith('!'):
+        return True
+    if stripped.startswith('#'):
+        return True
+    if stripped.startswith('//'):
+        return True
+    if re.match(r'^:.*:$', stripped):
+        return True
+    return False
+
+
+def legacy_convert_adguard_to_pihole(line):
+    """convert_adguard_to_pihole() before the parser"""
+    stripped = line.strip()
+    if not stripped or stripped.startswith('!'):
+        return None
+    domain = stripped
+    if domain.startswith('||'):
+        domain = domain[2:]
+    if domain.endswith('^'):
+        domain = domain[:-1]
+    if '^$' in domain:
+        domain = domain.split('^$')[0]
+    if re.match(r'^[a-zA-Z0-9]', domain) and '.' in domain:
+        return domain
+    return None
+
+
+def legacy_convert_pihole_to_adguard(line):
+    """convert_pihole_to_adguard() before the classifier"""
+    stripped = line.strip()
+    if not stripped:
+        return None
+    if stripped.startswith('#'):
+        return None
+    if stripped.startswith('!'):
+        return None
+    if stripped.startswith('//'):
+        return None
+    if ' ' in stripped:
+        return None
+    if re.match(r'^\d+\.\d+\.\d+\.\d+\s+', stripped):
+        parts = stripped.split()
+        if len(parts) >= 2:
+            stripped = parts[-1]
+        else:
+            return None
+    if stripped.startswith('||') and stripped.endswith('^'):
+        return stripped
+    if re.match(r'^[a-zA-Z0-9]', stripped) and '.' in stripped:
+        if re.match(r'^[a-zA-Z0-9\.\-_]+$', stripped):
+            return f'||{stripped}^'
+    return None
+
+
+def load_lines(path):
+    if path:
+        with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+            return f.read().split('\n')
+    return SAMPLE * (500000 // len(SAMPLE))
+
+
+def measure(func, lines, repeat=3):
+    """Best lines/sec over repeat runs"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for line in lines:
+            func(line)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(lines) / best
+
+
+def main():
+    lines = load_lines(sys.argv[1] if len(sys.argv) > 1 else None)
+    stripped = [line.strip() for line in lines]
+    encoded = [line.encode('utf-8') for line in stripped]
+    print(f"{len(lines):,} lines")
+
+    rows = [
+        ("is_comment (before)", legacy_is_comment, lines),
+        ("is_comment (after)", is_comment, lines),
+        ("is_rule, stripped str", is_rule, stripped),
+        ("is_rule, stripped bytes", is_rule, encoded),
+        ("classify, stripped str", classify, stripped),
+        ("classify, stripped bytes", classify, encoded),
+        ("parse_rule, stripped str", parse_rule, stripped),
+        ("parse_rule, ||domain^ only", parse_rule, ["||ads.example.com^"] * len(lines)),
+        ("blocked_domain, stripped str", blocked_domain, stripped),
+        ("blocked_domain, ||domain^ only", blocked_domain, ["||ads.example.com^"] * len(lines)),
+        ("convert_adguard_to_pihole (before)", legacy_convert_adguard_to_pihole, lines),
+        ("convert_adguard_to_pihole (after)", convert_adguard_to_pihole, lines),
+        ("convert_pihole_to_adguard (before)", legacy_convert_pihole_to_adguard, lines),
+        ("convert_pihole_to_adguard (after)", convert_pihole_to_adguard, lines),
+    ]
+    for name, func, data in rows:
+        print(f"{name:<38} {measure(func, data):>14,.0f} lines/sec")
+
+
+if __name__ == "__main__":
+    main()
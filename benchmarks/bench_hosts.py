@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Benchmark for hosts-file ingestion
+Converts a hosts file to AdGuard rules with the converter used before the
+hosts fast path and with the current one, per line and end to end through
+the conversion pipeline, in lines per second.
+
+Usage: python benchmarks/bench_hosts.py [hosts.txt] [lines]
+Without a file a synthetic hosts file (default 2,000,000 lines) is written
+to a temp folder: single and multi-name entries, IPv4/IPv6 sinks, inline
+comments and localhost lines.
+"""
+
+import os
+import sys
+import time
+import random
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'blocklist_manager'))
+
+from bench_classifier import legacy_convert_pihole_to_adguard, measure
+from core.pipeline import Pipeline, Normalize, FileSink
+from utils.helpers import convert_pihole_to_adguard
+from utils.rules import hosts_domains
+
+HEADER = [
+    "# Hosts file",
+    "127.0.0.1 localhost",
+    "127.0.0.1 localhost.localdomain",
+    "::1 localhost ip6-localhost ip6-loopback",
+    "0.0.0.0 0.0.0.0",
+    "",
+]
+
+
+def write_hosts(path, count):
+    """Write a synthetic hosts file of count lines"""
+    rng = random.Random(42)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(HEADER) + '\n')
+        for index in range(count - len(HEADER)):
+            name = f"{rng.randrange(1 << 30):x}.example{index % 97}.com"
+            pick = index % 10
+            if pick < 6:
+                f.write(f"0.0.0.0 {name}\n")
+            elif pick == 6:
+                f.write(f"127.0.0.1 {name} www.{name} cdn.{name}\n")
+            elif pick == 7:
+                f.write(f"0.0.0.0 {name} # tracker\n")
+            elif pick == 8:
+                f.write(f":: {name}\n")
+            else:
+                f.write(f"# 0.0.0.0 {name}\n")
+
+
+def convert_file(path, convert):
+    """Lines/sec and rules written converting path through the pipeline"""
+    output = path + '.out'
+    start = time.perf_counter()
+    total_lines, lines_written = Pipeline(Normalize(convert), FileSink(output)).run([path])
+    elapsed = time.perf_counter() - start
+    os.remove(output)
+    return total_lines / elapsed, lines_written
+
+
+def main():
+    temp_dir = None
+    if len(sys.argv) > 1 and os.path.isfile(sys.argv[1]):
+        path = sys.argv[1]
+    else:
+        count = int(sys.argv[-1]) if len(sys.argv) > 1 else 2000000
+        temp_dir = tempfile.mkdtemp(prefix="bench_hosts_")
+        path = os.path.join(temp_dir, "hosts.txt")
+        write_hosts(path, count)
+
+    try:
+        with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+            lines = f.read().split('\n')
+        stripped = [line.strip() for line in lines]
+        print(f"{len(lines):,} lines ({os.path.getsize(path):,} bytes)")
+
+        rows = [
+            ("convert_pihole_to_adguard (before)", legacy_convert_pihole_to_adguard, lines),
+            ("convert_pihole_to_adguard (after)", convert_pihole_to_adguard, lines),
+            ("hosts_domains, stripped str", hosts_domains, stripped),
+        ]
+        for name, func, data in rows:
+            print(f"{name:<38} {measure(func, data):>14,.0f} lines/sec")
+
+        for name, func in (("pipeline (before)", legacy_convert_pihole_to_adguard),
+                           ("pipeline (after)", convert_pihole_to_adguard)):
+            rate, written = convert_file(path, func)
+            print(f"{name:<38} {rate:>14,.0f} lines/sec  {written:,} rules")
+    finally:
+        if temp_dir:
+            for name in os.listdir(temp_dir):
+                os.remove(os.path.join(temp_dir, name))
+            os.rmdir(temp_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Benchmark and check for the incremental merge
+Merges a folder of synthetic blocklists incrementally, then removes one
+source and adds another, timing each run. After every run the unique
+lines (or domains with --key domain) of the output are checked against
+a full single-process merge_folder_dedupe of the same sources.
+
+The sequence runs for a plain and a .gz output, with the platform line
+separator and with CRLF (as written on Windows).
+
+Usage: python benchmarks/bench_incremental.py [files] [lines] [--key domain]
+Defaults: 6 files of 200,000 lines in a temp folder.
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'blocklist_manager'))
+
+import utils.lineio
+from core.dedupe import DEDUPE_KEYS
+from core.operations import merge_folder_dedupe
+from utils.lineio import iter_line_batches, strip_line
+
+
+def write_list(path, count, seed):
+    """Write a synthetic blocklist of count lines"""
+    rng = random.Random(seed)
+    with open(path, 'w', encoding='utf-8') as f:
+        for _ in range(count):
+            domain = f"d{rng.randrange(count * 2)}.example{rng.randrange(50)}.com"
+            kind = rng.random()
+            if kind < 0.5:
+                f.write(f"||{domain}^\n")
+            elif kind < 0.8:
+                f.write(f"0.0.0.0 {domain}\n")
+            elif kind < 0.85:
+                f.write("! comment\n")
+            else:
+                f.write(f"{domain}\n")
+
+
+def output_keys(path, key):
+    """Set of dedupe keys of an output file; fails on a repeated key"""
+    key_func = DEDUPE_KEYS[key]
+    keys = set()
+    count = 0
+    for lines, _ in iter_line_batches(path):
+        for line in lines:
+            stripped = strip_line(line)
+            if stripped:
+                keys.add(key_func(stripped) if key_func else stripped)
+                count += 1
+    assert count == len(keys), f"{path}: {count - len(keys):,} repeated keys"
+    return keys
+
+
+def run(source, output, key, label):
+    """One incremental run, checked against a full merge"""
+    log = []
+    start = time.perf_counter()
+    _, total, unique, success = merge_folder_dedupe(source, output, dedupe_key=key,
+                                                    incremental=True, log_callback=log.append)
+    elapsed = time.perf_counter() - start
+    assert success, log[-1]
+
+    reference = os.path.join(os.path.dirname(output), 'reference.txt')
+    merge_folder_dedupe(source, reference, dedupe_key=key, workers=1)
+    expected = output_keys(reference, key)
+    got = output_keys(output, key)
+    assert got == expected, (f"{label}: {len(got - expected):,} extra, "
+                             f"{len(expected - got):,} missing keys")
+    assert unique == len(got), f"{label}: reported {unique:,} lines, output has {len(got):,}"
+
+    action = next((line for line in log if line.startswith(("Patching", "Rebuilding",
+                                                             "No source"))), "")
+    print(f"  {label:<8} {elapsed:7.2f}s  {total:>11,} lines  {unique:>11,} unique  {action}")
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    key = 'domain' if '--key' in sys.argv and 'domain' in sys.argv else 'line'
+    files = int(args[0]) if args else 6
+    lines = int(args[1]) if len(args) > 1 else 200000
+
+    work_dir = tempfile.mkdtemp(prefix='bench_incremental_')
+    try:
+        lists = os.path.join(work_dir, 'lists')
+        os.makedirs(lists)
+        for index in range(files + 1):
+            write_list(os.path.join(lists, f"list{index}.txt"), lines, index)
+
+        for newline in (os.linesep.encode('ascii'), b'\r\n'):
+            utils.lineio.NEWLINE = newline
+            for name in ('merged.txt', 'merged.txt.gz'):
+                print(f"{name}, newline {newline!r}, key {key}")
+                source = os.path.join(work_dir, 'source')
+                run_dir = os.path.join(work_dir, 'run')
+                for folder in (source, run_dir):
+                    shutil.rmtree(folder, ignore_errors=True)
+                    os.makedirs(folder)
+                for index in range(files):
+                    shutil.copy(os.path.join(lists, f"list{index}.txt"), source)
+                output = os.path.join(run_dir, name)
+
+                run(source, output, key, "first")
+                os.remove(os.path.join(source, "list0.txt"))
+                run(source, output, key, "remove")
+                shutil.copy(os.path.join(lists, f"list{files}.txt"), source)
+                run(source, output, key, "add")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
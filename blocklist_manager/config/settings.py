@@ -41,11 +41,70 @@ GITHUB_SOURCES = {
     }
 }
 
+# Download settings
+DOWNLOAD = {
+    'max_concurrent': 5,          # Requests in flight (repos.json max_concurrent_downloads overrides)
+    'per_host': 4,                # Requests in flight per host
+    'timeout': 30,                # Seconds per connection attempt and read
+    'chunk_size': 1024 * 1024,    # Bytes per read when streaming a download to disk
+    'listing_estimate': 50,       # Files assumed per GitHub listing until it has been fetched
+    'cache_file': 'download_cache.json'  # ETag/Last-Modified per URL, kept next to repos.json
+}
+
 # File processing settings
 PROCESSING = {
     'batch_size': 10000,  # Lines to process before updating progress
     'encoding': 'utf-8',
-    'errors': 'ignore'
+    'errors': 'ignore',
+    'workers': 0,         # Worker processes for parallel modes (0 = CPU count)
+    'readers': 1,         # Reader pool size for merge ingestion (1 = read inline, 0 = CPU count)
+    'reader_processes': False,  # Readers are processes instead of threads (CPU-bound inputs)
+    'chunk_size': 1 << 20,  # Bytes read per chunk by the line reader
+    'input_mode': 'buffered',  # 'buffered' (chunked reads) or 'mmap' (memory-mapped input)
+    'write_batch': 10000  # Lines buffered before each write
+}
+
+# Deduplication settings
+DEDUPE = {
+    'mode': 'exact',              # 'exact', 'fingerprint', 'external', 'approximate' or 'sorted'
+    'key': 'line',                # 'line' (stripped text) or 'domain' (canonical domain)
+    'fingerprint_bits': 64,       # 64 (about 6x less RAM than exact) or 128 bit fingerprints
+    'initial_capacity': 1 << 16,  # Starting slot count for fingerprint tables
+    'max_load': 0.7,              # Grow the table beyond this load factor
+    'memory_budget_mb': 512,      # RAM used by external dedupe before spilling
+    'partitions': 64,             # Spill partitions per level for external dedupe
+    'preserve_order': True,       # External dedupe keeps first-occurrence order
+    'shards': 0,                  # Hash shards for parallel merge (0 = one per worker)
+    'temp_dir': None,             # Spill directory (None = system temp)
+    'bloom_memory_mb': 256,       # Size limit of the approximate (Bloom) filter
+    'bloom_line_bytes': 8,        # Input bytes per line assumed when sizing the filter
+    'bloom_fp_rate': 0.001,       # Target false-positive rate for approximate mode
+    'assume_sorted': False        # Sorted mode trusts inputs to be sorted (no check pass)
+}
+
+# Allowlist settings (merge and convert)
+ALLOWLIST = {
+    'files': [],                  # Allowlist files: domain, *.domain, ||domain^ or @@||domain^
+    'apply_exceptions': False,    # Also drop lines covered by @@||domain^ rules of the sources
+    'keep_exceptions': True,      # Keep the @@ rules in AdGuard outputs
+    'report_top': 10              # Allow entries listed in the removal report
+}
+
+# Binary domain-set files (utils.domainset)
+DOMAIN_SET = {
+    'block_size': 16,             # Front-coded keys per indexed block (smaller = faster lookups)
+    'extension': '.dset'          # File extension of converter outputs
+}
+
+# Compressed outputs (paths ending in .gz, .xz or .bz2)
+COMPRESSION = {
+    'level': 6                    # gzip/bz2 level or xz preset (bz2 uses at least 1)
+}
+
+# Multi-format export settings
+EXPORT = {
+    'formats': ['adguard', 'pihole', 'hosts', 'dnsmasq', 'unbound', 'rpz'],  # utils.formats.FORMATS names
+    'timestamp': 'source'  # Header time: 'source' (input file mtime, equal input = equal output) or 'now'
 }
 
 # UI Settings
@@ -0,0 +1,177 @@
+"""
+Allowlist / exception engine
+Allow entries are kept in a hash index keyed by domain; a blocked domain is
+checked against itself and each parent suffix, so a lookup costs one hash
+probe per label regardless of the allowlist size
+"""
+
+import os
+from collections import Counter
+from config.settings import PROCESSING
+from utils.classify import is_rule, NETWORK
+from utils.rules import parse_rule, normalize_domain, blocked_domain, DNS_NEUTRAL_MODIFIERS
+from utils.lineio import LineWriter, iter_line_batches, strip_line
+from utils.compression import compression_for_path
+
+# Index entry modes
+EXACT = 1        # the domain only (plain domain in an allowlist file)
+SUBDOMAINS = 2   # subdomains only (*.domain)
+SUFFIX = 3       # the domain and its subdomains (||domain^, @@||domain^)
+
+
+class Allowlist:
+    """
+    Hashed suffix index of allowed domains
+
+    Allowlist files take one entry per line: 'domain' (exact),
+    '*.domain' (subdomains), '||domain^' or '@@||domain^' (domain and
+    subdomains). Comments and blank lines are ignored.
+    """
+
+    def __init__(self):
+        self._index = {}
+        self.removed = Counter()  # allow entry -> lines removed
+
+    def __len__(self):
+        return len(self._index)
+
+    def copy(self, shared=False):
+        """
+        Copy with its own removal counts; shared=True reuses the index
+        instead of copying it, for copies no entries are added to
+        """
+        allowlist = Allowlist()
+        allowlist._index = self._index if shared else dict(self._index)
+        return allowlist
+
+    def _add(self, domain, mode):
+        self._index[domain] = self._index.get(domain, 0) | mode
+
+    def add_entry(self, stripped):
+        """Add one allowlist file line, returns True if it was an entry"""
+        if not is_rule(stripped):
+            return False
+        if stripped.startswith('*.'):
+            domain = normalize_domain(stripped[2:])
+            mode = SUBDOMAINS
+        elif stripped.startswith(('||', '@@')):
+            return self.add_exception(stripped if stripped.startswith('@@') else '@@' + stripped)
+        else:
+            domain = normalize_domain(stripped)
+            mode = EXACT
+        if domain is None:
+            return False
+        self._add(domain, mode)
+        return True
+
+    def add_exception(self, stripped):
+        """
+        Add an @@||domain^ exception rule, returns True if it was usable
+
+        Exceptions with scope-changing modifiers ($client, $dnstype,
+        $badfilter...) do not apply to every client and are ignored.
+        """
+        rule = parse_rule(stripped)
+        if (not rule.exception or rule.kind != NETWORK or rule.domain is None
+                or not DNS_NEUTRAL_MODIFIERS.issuperset(rule.modifiers)):
+            return False
+        self._add(rule.domain, SUFFIX)
+        return True
+
+    def load(self, filepath):
+        """Add all entries of an allowlist file, returns the number added"""
+        added = 0
+        for lines, _ in iter_line_batches(filepath, decode=True):
+            for line in lines:
+                if self.add_entry(line.strip()):
+                    added += 1
+        return added
+
+    def match(self, domain):
+        """Return the allow entry covering domain, or None"""
+        index = self._index
+        mode = index.get(domain)
+        if mode is not None and mode != SUBDOMAINS:
+            return domain
+        pos = domain.find('.')
+        while pos >= 0:
+            parent = domain[pos + 1:]
+            mode = index.get(parent)
+            if mode is not None and mode != EXACT:
+                return parent
+            pos = domain.find('.', pos + 1)
+        return None
+
+    def allows(self, line):
+        """
+        Check a bytes line that blocks a domain against the index
+
+        Returns the covering allow entry (and counts the removal), or None
+        for lines to keep, including lines that do not plainly block a domain.
+        """
+        if not self._index:
+            return None
+        domain = blocked_domain(line.decode(PROCESSING['encoding'], PROCESSING['errors']))
+        if domain is None:
+            return None
+        entry = self.match(domain)
+        if entry is not None:
+            self.removed[entry] += 1
+        return entry
+
+    def report(self, log_callback, top=10):
+        """Log the number of removed lines and the entries that removed most"""
+        if not log_callback:
+            return
+        log_callback(f"Allowlist removed {sum(self.removed.values()):,} lines "
+                     f"({len(self._index):,} allowed domains)")
+        for entry, count in self.removed.most_common(top):
+            log_callback(f"  - {entry}: {count:,}")
+
+
+def load_allowlist(files, log_callback=None):
+    """Build an Allowlist from allowlist files"""
+    allowlist = Allowlist()
+    for filepath in files or ():
+        added = allowlist.load(filepath)
+        if log_callback:
+            log_callback(f"Loaded {added:,} allowlist entries from {os.path.basename(filepath)}")
+    return allowlist
+
+
+def collect_exceptions(filepath, allowlist):
+    """Add every @@ exception of a file to allowlist, returns the number added"""
+    added = 0
+    for lines, _ in iter_line_batches(filepath):
+        for line in lines:
+            stripped = strip_line(line)
+            if stripped[:2] == b'@@' and allowlist.add_exception(
+                    stripped.decode(PROCESSING['encoding'], PROCESSING['errors'])):
+                added += 1
+    return added
+
+
+def filter_file(filepath, allowlist):
+    """
+    Rewrite a file without the lines the allowlist covers
+
+    Used to compact an output when exceptions only turned up after the
+    lines they cover had been written.
+
+    Returns:
+        tuple: (kept_lines, removed_lines)
+    """
+    temp_path = filepath + '.allow.tmp'
+    removed = 0
+    with LineWriter(temp_path, compression=compression_for_path(filepath)) as outfile:
+        for lines, _ in iter_line_batches(filepath):
+            for line in lines:
+                stripped = strip_line(line)
+                if not stripped:
+                    continue
+                if allowlist.allows(stripped) is not None:
+                    removed += 1
+                else:
+                    outfile.write(stripped)
+    os.replace(temp_path, filepath)
+    return outfile.lines_written, removed
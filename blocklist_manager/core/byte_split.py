@@ -0,0 +1,173 @@
+"""
+Byte-size split
+Part boundaries are put on the last newline before each size limit, found
+with rfind on a memory map, so no line is parsed. A thread pool then writes
+each part's header and copies its byte range inside the kernel
+(os.copy_file_range, else os.sendfile, else large buffered reads, which is
+what Windows uses).
+A compressed input is first decompressed to a temp file in the output folder.
+"""
+
+import os
+import mmap
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from config.settings import PROCESSING
+from utils.lineio import encode_text_block
+from utils.compression import detect_compression, open_input
+
+# Raw descriptors must not translate line endings (Windows text mode)
+O_BINARY = getattr(os, 'O_BINARY', 0)
+
+
+def plan_parts(filepath, limit):
+    """
+    Cut a file into (start, end) byte ranges of at most limit bytes that
+    end right after a newline
+
+    A line longer than limit gets a part of its own.
+    """
+    size = os.path.getsize(filepath)
+    if size == 0:
+        return []
+    ranges = []
+    with open(filepath, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            start = 0
+            while start < size:
+                if size - start <= limit:
+                    ranges.append((start, size))
+                    break
+                cut = mapped.rfind(b'\n', start, start + limit)
+                if cut < 0:
+                    cut = mapped.find(b'\n', start + limit)
+                    if cut < 0:
+                        cut = size - 1
+                ranges.append((start, cut + 1))
+                start = cut + 1
+    return ranges
+
+
+def copy_range(src_fd, dst_fd, offset, count):
+    """Append count bytes read at offset of src_fd to dst_fd, in the kernel where possible"""
+    end = offset + count
+    for copy in (_copy_file_range, _sendfile):
+        try:
+            while offset < end:
+                copied = copy(src_fd, dst_fd, offset, end - offset)
+                if not copied:
+                    break
+                offset += copied
+        except (AttributeError, OSError):
+            continue  # not available here, or not between these files
+        if offset >= end:
+            return
+
+    buffer_size = PROCESSING['chunk_size']
+    os.lseek(src_fd, offset, os.SEEK_SET)
+    while offset < end:
+        data = os.read(src_fd, min(buffer_size, end - offset))
+        if not data:
+            raise OSError(f"Unexpected end of file at offset {offset}")
+        os.write(dst_fd, data)
+        offset += len(data)
+
+
+def _copy_file_range(src_fd, dst_fd, offset, count):
+    return os.copy_file_range(src_fd, dst_fd, count, offset)
+
+
+def _sendfile(src_fd, dst_fd, offset, count):
+    return os.sendfile(dst_fd, src_fd, offset, count)
+
+
+def part_header(base_name, part_number, parts_total, part_bytes, source_name):
+    """Header block of a byte-split part"""
+    return encode_text_block([
+        f"# {base_name} - Part {part_number} of {parts_total}",
+        f"# Generated from: {source_name}",
+        f"# Size: {part_bytes:,} bytes",
+        "",
+    ])
+
+
+def _write_part(input_file, output_path, header, start, end):
+    """Worker: write a header and copy [start, end) of input_file after it"""
+    src_fd = os.open(input_file, os.O_RDONLY | O_BINARY)
+    try:
+        dst_fd = os.open(output_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | O_BINARY, 0o644)
+        try:
+            os.write(dst_fd, header)
+            copy_range(src_fd, dst_fd, start, end - start)
+        finally:
+            os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+
+
+def split_by_bytes(input_file, output_folder, base_name, max_bytes, workers=None,
+                   progress_callback=None, log_callback=None):
+    """
+    Split a file into parts of at most max_bytes, header included
+
+    Lines are copied as they are (no whitespace or line ending changes).
+    Part sizes of a compressed input are those of the decompressed text.
+
+    Args:
+        input_file: Text file to split, optionally gzip/xz/bz2 compressed
+        output_folder: Folder for <base_name>_partNNN.txt parts
+        base_name: Part file prefix
+        max_bytes: Size limit per part file
+        workers: Copy threads (default: PROCESSING['workers'] or CPU count)
+        progress_callback: Function(percent, status_message) for progress
+        log_callback: Function(message) for log updates
+
+    Returns:
+        list: (output_path, bytes) per part
+    """
+    source_name = os.path.basename(input_file)
+    if not detect_compression(input_file):
+        return _split_file(input_file, source_name, output_folder, base_name, max_bytes,
+                           workers, progress_callback, log_callback)
+
+    if log_callback:
+        log_callback(f"Decompressing {source_name}...")
+    fd, temp_path = tempfile.mkstemp(suffix='.split.tmp', dir=output_folder)
+    try:
+        with os.fdopen(fd, 'wb') as dst, open_input(input_file) as src:
+            shutil.copyfileobj(src, dst, PROCESSING['chunk_size'])
+        return _split_file(temp_path, source_name, output_folder, base_name, max_bytes,
+                           workers, progress_callback, log_callback)
+    finally:
+        os.remove(temp_path)
+
+
+def _split_file(input_file, source_name, output_folder, base_name, max_bytes,
+                workers, progress_callback, log_callback):
+    size = os.path.getsize(input_file)
+    # Widest possible header: every number at most the input size
+    header_room = len(part_header(base_name, size, size, size, source_name))
+    limit = max_bytes - header_room
+    if limit <= 0:
+        raise ValueError(f"Part size must be larger than the {header_room} byte header")
+
+    ranges = plan_parts(input_file, limit)
+    parts = []
+    for part_number, (start, end) in enumerate(ranges, 1):
+        output_path = os.path.join(output_folder, f"{base_name}_part{part_number:03d}.txt")
+        header = part_header(base_name, part_number, len(ranges), end - start, source_name)
+        parts.append((output_path, header, start, end))
+
+    workers = workers or PROCESSING['workers'] or os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(parts) or 1))) as pool:
+        futures = [pool.submit(_write_part, input_file, *part) for part in parts]
+        for done, future in enumerate(futures, 1):
+            future.result()
+            if log_callback:
+                log_callback(f"Created part {done}")
+            if progress_callback:
+                progress_callback(done / len(futures) * 100, f"Created {done}/{len(futures)} parts")
+
+    return [(output_path, len(header) + end - start)
+            for output_path, header, start, end in parts]
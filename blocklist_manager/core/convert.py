@@ -0,0 +1,178 @@
+"""
+Parallel directory conversion
+Every file matching a pattern in a directory tree is converted by a
+process pool, one file per task. Outputs keep their relative paths and are
+written to a temp file next to the target, then renamed over it, so a
+target is either the old or the complete new file.
+"""
+
+import os
+import glob
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from config.settings import PROCESSING, ALLOWLIST, DOMAIN_SET
+from core.pipeline import Pipeline, Normalize, Allow, FileSink, DomainSetSink
+from core.allowlist import filter_file
+from utils.helpers import ensure_directory, convert_adguard_to_pihole
+from utils.compression import compression_for_path, plain_name
+
+# Per-process conversion settings, set once by _init_worker
+_state = {}
+
+
+def find_files(source_dir, file_pattern="*.txt", exclude_dir=None):
+    """
+    Files matching file_pattern in source_dir and its subdirectories
+
+    Files under exclude_dir (an output folder inside source_dir) are left
+    out. Returns sorted paths relative to source_dir.
+    """
+    exclude = None
+    if exclude_dir and os.path.abspath(exclude_dir) != os.path.abspath(source_dir):
+        exclude = os.path.abspath(exclude_dir) + os.sep
+    found = []
+    for path in glob.glob(os.path.join(source_dir, "**", file_pattern), recursive=True):
+        if not os.path.isfile(path):
+            continue
+        if exclude and os.path.abspath(path).startswith(exclude):
+            continue
+        found.append(os.path.relpath(path, source_dir))
+    return sorted(found)
+
+
+def _init_worker(convert, allowlist, apply_exceptions, domain_set):
+    _state['convert'] = convert
+    _state['allowlist'] = allowlist
+    _state['apply_exceptions'] = apply_exceptions
+    _state['domain_set'] = domain_set
+
+
+def _convert_file(source_path, target_path):
+    """
+    Worker: convert one file to a temp file and rename it over target_path
+
+    Returns:
+        tuple: (lines_in, lines_out, removed Counter, seconds, error or None)
+    """
+    start = time.perf_counter()
+    temp_path = target_path + '.tmp'
+    domain_set = _state['domain_set']
+    try:
+        ensure_directory(os.path.dirname(target_path) or '.')
+        allowlist = _state['allowlist']
+        if allowlist is not None:
+            # Own removal counts; exceptions of one file must not leak into the next one
+            allowlist = allowlist.copy(shared=not _state['apply_exceptions'])
+        if domain_set:
+            # The writer renames into place itself and applies late exceptions
+            stages = [Normalize(convert_adguard_to_pihole), DomainSetSink(target_path, allowlist)]
+        else:
+            stages = [Normalize(_state['convert']),
+                      FileSink(temp_path, compression=compression_for_path(target_path))]
+        allows = []
+        if allowlist is not None:
+            # After Normalize every line blocks one domain, also those of multi-name hosts lines
+            allows.append(Allow(allowlist, keep_exceptions=ALLOWLIST['keep_exceptions']))
+            stages.insert(1, allows[0])
+            if _state['apply_exceptions']:
+                # The converters drop @@ rules, so they are collected before converting
+                allows.append(Allow(allowlist, True, ALLOWLIST['keep_exceptions']))
+                stages.insert(0, allows[1])
+        lines_in, lines_out = Pipeline(*stages).run([source_path])
+        if not domain_set:
+            if any(allow.late for allow in allows):
+                lines_out, _ = filter_file(temp_path, allowlist)
+            os.replace(temp_path, target_path)
+        removed = allowlist.removed if allowlist is not None else Counter()
+        return lines_in, lines_out, removed, time.perf_counter() - start, None
+    except Exception as e:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return 0, 0, Counter(), time.perf_counter() - start, str(e)
+
+
+def convert_directory(source_dir, target_dir, convert, file_pattern="*.txt", workers=None,
+                      allowlist=None, apply_exceptions=False, domain_set=False,
+                      progress_callback=None, log_callback=None):
+    """
+    Convert every matching file of a directory tree into target_dir
+
+    Args:
+        source_dir: Folder searched recursively for input files
+        target_dir: Output folder, relative paths are kept (may equal source_dir)
+        convert: Per-line converter, a module-level function (str -> str or None)
+        file_pattern: Glob pattern of the files to convert
+        workers: Worker processes (default: PROCESSING['workers'] or CPU count)
+        allowlist: core.allowlist.Allowlist applied to every file, or None
+        apply_exceptions: Also drop domains allowed by the file's @@ rules
+        domain_set: Write binary domain sets (utils.domainset) named
+                    <name>DOMAIN_SET['extension'] instead of converting;
+                    they serve every format, so convert is not used
+        progress_callback: Function(percent, status_message) for progress
+        log_callback: Function(message) for log updates
+
+    Returns:
+        tuple: (files_converted, stats) with stats a list of
+               (relative_path, lines_in, lines_out, seconds, error or None)
+    """
+    ensure_directory(target_dir)
+    files = find_files(source_dir, file_pattern, exclude_dir=target_dir)
+    if not files:
+        if log_callback:
+            log_callback(f"No files matching '{file_pattern}' found in {source_dir}")
+        return 0, []
+
+    workers = workers or PROCESSING['workers'] or os.cpu_count() or 1
+    workers = max(1, min(workers, len(files)))
+    if log_callback:
+        log_callback(f"Converting {len(files)} files with {workers} workers")
+
+    targets = files
+    if domain_set:
+        targets = [os.path.join(os.path.dirname(path), plain_name(path)) + DOMAIN_SET['extension']
+                   for path in files]
+    jobs = [(os.path.join(source_dir, path), os.path.join(target_dir, target))
+            for path, target in zip(files, targets)]
+    init_args = (convert, allowlist, apply_exceptions, domain_set)
+    if workers == 1:
+        _init_worker(*init_args)
+        results = (_convert_file(*job) for job in jobs)
+        pool = None
+    else:
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                   initargs=init_args)
+        futures = [pool.submit(_convert_file, *job) for job in jobs]
+        results = (future.result() for future in futures)
+
+    stats = []
+    converted = 0
+    try:
+        for index, (path, result) in enumerate(zip(files, results), 1):
+            lines_in, lines_out, removed, seconds, error = result
+            stats.append((path, lines_in, lines_out, seconds, error))
+            if error:
+                if log_callback:
+                    log_callback(f"Error converting {path}: {error}")
+            else:
+                converted += 1
+                if allowlist is not None:
+                    allowlist.removed.update(removed)
+                if log_callback:
+                    log_callback(f"Converted {path}: {lines_in:,} -> {lines_out:,} lines "
+                                 f"({seconds:.2f}s)")
+            if progress_callback:
+                progress_callback(index / len(files) * 100,
+                                  f"Converted {index}/{len(files)} files")
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    if log_callback:
+        total_in = sum(stat[1] for stat in stats)
+        total_out = sum(stat[2] for stat in stats)
+        log_callback(f"Converted {converted}/{len(files)} files: "
+                     f"{total_in:,} -> {total_out:,} lines")
+        if allowlist is not None:
+            allowlist.report(log_callback, ALLOWLIST['report_top'])
+    return converted, stats
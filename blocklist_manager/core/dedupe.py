@@ -0,0 +1,676 @@
+"""
+Deduplication structures used by the core operations
+Lines are stripped bytes. All "seen" sets share one protocol: add(line)
+returns True when the caller should write the line now, flush(outfile)
+writes any deferred lines to a LineWriter and returns how many it wrote.
+Sets built with a key_func compare lines on key_func(line) instead of
+the line itself.
+"""
+
+import os
+import json
+import math
+import heapq
+import shutil
+import hashlib
+import tempfile
+import weakref
+from array import array
+from config.settings import PROCESSING, DEDUPE
+from utils.helpers import canonical_domain
+
+# Slots reinserted per read when a fingerprint table grows
+GROW_STEP = 1 << 16
+
+
+class ExactSet:
+    """Exact seen-set backed by a plain Python set of lines"""
+
+    def __init__(self, key_func=None):
+        self._items = set()
+        self._key = key_func
+
+    def add(self, line):
+        """Add a line, returns True if it was not seen before"""
+        if self._key:
+            line = self._key(line)
+        if line in self._items:
+            return False
+        self._items.add(line)
+        return True
+
+    def flush(self, outfile):
+        """Nothing is deferred, lines are written as they are added"""
+        return 0
+
+    def __contains__(self, line):
+        if self._key:
+            line = self._key(line)
+        return line in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+
+class FingerprintSet:
+    """
+    Compact seen-set storing line fingerprints instead of lines
+
+    Lines are hashed with BLAKE2b. The first 64 bits select the slot in an
+    open-addressing table (linear probing) held in a flat array('Q'), the
+    next 64 bits are kept in a parallel check array. Two different lines
+    sharing the same 64-bit slot key are told apart by the check word and
+    the newcomer is kept verbatim in a small exact overflow set, so the
+    result matches a plain set unless two lines collide on all 128 bits.
+
+    With bits=64 (the default) the check array is dropped (8 bytes per slot
+    instead of 16) and slot key collisions are treated as duplicates; for n
+    unique lines the chance of any such collision is about n^2 / 2^65
+    (2e-7 at 3 million lines).
+
+    With counted=True every add() of a line is counted in a parallel
+    array('I') (4 more bytes per slot) and release() drops one reference,
+    removing the line once none is left.
+    """
+
+    def __init__(self, bits=None, capacity=None, max_load=None, key_func=None, counted=False):
+        bits = bits or DEDUPE['fingerprint_bits']
+        if bits not in (64, 128):
+            raise ValueError(f"Unsupported fingerprint size: {bits} bits")
+
+        self.bits = bits
+        self.counted = counted
+        self.max_load = max_load or DEDUPE['max_load']
+        self._digest_size = bits // 8
+        self._key = key_func
+        self._overflow = {}  # line -> references
+        self._count = 0
+        self._allocate(capacity or DEDUPE['initial_capacity'])
+
+    def _allocate(self, capacity):
+        """Allocate empty tables with at least the given number of slots"""
+        size = 1
+        while size < capacity:
+            size <<= 1
+        self._mask = size - 1
+        self._limit = int(size * self.max_load)
+        self._keys = array('Q', [0]) * size
+        self._checks = array('Q', [0]) * size if self.bits == 128 else None
+        self._refs = array('I', [0]) * size if self.counted else None
+
+    def _tables(self):
+        """The allocated slot tables, keys first"""
+        return [table for table in (self._keys, self._checks, self._refs) if table is not None]
+
+    def _fingerprint(self, line):
+        """Return (slot_key, check) for a line; slot_key is never 0"""
+        digest = hashlib.blake2b(line, digest_size=self._digest_size).digest()
+        key = int.from_bytes(digest[:8], 'little') or 1
+        check = int.from_bytes(digest[8:], 'little') if self.bits == 128 else 0
+        return key, check
+
+    def _grow(self):
+        """
+        Double the table size and reinsert the stored fingerprints
+
+        The old tables are spilled to a temporary file and released before
+        the new ones are allocated, so the two are never in memory together.
+        """
+        size = self._mask + 1
+        with tempfile.TemporaryFile(dir=DEDUPE['temp_dir']) as spill:
+            offsets = []
+            for table in self._tables():
+                offsets.append((spill.tell(), table.typecode, table.itemsize))
+                table.tofile(spill)
+            self._keys = self._checks = self._refs = None
+            self._allocate(size * 2)
+
+            tables = self._tables()
+            keys = self._keys
+            mask = self._mask
+            for start in range(0, size, GROW_STEP):
+                count = min(GROW_STEP, size - start)
+                old_tables = []
+                for offset, typecode, itemsize in offsets:
+                    old = array(typecode)
+                    spill.seek(offset + itemsize * start)
+                    old.fromfile(spill, count)
+                    old_tables.append(old)
+                for index, key in enumerate(old_tables[0]):
+                    if not key:
+                        continue
+                    slot = key & mask
+                    while keys[slot]:
+                        slot = (slot + 1) & mask
+                    for table, old in zip(tables, old_tables):
+                        table[slot] = old[index]
+
+    def _find(self, key, check):
+        """Slot holding a slot key (its check word may still differ), or -1"""
+        keys = self._keys
+        mask = self._mask
+        slot = key & mask
+        while keys[slot]:
+            if keys[slot] == key:
+                return slot
+            slot = (slot + 1) & mask
+        return -1
+
+    def add(self, line):
+        """Add a line, returns True if it was not seen before"""
+        if self._key:
+            line = self._key(line)
+        key, check = self._fingerprint(line)
+        keys = self._keys
+        checks = self._checks
+        mask = self._mask
+
+        slot = key & mask
+        while True:
+            stored = keys[slot]
+            if not stored:
+                break
+            if stored == key:
+                if checks is None or checks[slot] == check:
+                    if self._refs is not None:
+                        self._refs[slot] += 1
+                    return False
+                # Slot key collision between different lines: resolve exactly
+                if line in self._overflow:
+                    if self.counted:
+                        self._overflow[line] += 1
+                    return False
+                self._overflow[line] = 1
+                self._count += 1
+                return True
+            slot = (slot + 1) & mask
+
+        keys[slot] = key
+        if checks is not None:
+            checks[slot] = check
+        if self._refs is not None:
+            self._refs[slot] = 1
+        self._count += 1
+        if self._count > self._limit:
+            # Drop the local references so _grow() can release the old tables
+            keys = checks = None
+            self._grow()
+        return True
+
+    def release(self, line):
+        """
+        Drop one reference to a line (counted sets only)
+
+        Returns True if no reference is left and the line was removed.
+        """
+        if not self.counted:
+            raise ValueError("release() needs a counted FingerprintSet")
+        if self._key:
+            line = self._key(line)
+        key, check = self._fingerprint(line)
+        slot = self._find(key, check)
+        if slot < 0:
+            return False
+        if self._checks is not None and self._checks[slot] != check:
+            references = self._overflow.get(line)
+            if references is None:
+                return False
+            if references > 1:
+                self._overflow[line] = references - 1
+                return False
+            del self._overflow[line]
+            self._count -= 1
+            return True
+
+        self._refs[slot] -= 1
+        if self._refs[slot]:
+            return False
+        self._count -= 1
+        # A line that collided with this one on the slot key takes its place
+        for other, references in self._overflow.items():
+            other_key, other_check = self._fingerprint(other)
+            if other_key == key:
+                del self._overflow[other]
+                self._checks[slot] = other_check
+                self._refs[slot] = references
+                return True
+        self._remove_slot(slot)
+        return True
+
+    def _remove_slot(self, slot):
+        """Empty a slot, shifting back later entries of its probe run (no tombstones)"""
+        tables = self._tables()
+        keys = self._keys
+        mask = self._mask
+        hole = slot
+        slot = (slot + 1) & mask
+        while keys[slot]:
+            # An entry may fill the hole unless its home slot lies after the hole
+            home = keys[slot] & mask
+            if (slot - home) & mask >= (slot - hole) & mask:
+                for table in tables:
+                    table[hole] = table[slot]
+                hole = slot
+            slot = (slot + 1) & mask
+        for table in tables:
+            table[hole] = 0
+
+    def flush(self, outfile):
+        """Nothing is deferred, lines are written as they are added"""
+        return 0
+
+    def __contains__(self, line):
+        if self._key:
+            line = self._key(line)
+        key, check = self._fingerprint(line)
+        slot = self._find(key, check)
+        if slot < 0:
+            return False
+        if self._checks is None or self._checks[slot] == check:
+            return True
+        return line in self._overflow
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def memory_bytes(self):
+        """Approximate memory used by the fingerprint tables"""
+        return sum(table.buffer_info()[1] * table.itemsize for table in self._tables())
+
+    def save(self, path):
+        """Write the tables to disk so a later run can continue from them"""
+        header = json.dumps({
+            'bits': self.bits,
+            'counted': self.counted,
+            'slots': self._mask + 1,
+            'count': self._count,
+            'max_load': self.max_load,
+        }).encode('utf-8')
+        with open(path, 'wb') as f:
+            f.write(len(header).to_bytes(4, 'little'))
+            f.write(header)
+            for table in self._tables():
+                table.tofile(f)
+            # Overflow lines are repeated once per reference
+            for line, references in self._overflow.items():
+                f.write((line + b'\n') * references)
+
+    @classmethod
+    def load(cls, path, key_func=None):
+        """Read tables written by save()"""
+        with open(path, 'rb') as f:
+            header = json.loads(f.read(int.from_bytes(f.read(4), 'little')))
+            seen = cls(bits=header['bits'], capacity=1, max_load=header['max_load'],
+                       key_func=key_func, counted=header.get('counted', False))
+            seen._mask = header['slots'] - 1
+            seen._limit = int(header['slots'] * seen.max_load)
+            seen._keys = array('Q')
+            seen._keys.fromfile(f, header['slots'])
+            if seen._checks is not None:
+                seen._checks = array('Q')
+                seen._checks.fromfile(f, header['slots'])
+            if seen._refs is not None:
+                seen._refs = array('I')
+                seen._refs.fromfile(f, header['slots'])
+            for line in f:
+                seen._overflow[line[:-1]] = seen._overflow.get(line[:-1], 0) + 1
+            seen._count = header['count']
+        return seen
+
+
+class ExternalDeduper:
+    """
+    Spill-to-disk deduper for inputs whose unique lines do not fit in RAM
+
+    Lines are kept in memory until the budget is reached. After that every
+    line is tagged with its sequence number and hash-partitioned into
+    temporary files. On flush each partition is deduplicated on its own
+    (partitions that still exceed the budget are split again with other
+    hash bits), and the per-partition results are k-way merged by sequence
+    number so the output keeps first-occurrence order. Without
+    preserve_order the partitions are written out one after another.
+    """
+
+    # Rough per-entry cost of a dict slot + key + (seq, line) on top of the line text
+    ENTRY_OVERHEAD = 180
+    MAX_DEPTH = 7
+
+    def __init__(self, memory_budget_mb=None, partitions=None,
+                 preserve_order=None, temp_dir=None, key_func=None):
+        self.memory_budget = int((memory_budget_mb or DEDUPE['memory_budget_mb']) * 1024 * 1024)
+        self.partitions = partitions or DEDUPE['partitions']
+        self.preserve_order = (DEDUPE['preserve_order'] if preserve_order is None
+                               else preserve_order)
+        self.temp_dir = temp_dir or DEDUPE['temp_dir']
+        self._key = key_func or (lambda line: line)
+
+        self._pending = {}  # key -> (sequence number, line) while everything fits
+        self._pending_bytes = 0
+        self._seq = 0
+        self._count = 0
+        self._work_dir = None
+        self._spill_files = None
+        self._cleanup = None
+
+    @property
+    def spilled(self):
+        """True once lines have been written to temporary partitions"""
+        return self._work_dir is not None
+
+    def _partition(self, key, depth):
+        """Partition index of a key at the given split depth"""
+        digest = hashlib.blake2b(key, digest_size=8).digest()
+        return (int.from_bytes(digest, 'little') >> (depth * 8)) % self.partitions
+
+    def _open_partitions(self, prefix):
+        """Create one spill file per partition"""
+        paths = [os.path.join(self._work_dir, f"{prefix}_{i:03d}.tmp")
+                 for i in range(self.partitions)]
+        files = [open(path, 'wb') for path in paths]
+        return paths, files
+
+    def _start_spilling(self):
+        """Move the in-memory lines to disk and spill everything after them"""
+        self._work_dir = tempfile.mkdtemp(prefix='blocklist_dedupe_', dir=self.temp_dir)
+        self._cleanup = weakref.finalize(self, shutil.rmtree, self._work_dir, True)
+        self._spill_paths, self._spill_files = self._open_partitions('p')
+
+        for key, (seq, line) in self._pending.items():
+            self._spill_files[self._partition(key, 0)].write(b"%d\t%b\n" % (seq, line))
+        self._pending = {}
+        self._pending_bytes = 0
+
+    def add(self, line):
+        """Record a line; output is deferred until flush(), returns False"""
+        seq = self._seq
+        self._seq += 1
+        key = self._key(line)
+
+        if self._spill_files is not None:
+            self._spill_files[self._partition(key, 0)].write(b"%d\t%b\n" % (seq, line))
+            return False
+
+        if key not in self._pending:
+            self._pending[key] = (seq, line)
+            self._pending_bytes += len(line) + self.ENTRY_OVERHEAD
+            if self._pending_bytes > self.memory_budget:
+                self._start_spilling()
+        return False
+
+    def _read_partition(self, path):
+        """Yield (seq, line) records from a spill file"""
+        with open(path, 'rb') as f:
+            for record in f:
+                seq, _, line = record[:-1].partition(b'\t')
+                yield int(seq), line
+
+    def _dedupe_partition(self, path, depth, outfile, runs):
+        """Deduplicate one spill file, splitting it further if it is too big"""
+        unique = {}
+        used = 0
+        for seq, line in self._read_partition(path):
+            key = self._key(line)
+            if key in unique:
+                continue
+            unique[key] = (seq, line)
+            used += len(line) + self.ENTRY_OVERHEAD
+            if used > self.memory_budget and depth < self.MAX_DEPTH:
+                break
+        else:
+            os.remove(path)
+            self._count += len(unique)
+            if not self.preserve_order:
+                for _, line in unique.values():
+                    outfile.write(line)
+                return
+
+            # Records arrive in sequence order, so dict order is a sorted run
+            run_path = path + '.run'
+            with open(run_path, 'wb') as run:
+                for seq, line in unique.values():
+                    run.write(b"%d\t%b\n" % (seq, line))
+            runs.append(run_path)
+            return
+
+        # Partition does not fit in the budget: split it with the next hash bits
+        unique = None
+        sub_paths, sub_files = self._open_partitions(
+            f"{os.path.splitext(os.path.basename(path))[0]}_{depth + 1}")
+        for seq, line in self._read_partition(path):
+            sub_files[self._partition(self._key(line), depth + 1)].write(b"%d\t%b\n" % (seq, line))
+        for f in sub_files:
+            f.close()
+        os.remove(path)
+
+        for sub_path in sub_paths:
+            self._dedupe_partition(sub_path, depth + 1, outfile, runs)
+
+    def flush(self, outfile):
+        """
+        Write the unique lines to outfile
+
+        Returns:
+            int: Number of unique lines written
+        """
+        if self._spill_files is None:
+            for _, line in self._pending.values():
+                outfile.write(line)
+            self._count = len(self._pending)
+            self._pending = {}
+            return self._count
+
+        for f in self._spill_files:
+            f.close()
+        self._spill_files = []
+
+        try:
+            runs = []
+            for path in self._spill_paths:
+                self._dedupe_partition(path, 0, outfile, runs)
+
+            if self.preserve_order:
+                for _, line in heapq.merge(*[self._read_partition(run) for run in runs]):
+                    outfile.write(line)
+        finally:
+            self._cleanup()
+
+        return self._count
+
+    def __len__(self):
+        return self._count
+
+
+class BloomFilter:
+    """
+    Approximate seen-set with a bounded memory footprint
+
+    A line is reported as new unless all of its bits are set, so duplicates
+    are always dropped but a small fraction of new lines are dropped too
+    (false positives). This is a split-block filter: a line hashes to one
+    256-bit block and sets one bit in each of its eight 32-bit lanes. The
+    block is read, OR-ed and written back as a single integer, and the lane
+    bits come from precomputed masks, so an insert costs one digest and a
+    handful of operations instead of k scattered bit updates.
+
+    The filter is sized for expected_lines at fp_rate (at most memory_mb);
+    without an estimate it takes memory_mb. The rate holds while the number
+    of unique lines stays below `capacity`.
+    """
+
+    BLOCK_BYTES = 32
+    LANES = 8
+    LANE_BITS = 32
+    MIN_BLOCKS = 1 << 10
+    # A 64-bit digest gives 40 lane bits and 24 block bits (512 MB at most)
+    MAX_BLOCKS = 1 << 24
+
+    # Recompute the current false-positive probability every N insertions
+    RATE_UPDATE_INTERVAL = 1024
+
+    # One mask per pair of lanes: 10 hash bits pick a bit in each of the two lanes
+    _PAIR_MASKS = tuple(
+        tuple((1 << (64 * pair + (bits & 31))) | (1 << (64 * pair + 32 + (bits >> 5)))
+              for bits in range(1024))
+        for pair in range(4))
+
+    def __init__(self, memory_mb=None, fp_rate=None, key_func=None, expected_lines=None):
+        memory_mb = memory_mb or DEDUPE['bloom_memory_mb']
+        self.fp_rate = fp_rate or DEDUPE['bloom_fp_rate']
+        max_blocks = min(self.MAX_BLOCKS,
+                         max(self.MIN_BLOCKS, int(memory_mb * 1024 * 1024) // self.BLOCK_BYTES))
+        # Lines per block the target rate allows
+        load = self._load_for_rate(self.fp_rate)
+
+        wanted = math.ceil(expected_lines / load) if expected_lines else max_blocks
+        blocks = self.MIN_BLOCKS
+        while blocks < wanted and blocks * 2 <= max_blocks:
+            blocks <<= 1
+        self.num_blocks = blocks
+        self.num_bits = blocks * self.BLOCK_BYTES * 8
+        self.num_hashes = self.LANES
+        self.capacity = int(load * blocks)
+
+        self._blocks = bytearray(blocks * self.BLOCK_BYTES)
+        self._block_mask = blocks - 1
+        self._key = key_func
+        self._count = 0
+        self._current_rate = 0.0
+        self._expected_false_drops = 0.0
+
+    @classmethod
+    def _rate_at_load(cls, load):
+        """False-positive rate with `load` lines per block on average (Poisson block loads)"""
+        rate = 0.0
+        probability = math.exp(-load)
+        lines = 0
+        while lines < 4 * load + 40:
+            lane_fill = 1 - (1 - 1 / cls.LANE_BITS) ** lines
+            rate += probability * lane_fill ** cls.LANES
+            lines += 1
+            probability *= load / lines
+        return rate
+
+    @classmethod
+    def _load_for_rate(cls, fp_rate):
+        """Highest lines per block that keeps the rate at or below fp_rate"""
+        low, high = 0.0, float(cls.BLOCK_BYTES * 8)
+        for _ in range(40):
+            middle = (low + high) / 2
+            if cls._rate_at_load(middle) <= fp_rate:
+                low = middle
+            else:
+                high = middle
+        return max(low, 1e-3)
+
+    def _locate(self, line):
+        """(byte offset of the block, lane mask) for a line"""
+        h = int.from_bytes(hashlib.blake2b(line, digest_size=8).digest(), 'little')
+        mask0, mask1, mask2, mask3 = self._PAIR_MASKS
+        lane_mask = (mask0[h & 1023] | mask1[h >> 10 & 1023]
+                     | mask2[h >> 20 & 1023] | mask3[h >> 30 & 1023])
+        return ((h >> 40) & self._block_mask) << 5, lane_mask
+
+    def add(self, line):
+        """Add a line, returns True if it was (probably) not seen before"""
+        if self._key:
+            line = self._key(line)
+        # Inlined _locate(): this is the per-line hot path
+        h = int.from_bytes(hashlib.blake2b(line, digest_size=8).digest(), 'little')
+        mask0, mask1, mask2, mask3 = self._PAIR_MASKS
+        offset = ((h >> 40) & self._block_mask) << 5
+        blocks = self._blocks
+        block = int.from_bytes(blocks[offset:offset + 32], 'little')
+        updated = (block | mask0[h & 1023] | mask1[h >> 10 & 1023]
+                   | mask2[h >> 20 & 1023] | mask3[h >> 30 & 1023])
+        if updated == block:
+            return False
+        blocks[offset:offset + 32] = updated.to_bytes(32, 'little')
+        self._count += 1
+        if self._count % self.RATE_UPDATE_INTERVAL == 0:
+            self._update_rate()
+        return True
+
+    def _update_rate(self):
+        # A new line is accepted with probability (1 - rate), so every
+        # accepted line stands for rate / (1 - rate) wrongly dropped ones
+        self._expected_false_drops += self.RATE_UPDATE_INTERVAL * self._drops_per_line()
+        self._current_rate = self.false_positive_rate
+
+    def _drops_per_line(self):
+        rate = self._current_rate
+        return rate / (1 - rate) if rate < 1 else 1.0
+
+    def flush(self, outfile):
+        """Nothing is deferred, lines are written as they are added"""
+        return 0
+
+    def __contains__(self, line):
+        if self._key:
+            line = self._key(line)
+        offset, lane_mask = self._locate(line)
+        block = int.from_bytes(self._blocks[offset:offset + self.BLOCK_BYTES], 'little')
+        return block | lane_mask == block
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def memory_bytes(self):
+        """Size of the filter"""
+        return len(self._blocks)
+
+    @property
+    def false_positive_rate(self):
+        """Probability that a new line is currently reported as seen"""
+        return self._rate_at_load(self._count / self.num_blocks)
+
+    @property
+    def expected_false_drops(self):
+        """Expected number of unique lines wrongly dropped so far"""
+        pending = self._count % self.RATE_UPDATE_INTERVAL
+        return self._expected_false_drops + pending * self._drops_per_line()
+
+
+DEDUPE_MODES = {
+    'exact': ExactSet,
+    'fingerprint': FingerprintSet,
+    'external': ExternalDeduper,
+    'approximate': BloomFilter,
+}
+
+
+def domain_key(line):
+    """Dedupe key for a bytes line: its normalized blocked domain or the line itself"""
+    domain = canonical_domain(line.decode(PROCESSING['encoding'], PROCESSING['errors']))
+    return domain.encode('ascii') if domain else line
+
+
+DEDUPE_KEYS = {
+    'line': None,
+    'domain': domain_key,
+}
+
+
+def create_seen_set(mode=None, key=None, expected_lines=None):
+    """
+    Create a seen-set for the given dedupe mode
+
+    Args:
+        mode: One of DEDUPE_MODES (default: DEDUPE['mode'])
+        key: One of DEDUPE_KEYS (default: DEDUPE['key']); 'domain' treats
+             rules blocking the same domain in any format as duplicates
+        expected_lines: Estimated input line count, sizes the approximate filter
+
+    Returns:
+        Object with add(line) -> bool, flush(outfile) -> int and len()
+    """
+    mode = mode or DEDUPE['mode']
+    key = key or DEDUPE['key']
+    if mode not in DEDUPE_MODES:
+        raise ValueError(f"Unknown dedupe mode: {mode}")
+    if key not in DEDUPE_KEYS:
+        raise ValueError(f"Unknown dedupe key: {key}")
+    if mode == 'approximate':
+        return BloomFilter(key_func=DEDUPE_KEYS[key], expected_lines=expected_lines)
+    return DEDUPE_MODES[mode](key_func=DEDUPE_KEYS[key])
@@ -0,0 +1,270 @@
+"""
+Concurrent downloads
+GitHub listings and files are fetched by a thread pool. The calling thread
+schedules the requests and only starts one while fewer than the global and
+the per-host limit are in flight, so a slow host cannot hold every
+connection. Files are streamed to a temp file next to the target and
+renamed over it, so a failed download keeps the previous copy.
+
+With a DownloadCache, requests carry the ETag / Last-Modified of the last
+download as If-None-Match / If-Modified-Since; on 304 Not Modified the
+local file is kept as it is.
+"""
+
+import os
+import re
+import json
+import shutil
+import tempfile
+import urllib.error
+import urllib.request
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlsplit
+from config.settings import DOWNLOAD
+from utils.helpers import progress_percent
+
+LISTING = 'listing'
+FILE = 'file'
+
+
+def listing_task(name, api_url, dest_folder, file_pattern=".*"):
+    """Task: download the files of a GitHub contents listing matching file_pattern"""
+    return (LISTING, name, api_url, dest_folder, file_pattern)
+
+
+def file_task(name, url, output_path):
+    """Task: download url to output_path"""
+    return (FILE, name, url, output_path, None)
+
+
+class DownloadCache:
+    """
+    ETag / Last-Modified of earlier downloads, per URL, in a JSON file
+
+    An entry is only used while the local file still has the size and
+    modification time it had after the download, so a file that was
+    edited or deleted since is downloaded again. Listing entries also keep
+    the listed files, which a 304 response does not repeat.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == self.VERSION:
+                self.entries = data.get('entries', {})
+        except (OSError, ValueError):
+            pass
+
+    def conditional_headers(self, url, output_path=None):
+        """If-None-Match / If-Modified-Since headers for url, empty if it must be fetched"""
+        entry = self.entries.get(url)
+        if not entry:
+            return {}
+        if output_path is not None:
+            try:
+                stat = os.stat(output_path)
+            except OSError:
+                return {}
+            if stat.st_size != entry.get('size') or stat.st_mtime_ns != entry.get('mtime_ns'):
+                return {}
+        elif 'files' not in entry:
+            return {}
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def files(self, url):
+        """Files of the cached listing of url"""
+        return [tuple(item) for item in self.entries[url]['files']]
+
+    def store(self, url, response_headers, output_path=None, files=None):
+        """Remember the validators of a 200 response (forgets url if it sent none)"""
+        etag = response_headers.get('ETag')
+        last_modified = response_headers.get('Last-Modified')
+        if not etag and not last_modified:
+            self.entries.pop(url, None)
+            return
+        entry = {'etag': etag, 'last_modified': last_modified}
+        if output_path is not None:
+            stat = os.stat(output_path)
+            entry['size'] = stat.st_size
+            entry['mtime_ns'] = stat.st_mtime_ns
+        if files is not None:
+            entry['files'] = files
+        self.entries[url] = entry
+
+    def save(self):
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': self.VERSION, 'entries': self.entries}, f, indent=2)
+        os.replace(temp_path, self.path)
+
+
+def _open(url, headers, timeout):
+    """Response for url, or None on 304 Not Modified"""
+    req = urllib.request.Request(url, headers=headers)
+    try:
+        return urllib.request.urlopen(req, timeout=timeout)
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            e.close()
+            return None
+        raise
+
+
+def fetch_listing(api_url, file_pattern, headers, timeout):
+    """
+    Worker: (name, download_url) of the listed files whose name matches
+    file_pattern, and the response headers; (None, None) on 304
+    """
+    response = _open(api_url, headers, timeout)
+    if response is None:
+        return None, None
+    with response:
+        data = json.loads(response.read().decode('utf-8'))
+    files = [(f['name'], f['download_url']) for f in data if re.match(file_pattern, f['name'])]
+    return files, response.headers
+
+
+def fetch_file(url, output_path, headers, timeout):
+    """Worker: stream url into output_path; (bytes written, response headers), (None, None) on 304"""
+    response = _open(url, headers, timeout)
+    if response is None:
+        return None, None
+    fd, temp_path = tempfile.mkstemp(suffix='.part', dir=os.path.dirname(output_path) or '.')
+    try:
+        with response, os.fdopen(fd, 'wb') as f:
+            shutil.copyfileobj(response, f, DOWNLOAD['chunk_size'])
+            size = f.tell()
+        os.replace(temp_path, output_path)
+        return size, response.headers
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def _run(task, headers, timeout):
+    kind, _, url, target, pattern = task
+    if kind == LISTING:
+        return fetch_listing(url, pattern, headers, timeout)
+    return fetch_file(url, target, headers, timeout)
+
+
+def _host(url):
+    return urlsplit(url).netloc.lower()
+
+
+def download_all(tasks, max_concurrent=None, per_host=None, headers=None, cache=None,
+                 progress_callback=None, log_callback=None):
+    """
+    Run download tasks concurrently
+
+    A failed listing or file is logged and skipped; it does not stop the
+    other downloads. The cache is updated and saved at the end.
+
+    Args:
+        tasks: listing_task() and file_task() tuples
+        max_concurrent: Requests in flight (default: DOWNLOAD['max_concurrent'])
+        per_host: Requests in flight per host (default: DOWNLOAD['per_host'])
+        headers: HTTP headers sent with every request
+        cache: DownloadCache for conditional requests, or None
+        progress_callback: Function(percent, status_message) for progress
+        log_callback: Function(message, file_name) for download updates
+
+    Returns:
+        tuple: (files_downloaded, files_unchanged, files_failed)
+    """
+    max_concurrent = max(1, int(max_concurrent or DOWNLOAD['max_concurrent']))
+    per_host = max(1, int(per_host or DOWNLOAD['per_host']))
+    headers = headers or {}
+    timeout = DOWNLOAD['timeout']
+
+    queued = defaultdict(deque)   # host -> tasks waiting for a slot
+    active = defaultdict(int)     # host -> requests in flight
+    for task in tasks:
+        queued[_host(task[2])].append(task)
+    listings_left = sum(1 for task in tasks if task[0] == LISTING)
+    files_total = len(tasks) - listings_left
+    downloaded = 0
+    unchanged = 0
+    failed = 0
+
+    with ThreadPoolExecutor(max_workers=max_concurrent) as pool:
+        running = {}
+
+        def start_ready():
+            for host, waiting in queued.items():
+                while waiting and active[host] < per_host and len(running) < max_concurrent:
+                    task = waiting.popleft()
+                    active[host] += 1
+                    if log_callback and task[0] == FILE:
+                        log_callback(f"Downloading {task[1]}...", task[1])
+                    request_headers = headers
+                    if cache is not None:
+                        output_path = task[3] if task[0] == FILE else None
+                        request_headers = {**headers,
+                                           **cache.conditional_headers(task[2], output_path)}
+                    running[pool.submit(_run, task, request_headers, timeout)] = task
+
+        start_ready()
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                task = running.pop(future)
+                kind, name, url, target, _ = task
+                active[_host(url)] -= 1
+                try:
+                    result, response_headers = future.result()
+                    if result is None:
+                        result = cache.files(url) if kind == LISTING else None
+                    elif cache is not None:
+                        if kind == LISTING:
+                            cache.store(url, response_headers, files=result)
+                        else:
+                            cache.store(url, response_headers, output_path=target)
+                except Exception as e:
+                    if kind == LISTING:
+                        listings_left -= 1
+                        if log_callback:
+                            log_callback(f"Error with {name}: {str(e)}", None)
+                    else:
+                        failed += 1
+                        if log_callback:
+                            log_callback(f"Error downloading {name}: {str(e)}", None)
+                    continue
+
+                if kind == LISTING:
+                    listings_left -= 1
+                    files_total += len(result)
+                    if log_callback:
+                        state = " (listing unchanged)" if response_headers is None else ""
+                        log_callback(f"Found {len(result)} files in {name}{state}", None)
+                    for file_name, download_url in result:
+                        queued[_host(download_url)].append(
+                            file_task(file_name, download_url, os.path.join(target, file_name)))
+                else:
+                    if result is None:
+                        unchanged += 1
+                        status = f"{name} unchanged"
+                    else:
+                        downloaded += 1
+                        status = f"Downloaded {name}"
+                    if progress_callback:
+                        expected = files_total + listings_left * DOWNLOAD['listing_estimate']
+                        done_files = downloaded + unchanged + failed
+                        percent = min(progress_percent(done_files, expected), 99)
+                        progress_callback(percent, status)
+            start_ready()
+
+    if cache is not None:
+        cache.save()
+    return downloaded, unchanged, failed
@@ -0,0 +1,85 @@
+"""
+External merge sort for text or bytes records
+Records that do not fit in the memory budget are sorted in chunks, spilled
+to temporary run files and merged back with a heap
+"""
+
+import os
+import heapq
+import shutil
+import tempfile
+from config.settings import DEDUPE
+
+# Rough per-record cost of a list slot + str object on top of the text
+RECORD_OVERHEAD = 60
+
+
+def _write_run(records, work_dir, run_index):
+    """Sort a chunk of records and write it as a run file"""
+    records.sort()
+    path = os.path.join(work_dir, f"run_{run_index:05d}.tmp")
+    if isinstance(records[0], bytes):
+        with open(path, 'wb') as f:
+            f.writelines(record + b'\n' for record in records)
+    else:
+        with open(path, 'w', encoding='utf-8', newline='\n') as f:
+            f.writelines(record + '\n' for record in records)
+    return path
+
+
+def _read_run(path, binary):
+    if binary:
+        with open(path, 'rb') as f:
+            for record in f:
+                yield record[:-1]
+    else:
+        with open(path, 'r', encoding='utf-8', newline='\n') as f:
+            for record in f:
+                yield record[:-1]
+
+
+def sort_records(records, memory_budget_mb=None, temp_dir=None):
+    """
+    Sort string records (without newlines) in bounded memory
+
+    Args:
+        records: Iterable of str records, or of bytes records
+        memory_budget_mb: RAM used for in-memory chunks (default: DEDUPE['memory_budget_mb'])
+        temp_dir: Directory for run files (default: DEDUPE['temp_dir'])
+
+    Yields:
+        str or bytes: Records in ascending order
+    """
+    budget = int((memory_budget_mb or DEDUPE['memory_budget_mb']) * 1024 * 1024)
+    temp_dir = temp_dir or DEDUPE['temp_dir']
+
+    chunk = []
+    used = 0
+    runs = []
+    work_dir = None
+    binary = False
+
+    try:
+        for record in records:
+            chunk.append(record)
+            used += len(record) + RECORD_OVERHEAD
+            if used > budget:
+                if work_dir is None:
+                    work_dir = tempfile.mkdtemp(prefix='blocklist_sort_', dir=temp_dir)
+                    binary = isinstance(record, bytes)
+                runs.append(_write_run(chunk, work_dir, len(runs)))
+                chunk = []
+                used = 0
+
+        if not runs:
+            chunk.sort()
+            yield from chunk
+            return
+
+        if chunk:
+            runs.append(_write_run(chunk, work_dir, len(runs)))
+            chunk = []
+        yield from heapq.merge(*[_read_run(run, binary) for run in runs])
+    finally:
+        if work_dir is not None:
+            shutil.rmtree(work_dir, ignore_errors=True)
@@ -0,0 +1,446 @@
+"""
+Incremental merge + deduplicate
+A manifest next to the merged output remembers every source file (size,
+mtime, content hash) together with a cache of the lines it contributed and
+the fingerprint index of the output, which counts per key the sources that
+have it. A re-run only reads the source files that were added or changed
+since the last merge and patches the output for them
+"""
+
+import os
+import json
+import hashlib
+from config.settings import PROCESSING, DEDUPE
+from core.dedupe import FingerprintSet, DEDUPE_KEYS
+from core.pipeline import Allow
+from utils.helpers import ensure_directory
+from utils.lineio import LineWriter, iter_line_batches, strip_line
+from utils.compression import compression_for_path
+from utils.rules import split_hosts_lines
+
+INDEX_VERSION = 3
+
+
+def index_dir_for(output_file):
+    """Directory holding the manifest and caches for a merged output"""
+    return output_file + '.index'
+
+
+def _manifest_path(index_dir):
+    return os.path.join(index_dir, 'manifest.json')
+
+
+def _seen_path(index_dir):
+    return os.path.join(index_dir, 'seen.idx')
+
+
+def _cache_path(index_dir, path):
+    name = hashlib.sha1(path.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(index_dir, f"{name}.lines")
+
+
+def _load_manifest(index_dir, output_file, dedupe_key, split_hosts):
+    """Return the previous manifest if it still describes output_file"""
+    try:
+        with open(_manifest_path(index_dir), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        stat = os.stat(output_file)
+    except (OSError, ValueError):
+        return None
+
+    if manifest.get('version') != INDEX_VERSION or manifest.get('dedupe_key') != dedupe_key:
+        return None
+    if manifest.get('split_hosts', False) != split_hosts:
+        return None
+    # The output must not have been modified by anything else since
+    if (stat.st_size != manifest.get('output_size') or
+            stat.st_mtime_ns != manifest.get('output_mtime_ns')):
+        return None
+    if not os.path.exists(_seen_path(index_dir)):
+        return None
+    return manifest
+
+
+def _save_manifest(index_dir, output_file, manifest):
+    stat = os.stat(output_file)
+    manifest['output_size'] = stat.st_size
+    manifest['output_mtime_ns'] = stat.st_mtime_ns
+    temp_path = _manifest_path(index_dir) + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(temp_path, _manifest_path(index_dir))
+
+
+def stamp_output(output_file, unique_lines):
+    """Record the state of output_file after it was post-processed (e.g. pruned)"""
+    index_dir = index_dir_for(output_file)
+    try:
+        with open(_manifest_path(index_dir), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return
+    manifest['unique_lines'] = unique_lines
+    _save_manifest(index_dir, output_file, manifest)
+
+
+def _scan_source(filepath, cache_path, key_func, split_hosts):
+    """
+    Read a source file once: hash its content and cache the lines it
+    contributes (stripped, non-empty, first occurrence per key)
+
+    Returns:
+        tuple: (sha256_hex, total_lines, @@ exception rules of the file)
+    """
+    digest = hashlib.sha256()
+    total_lines = 0
+    seen = set()
+    exceptions = []
+    temp_path = cache_path + '.tmp'
+
+    with open(temp_path, 'wb') as cache:
+        for lines, _ in iter_line_batches(filepath):
+            digest.update(b'\n'.join(lines) + b'\n')
+            total_lines += len(lines)
+            stripped_lines = [stripped for stripped in map(strip_line, lines) if stripped]
+            if split_hosts:
+                stripped_lines = split_hosts_lines(stripped_lines)
+            for stripped in stripped_lines:
+                key = key_func(stripped) if key_func else stripped
+                if key not in seen:
+                    seen.add(key)
+                    cache.write(stripped + b'\n')
+                    if stripped[:2] == b'@@':
+                        exceptions.append(stripped.decode(PROCESSING['encoding'],
+                                                          PROCESSING['errors']))
+
+    os.replace(temp_path, cache_path)
+    return digest.hexdigest(), total_lines, exceptions
+
+
+def _append_cached(cache_path, seen, outfile, allow=None):
+    """
+    Count the lines of a cache in seen and write those with a key not seen
+    before (through allow, if given), returns the number written
+
+    Allowed lines are counted as well, so seen holds the references of
+    every cached line whether it reached the output or not.
+    """
+    written = 0
+    for lines, _ in iter_line_batches(cache_path):
+        lines = [stripped for stripped in lines if seen.add(stripped)]
+        if allow is not None:
+            lines = allow.apply(lines)
+        outfile.write_many(lines)
+        written += len(lines)
+    return written
+
+
+def _release_cached(cache_paths, seen, key_func):
+    """
+    Drop the references of outdated caches from seen
+
+    Returns:
+        tuple: (keys no source has any more,
+                cached lines whose key other sources still have; only
+                collected with a key_func, the line is the key otherwise,
+                True if a ||parent^ rule is among either)
+    """
+    gone = set()
+    stale = set()
+    parents = False
+    for cache_path in cache_paths:
+        for lines, _ in iter_line_batches(cache_path):
+            for line in lines:
+                stripped = strip_line(line)
+                if not stripped:
+                    continue
+                if seen.release(stripped):
+                    gone.add(key_func(stripped) if key_func else stripped)
+                elif key_func:
+                    stale.add(stripped)
+                else:
+                    continue
+                parents = parents or stripped[:2] == b'||'
+    return gone, stale, parents
+
+
+def _drop_lines(output_file, gone, stale, key_func):
+    """
+    Rewrite the output without the lines of gone keys and the stale lines
+
+    Returns:
+        tuple: (lines dropped, keys of the stale lines dropped)
+    """
+    temp_path = output_file + '.patch.tmp'
+    dropped = 0
+    orphans = set()
+    with LineWriter(temp_path, compression=compression_for_path(output_file)) as outfile:
+        for lines, _ in iter_line_batches(output_file):
+            kept = []
+            for line in lines:
+                stripped = strip_line(line)
+                if not stripped:
+                    continue
+                key = key_func(stripped) if key_func else stripped
+                if key in gone:
+                    dropped += 1
+                elif stripped in stale:
+                    orphans.add(key)
+                    dropped += 1
+                else:
+                    kept.append(stripped)
+            outfile.write_many(kept)
+    os.replace(temp_path, output_file)
+    return dropped, orphans
+
+
+def _append_orphans(cache_paths, orphans, key_func, outfile, allow=None):
+    """
+    Write the first cached line of each orphaned key, returns the number written
+
+    An orphaned key is still in some source, but the line the output had
+    for it came from a source that changed or was removed.
+    """
+    written = 0
+    for cache_path in cache_paths:
+        if not orphans:
+            break
+        for lines, _ in iter_line_batches(cache_path):
+            found = []
+            for stripped in lines:
+                key = key_func(stripped)
+                if key in orphans:
+                    orphans.discard(key)
+                    found.append(stripped)
+            if allow is not None:
+                found = allow.apply(found)
+            outfile.write_many(found)
+            written += len(found)
+    return written
+
+
+def _exceptions_of(entries):
+    """The @@ rules of manifest entries"""
+    return {rule for entry in entries for rule in entry['exceptions']}
+
+
+def file_digests(files):
+    """[path, sha256] of files (allowlists...) whose content an output depends on"""
+    digests = []
+    for filepath in files or ():
+        digest = hashlib.sha256()
+        with open(filepath, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        digests.append([os.path.abspath(filepath), digest.hexdigest()])
+    return digests
+
+
+def _patch(index_dir, output_file, unique_lines, entries, changed, outdated, key_func,
+           allow=None, prune=False, log_callback=None):
+    """
+    Update the output for added, changed and removed sources in place
+
+    seen counts per key the sources whose cache has it. The caches of new
+    or changed sources add references and their lines with new keys are
+    appended; the outdated caches release theirs, and the output only loses
+    the lines of keys no source has any more. With a key_func the lines of
+    a released cache are dropped as well and replaced by the first line of
+    the current sources with the same key.
+
+    Returns:
+        int: Unique lines of the output, or None if it has to be rebuilt
+             (a pruned output lost a ||parent^ rule, so the entries pruned
+             under it would have to come back)
+    """
+    seen = FingerprintSet.load(_seen_path(index_dir), key_func=key_func)
+    new_caches = [_cache_path(index_dir, entry['path'])
+                  for entry in entries if entry['path'] in changed]
+
+    if not outdated:
+        # Only new sources: their new keys go straight to the end of the output
+        with LineWriter(output_file, append=True) as outfile:
+            for cache_path in new_caches:
+                unique_lines += _append_cached(cache_path, seen, outfile, allow)
+        seen.save(_seen_path(index_dir))
+        return unique_lines
+
+    # Lines with new keys wait in a spill file until the dropped ones are gone
+    fresh_path = os.path.join(index_dir, 'fresh.tmp')
+    try:
+        with LineWriter(fresh_path) as fresh:
+            for cache_path in new_caches:
+                _append_cached(cache_path, seen, fresh, allow)
+        gone, stale, parents = _release_cached(outdated, seen, key_func)
+        if prune and parents:
+            return None
+
+        orphans = set()
+        if gone or stale:
+            dropped, orphans = _drop_lines(output_file, gone, stale, key_func)
+            unique_lines -= dropped
+            if log_callback:
+                log_callback(f"Dropped {dropped:,} lines of changed or removed sources")
+
+        with LineWriter(output_file, append=True) as outfile:
+            with open(fresh_path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    outfile.write_raw(block)
+            unique_lines += fresh.lines_written
+            if orphans:
+                current = [_cache_path(index_dir, entry['path']) for entry in entries]
+                unique_lines += _append_orphans(current, orphans, key_func, outfile, allow)
+    finally:
+        if os.path.exists(fresh_path):
+            os.remove(fresh_path)
+
+    seen.save(_seen_path(index_dir))
+    return unique_lines
+
+
+def incremental_merge(files, output_file, dedupe_key=None, split_hosts=False, allow=None,
+                      options=None, progress_callback=None, log_callback=None):
+    """
+    Merge and deduplicate files, reusing the index of the previous run
+
+    Unchanged sources (same size and mtime, or same content hash) are not
+    read at all. For added, changed or removed sources the output is
+    patched in place from per-key reference counts (see _patch()); the
+    output is rebuilt from the per-file caches on the first run, when
+    options differ from the last run, when exceptions of removed sources
+    are lost, or when a pruned output loses a ||parent^ rule.
+
+    Args:
+        files: Ordered list of input file paths
+        output_file: Path to the merged output
+        dedupe_key: One of DEDUPE_KEYS (default: DEDUPE['key'])
+        split_hosts: Give every domain of a multi-name hosts line its own line
+        allow: core.pipeline.Allow stage run on the cached lines before they
+               are written. The exceptions it collects are taken from the
+               manifest up front; allow.late is set when a patch brings
+               exceptions for lines already written
+        options: JSON-serializable settings the caller post-processes the
+                 output with, e.g. {'prune': True, 'allowlist': file_digests(...)};
+                 recorded in the manifest, 'prune' is also read here
+        progress_callback: Function(percent, status_message) for progress
+        log_callback: Function(message) for log updates
+
+    Returns:
+        tuple: (total_lines, unique_lines)
+    """
+    dedupe_key = dedupe_key or DEDUPE['key']
+    key_func = DEDUPE_KEYS[dedupe_key]
+    options = options or {}
+    index_dir = ensure_directory(index_dir_for(output_file))
+
+    manifest = _load_manifest(index_dir, output_file, dedupe_key, split_hosts)
+    previous = {entry['path']: entry for entry in manifest['files']} if manifest else {}
+
+    # Refresh the manifest entries, reading only new or modified files
+    entries = []
+    changed = set()
+    outdated = []  # caches of the previous run that no longer describe a source
+    for done, filepath in enumerate(files, 1):
+        path = os.path.abspath(filepath)
+        stat = os.stat(path)
+        cache_path = _cache_path(index_dir, path)
+        old = previous.get(path)
+
+        old_cache = None
+        if old and os.path.exists(cache_path):
+            if old['size'] == stat.st_size and old['mtime_ns'] == stat.st_mtime_ns:
+                entries.append(old)
+                continue
+            # Keep the old cache until its references have been released
+            old_cache = cache_path + '.old'
+            os.replace(cache_path, old_cache)
+
+        sha256, lines, exceptions = _scan_source(path, cache_path, key_func, split_hosts)
+        entries.append({'path': path, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                        'sha256': sha256, 'lines': lines, 'exceptions': exceptions})
+        if old_cache is not None:
+            if old['sha256'] == sha256:
+                os.remove(old_cache)
+            else:
+                outdated.append(old_cache)
+        if not old or old['sha256'] != sha256:
+            changed.add(path)
+            if log_callback:
+                state = "Changed" if old else "Added"
+                log_callback(f"{state}: {os.path.basename(path)} ({lines:,} lines)")
+
+        if progress_callback:
+            progress_callback(done / len(files) * 50, f"Checked {done}/{len(files)} files...")
+
+    current = [entry['path'] for entry in entries]
+    removed = [path for path in previous if path not in set(current)]
+    for path in removed:
+        if log_callback:
+            log_callback(f"Removed: {os.path.basename(path)}")
+        if os.path.exists(_cache_path(index_dir, path)):
+            outdated.append(_cache_path(index_dir, path))
+
+    total_lines = sum(entry['lines'] for entry in entries)
+
+    # Exceptions are known up front, so the stage itself collects none
+    filter_stage = None
+    collect = allow is not None and allow.collect_exceptions
+    if allow is not None:
+        filter_stage = Allow(allow.allowlist, keep_exceptions=allow.keep_exceptions)
+    if collect:
+        for rule in sorted(_exceptions_of(entries)):
+            allow.allowlist.add_exception(rule)
+
+    unique_lines = None
+    try:
+        if manifest and manifest.get('options', {}) != options:
+            if log_callback:
+                log_callback("Output settings changed since the last run")
+        elif collect and _exceptions_of(previous.values()) - _exceptions_of(entries):
+            # Lines a lost exception removed would have to come back
+            if log_callback:
+                log_callback("Exceptions of changed or removed sources are gone")
+        elif manifest and not changed and not removed:
+            if log_callback:
+                log_callback("No source changes, output is up to date")
+            unique_lines = manifest['unique_lines']
+        elif manifest:
+            if log_callback:
+                log_callback(f"Patching the output ({len(changed)} added or changed, "
+                             f"{len(removed)} removed)")
+            unique_lines = _patch(index_dir, output_file, manifest['unique_lines'], entries,
+                                  changed, outdated, key_func, filter_stage,
+                                  options.get('prune', False), log_callback)
+            # New exceptions may cover lines the output already had
+            if (unique_lines is not None and collect
+                    and _exceptions_of(entries) - _exceptions_of(previous.values())):
+                allow.late = True
+
+        if unique_lines is None:
+            if log_callback:
+                log_callback(f"Rebuilding output from cache ({len(current)} files)")
+            seen = FingerprintSet(key_func=key_func, counted=True)
+            unique_lines = 0
+            with LineWriter(output_file) as outfile:
+                for done, path in enumerate(current, 1):
+                    unique_lines += _append_cached(_cache_path(index_dir, path), seen, outfile,
+                                                   filter_stage)
+                    if progress_callback:
+                        progress_callback(50 + done / len(current) * 50,
+                                          f"Merged {done}/{len(current)} cached files...")
+            seen.save(_seen_path(index_dir))
+    finally:
+        for cache_path in outdated:
+            if os.path.exists(cache_path):
+                os.remove(cache_path)
+
+    _save_manifest(index_dir, output_file, {
+        'version': INDEX_VERSION,
+        'dedupe_key': dedupe_key,
+        'split_hosts': split_hosts,
+        'options': options,
+        'files': entries,
+        'unique_lines': unique_lines,
+    })
+
+    return total_lines, unique_lines
@@ -0,0 +1,138 @@
+"""
+Parallel ordered file ingestion
+Input files are cut into byte ranges that a pool of readers loads and
+normalizes concurrently, while the caller consumes the results strictly in
+input order, so a single writer produces the same output as a sequential read.
+Compressed files cannot be cut into ranges; they are streamed in order by the
+consumer while the pool works ahead on the next files.
+"""
+
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from config.settings import PROCESSING
+from utils.lineio import strip_line, iter_line_batches
+from utils.domainset import DomainSet, is_domain_set
+from utils.compression import detect_compression, READ_ERRORS
+
+
+def _read_range(filepath, start, end):
+    """
+    Worker: load the lines starting inside [start, end) of a file
+
+    A line belongs to the range its first byte falls in, so the range is
+    read from start - 1 (to see whether a line starts at start) and the last
+    line is completed past end.
+
+    Domain-set files are cut the same way, by the blocks starting in the
+    range.
+
+    Returns:
+        tuple: (line_count, stripped non-empty lines, error_message)
+    """
+    try:
+        if is_domain_set(filepath):
+            with DomainSet(filepath) as domain_set:
+                domains = [domain for batch, _ in domain_set.iter_batches(start, end)
+                           for domain in batch]
+            return len(domains), domains, None
+        with open(filepath, 'rb') as f:
+            if start:
+                f.seek(start - 1)
+                data = f.read(end - start + 1)
+                cut = data.find(b'\n')
+                if cut < 0:
+                    return 0, [], None  # inside a line that started earlier
+                data = data[cut + 1:]
+            else:
+                data = f.read(end)
+            if data and not data.endswith(b'\n'):
+                data += f.readline()
+    except (OSError, ValueError) as e:
+        return 0, [], str(e)
+
+    if not data:
+        return 0, [], None
+    lines = (data[:-1] if data.endswith(b'\n') else data).split(b'\n')
+    stripped_lines = [stripped for stripped in map(strip_line, lines) if stripped]
+    return len(lines), stripped_lines, None
+
+
+def _submit(pool, task):
+    """Future for a range task, None for a failed or compressed (streamed) file"""
+    _, filepath, start, end, error = task
+    if error or start is None:
+        return None
+    return pool.submit(_read_range, filepath, start, end)
+
+
+def _stream_file(file_index, filepath, chunk_size):
+    """Yield ordered_ranges results for a whole compressed file, read in this thread"""
+    try:
+        for lines, bytes_read in iter_line_batches(filepath, chunk_size=chunk_size):
+            stripped_lines = [stripped for stripped in map(strip_line, lines) if stripped]
+            yield file_index, bytes_read, len(lines), stripped_lines, None
+    except READ_ERRORS as e:
+        yield file_index, 0, 0, [], str(e)
+
+
+def ordered_ranges(files, readers=None, processes=None, chunk_size=None):
+    """
+    Read and normalize files with a reader pool, yielding results in order
+
+    At most 2 * readers ranges are in flight, which bounds memory to about
+    that many chunks no matter how large the inputs are.
+
+    Args:
+        files: Ordered list of input file paths
+        readers: Pool size (default: PROCESSING['readers'], 0 = CPU count)
+        processes: Use worker processes instead of threads, for inputs where
+                   normalization rather than I/O is the bottleneck
+                   (default: PROCESSING['reader_processes'])
+        chunk_size: Bytes per range (default: PROCESSING['chunk_size'])
+
+    Yields:
+        tuple: (file_index, bytes_read, line_count, stripped_lines, error_message)
+               with bytes_read counted within the file
+    """
+    readers = readers or PROCESSING['readers'] or os.cpu_count() or 1
+    if processes is None:
+        processes = PROCESSING['reader_processes']
+    chunk_size = chunk_size or PROCESSING['chunk_size']
+
+    tasks = []
+    for file_index, filepath in enumerate(files):
+        try:
+            size = os.path.getsize(filepath)
+        except OSError as e:
+            tasks.append((file_index, filepath, 0, 0, str(e)))
+            continue
+        if detect_compression(filepath):
+            tasks.append((file_index, filepath, None, size, None))
+            continue
+        for start in range(0, size, chunk_size):
+            tasks.append((file_index, filepath, start, min(start + chunk_size, size), None))
+
+    executor = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    with executor(max_workers=readers) as pool:
+        pending = deque()
+        task_iter = iter(tasks)
+        for task in task_iter:
+            pending.append((task, _submit(pool, task)))
+            if len(pending) >= 2 * readers:
+                break
+
+        while pending:
+            (file_index, filepath, start, end, error), future = pending.popleft()
+            # Refill the window before blocking on the oldest range
+            for task in task_iter:
+                pending.append((task, _submit(pool, task)))
+                break
+            if error:
+                yield file_index, end, 0, [], error
+                continue
+            if future is None:
+                yield from _stream_file(file_index, filepath, chunk_size)
+                continue
+            line_count, stripped_lines, error = future.result()
+            yield file_index, end, line_count, stripped_lines, error
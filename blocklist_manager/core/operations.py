@@ -4,14 +4,80 @@ All functions support progress callbacks for UI updates
 """
 
 import os
-import json
-import urllib.request
-import urllib.error
-from config.settings import PROCESSING, GITHUB_SOURCES
-from utils.helpers import ensure_directory, is_comment, convert_adguard_to_pihole, convert_pihole_to_adguard
+from datetime import datetime
+from config.settings import PROCESSING, GITHUB_SOURCES, DEDUPE, ALLOWLIST, EXPORT, DOWNLOAD
+from utils.helpers import ensure_directory, convert_adguard_to_pihole, convert_pihole_to_adguard
+from utils.lineio import LineWriter
+from utils.formats import get_formats
+from utils.domainset import is_domain_set
+from utils.compression import plain_name
+from core.pipeline import (Pipeline, Strip, Clean, SplitHosts, Normalize, Allow, Dedupe, FileSink,
+                           SplitSink, FormatSink, DomainSetSink, ShardSink)
+from core.allowlist import load_allowlist, filter_file
+from core.convert import convert_directory
+from core.download import download_all, listing_task, file_task, DownloadCache
+from core.byte_split import split_by_bytes
+from core.parallel_dedupe import sharded_merge
+from core.sorted_merge import sorted_merge
+from core.prune import prune_subdomains
+from core.incremental import incremental_merge, stamp_output, file_digests
 
 
-def remove_duplicates(input_file, output_file, progress_callback=None, log_callback=None):
+def _is_sorted_mode(dedupe_mode, dedupe_key):
+    """True for the 'sorted' k-way merge mode, which only supports the 'line' key"""
+    if (dedupe_mode or DEDUPE['mode']) != 'sorted':
+        return False
+    if (dedupe_key or DEDUPE['key']) != 'line':
+        raise ValueError("Sorted dedupe mode only supports the 'line' key")
+    return True
+
+
+def _splits_hosts(dedupe_key, prune, allowed=None):
+    """
+    True when a run works on domains (domain key, pruning or an allowlist);
+    every domain of a multi-name hosts line then needs a line of its own
+    """
+    return (dedupe_key or DEDUPE['key']) == 'domain' or bool(prune) or allowed is not None
+
+
+def _load_allowlist(allowlist, apply_exceptions, log_callback):
+    """
+    Allowlist of a merge/convert run
+    
+    Returns:
+        tuple: (Allowlist or None if nothing is allowed, apply_exceptions)
+    """
+    if allowlist is None:
+        allowlist = ALLOWLIST['files']
+    if apply_exceptions is None:
+        apply_exceptions = ALLOWLIST['apply_exceptions']
+    if not allowlist and not apply_exceptions:
+        return None, False
+    return load_allowlist(allowlist, log_callback), apply_exceptions
+
+
+def _compact_allowed(stage, output_file, log_callback):
+    """Remove lines covered by exceptions that came after them, returns the lines removed"""
+    if not stage.late:
+        return 0
+    _, removed = filter_file(output_file, stage.allowlist)
+    if log_callback:
+        log_callback(f"Removed {removed:,} lines covered by later exceptions")
+    return removed
+
+
+def _write_domain_set(input_file, output_file, log_callback):
+    """Pack the domains a blocklist blocks into a domain-set file, returns their count"""
+    _, domains = Pipeline(Normalize(convert_adguard_to_pihole), DomainSetSink(output_file)).run(
+        [input_file]
+    )
+    if log_callback:
+        log_callback(f"Wrote {domains:,} domains to {os.path.basename(output_file)}")
+    return domains
+
+
+def remove_duplicates(input_file, output_file, progress_callback=None, log_callback=None,
+                      dedupe_mode=None, dedupe_key=None, prune=False, input_mode=None):
     """
     Remove duplicate lines from blocklist file
     
@@ -20,50 +86,50 @@ def remove_duplicates(input_file, output_file, progress_callback=None, log_callb
         output_file: Path to output file
         progress_callback: Function(percent, status_message) to call for progress updates
         log_callback: Function(message) to call for log updates
+        dedupe_mode: 'exact', 'fingerprint', 'external', 'approximate' or
+                     'sorted' (default: DEDUPE['mode']); 'sorted' writes the
+                     unique lines in sorted order
+        dedupe_key: 'line' or 'domain' (default: DEDUPE['key']); 'domain' keeps
+                    only the first rule blocking each domain in any format
+        prune: Also drop entries covered by a blocked ||parent^ rule
+        input_mode: 'buffered' or 'mmap' (default: PROCESSING['input_mode'])
     
     Returns:
         tuple: (total_lines, unique_lines, success)
     """
     try:
-        seen = set()
-        total_lines = 0
-        unique_lines = 0
-        batch_size = PROCESSING['batch_size']
+        if _is_sorted_mode(dedupe_mode, dedupe_key):
+            with LineWriter(output_file) as outfile:
+                total_lines, unique_lines = sorted_merge(
+                    [input_file], outfile, split_hosts=_splits_hosts(dedupe_key, prune),
+                    progress_callback=progress_callback, log_callback=log_callback
+                )
+            if prune:
+                unique_lines, _ = prune_subdomains(output_file, log_callback=log_callback)
+            if progress_callback:
+                progress_callback(100, "Complete")
+            return total_lines, unique_lines, True
+        
+        # Progress is reported against the file size, no line counting pass
+        if log_callback:
+            log_callback(f"Input size: {os.path.getsize(input_file):,} bytes")
         
-        # Count total lines first
-        with open(input_file, 'rb') as f:
-            for _ in f:
-                total_lines += 1
+        stages = [Strip(), Dedupe(dedupe_mode, dedupe_key), FileSink(output_file)]
+        if _splits_hosts(dedupe_key, prune):
+            stages.insert(1, SplitHosts())
+        total_lines, unique_lines = Pipeline(*stages).run(
+            [input_file], progress_callback, log_callback, input_mode=input_mode
+        )
+        
+        # Final progress update
+        if progress_callback:
+            progress_callback(100, "Complete")
         
         if log_callback:
-            log_callback(f"Total lines to process: {total_lines:,}")
-        
-        # Process file
-        with open(input_file, 'r', encoding=PROCESSING['encoding'], 
-                  errors=PROCESSING['errors']) as infile:
-            with open(output_file, 'w', encoding=PROCESSING['encoding']) as outfile:
-                processed = 0
-                for line in infile:
-                    processed += 1
-                    stripped = line.strip()
-                    
-                    if not stripped:
-                        continue
-                    
-                    if stripped not in seen:
-                        seen.add(stripped)
-                        outfile.write(stripped + '\n')
-                        unique_lines += 1
-                    
-                    # Update progress
-                    if processed % batch_size == 0:
-                        percent = (processed / total_lines) * 100
-                        if progress_callback:
-                            progress_callback(percent, f"Processed {processed:,} lines...")
-                
-                # Final progress update
-                if progress_callback:
-                    progress_callback(100, "Complete")
+            log_callback(f"Total lines processed: {total_lines:,}")
+        
+        if prune:
+            unique_lines, _ = prune_subdomains(output_file, log_callback=log_callback)
         
         return total_lines, unique_lines, True
         
@@ -73,7 +139,8 @@ def remove_duplicates(input_file, output_file, progress_callback=None, log_callb
         return 0, 0, False
 
 
-def clean_blocklist(input_file, output_file, progress_callback=None, log_callback=None):
+def clean_blocklist(input_file, output_file, progress_callback=None, log_callback=None,
+                    input_mode=None):
     """
     Remove comments and empty lines from blocklist
     
@@ -82,39 +149,18 @@ def clean_blocklist(input_file, output_file, progress_callback=None, log_callbac
         output_file: Path to output file
         progress_callback: Function(percent, status_message) for progress
         log_callback: Function(message) for log updates
+        input_mode: 'buffered' or 'mmap' (default: PROCESSING['input_mode'])
     
     Returns:
         tuple: (total_lines, kept_lines, success)
     """
     try:
-        total_lines = 0
-        kept_lines = 0
-        batch_size = PROCESSING['batch_size']
-        
-        # Count total lines
-        with open(input_file, 'rb') as f:
-            for _ in f:
-                total_lines += 1
-        
-        with open(input_file, 'r', encoding=PROCESSING['encoding'],
-                  errors=PROCESSING['errors']) as infile:
-            with open(output_file, 'w', encoding=PROCESSING['encoding']) as outfile:
-                processed = 0
-                for line in infile:
-                    processed += 1
-                    
-                    if not is_comment(line):
-                        outfile.write(line.strip() + '\n')
-                        kept_lines += 1
-                    
-                    # Update progress
-                    if processed % batch_size == 0:
-                        percent = (processed / total_lines) * 100
-                        if progress_callback:
-                            progress_callback(percent, f"Processed {processed:,} lines...")
-                
-                if progress_callback:
-                    progress_callback(100, "Complete")
+        total_lines, kept_lines = Pipeline(Clean(), FileSink(output_file)).run(
+            [input_file], progress_callback, log_callback, input_mode=input_mode
+        )
+        
+        if progress_callback:
+            progress_callback(100, "Complete")
         
         return total_lines, kept_lines, True
         
@@ -124,54 +170,52 @@ def clean_blocklist(input_file, output_file, progress_callback=None, log_callbac
         return 0, 0, False
 
 
-def convert_to_pihole(source_dir, target_dir, progress_callback=None, log_callback=None):
+def _convert_files(source_dir, target_dir, convert, progress_callback, log_callback,
+                   allowlist, apply_exceptions, file_pattern, workers, domain_set):
+    """Run a per-line converter over every matching file of a folder tree"""
+    allowed, apply_exceptions = _load_allowlist(allowlist, apply_exceptions, log_callback)
+    processed_files, _ = convert_directory(
+        source_dir, target_dir, convert, file_pattern=file_pattern, workers=workers,
+        allowlist=allowed, apply_exceptions=apply_exceptions, domain_set=domain_set,
+        progress_callback=progress_callback, log_callback=log_callback
+    )
+    
+    if progress_callback:
+        progress_callback(100, "Complete")
+    
+    return processed_files
+
+
+def convert_to_pihole(source_dir, target_dir, progress_callback=None, log_callback=None,
+                      allowlist=None, apply_exceptions=None, file_pattern="*.txt", workers=None,
+                      domain_set=False):
     """
     Convert AdGuard format files to PiHole format
     
     Args:
         source_dir: Source directory with AdGuard files
-        target_dir: Target directory for PiHole files
+        target_dir: Target directory for PiHole files (same relative paths)
         progress_callback: Function(percent, status_message) for progress
-        log_callback: Function(filename) for file processing updates
+        log_callback: Function(message) for log updates (per-file stats)
+        allowlist: Allowlist files whose domains are left out
+                   (default: ALLOWLIST['files'])
+        apply_exceptions: Also leave out domains allowed by @@||domain^ rules
+                          of each file (default: ALLOWLIST['apply_exceptions'])
+        file_pattern: Glob pattern of the files to convert in source_dir and
+                      its subdirectories (default: "*.txt")
+        workers: Worker processes, one file each
+                 (default: PROCESSING['workers'], 0 = CPU count)
+        domain_set: Write each file as a binary domain set (<name>.dset)
+                    instead; domain-set inputs are read in any case
     
     Returns:
         tuple: (processed_files, success)
     """
     try:
-        ensure_directory(target_dir)
-        
-        main_files = [
-            'BlockList.txt', 'BlockList_clean.txt', 
-            'BlockList_unique.txt', 'Romanian_Complete_Blocklist.txt'
-        ]
-        
-        total_files = len(main_files)
-        processed_files = 0
-        
-        for filename in main_files:
-            source_path = os.path.join(source_dir, filename)
-            if os.path.exists(source_path):
-                if log_callback:
-                    log_callback(filename)
-                
-                target_path = os.path.join(target_dir, filename)
-                
-                with open(source_path, 'r', encoding=PROCESSING['encoding'],
-                          errors=PROCESSING['errors']) as infile:
-                    with open(target_path, 'w', encoding=PROCESSING['encoding']) as outfile:
-                        for line in infile:
-                            domain = convert_adguard_to_pihole(line)
-                            if domain:
-                                outfile.write(domain + '\n')
-                
-                processed_files += 1
-                if progress_callback:
-                    percent = (processed_files / total_files) * 100
-                    progress_callback(percent, f"Converted {processed_files}/{total_files} files")
-        
-        if progress_callback:
-            progress_callback(100, "Complete")
-        
+        processed_files = _convert_files(source_dir, target_dir, convert_adguard_to_pihole,
+                                         progress_callback, log_callback,
+                                         allowlist, apply_exceptions, file_pattern, workers,
+                                         domain_set)
         return processed_files, True
         
     except Exception as e:
@@ -180,66 +224,103 @@ def convert_to_pihole(source_dir, target_dir, progress_callback=None, log_callba
         return 0, False
 
 
-def convert_to_adguard(source_dir, target_dir, progress_callback=None, log_callback=None):
+def convert_to_adguard(source_dir, target_dir, progress_callback=None, log_callback=None,
+                      allowlist=None, apply_exceptions=None, file_pattern="*.txt", workers=None,
+                      domain_set=False):
     """
     Convert PiHole format files to AdGuard format
     
     Args:
         source_dir: Source directory with PiHole files
-        target_dir: Target directory for AdGuard files
+        target_dir: Target directory for AdGuard files (same relative paths)
         progress_callback: Function(percent, status_message) for progress
-        log_callback: Function(filename) for file processing updates
+        log_callback: Function(message) for log updates (per-file stats)
+        allowlist: Allowlist files whose domains are left out
+                   (default: ALLOWLIST['files'])
+        apply_exceptions: Also leave out domains allowed by @@||domain^ rules
+                          of each file (default: ALLOWLIST['apply_exceptions'])
+        file_pattern: Glob pattern of the files to convert in source_dir and
+                      its subdirectories (default: "*.txt")
+        workers: Worker processes, one file each
+                 (default: PROCESSING['workers'], 0 = CPU count)
+        domain_set: Write each file as a binary domain set (<name>.dset)
+                    instead; domain-set inputs are read in any case
     
     Returns:
         tuple: (processed_files, success)
     """
     try:
-        ensure_directory(target_dir)
+        processed_files = _convert_files(source_dir, target_dir, convert_pihole_to_adguard,
+                                         progress_callback, log_callback,
+                                         allowlist, apply_exceptions, file_pattern, workers,
+                                         domain_set)
+        return processed_files, True
         
-        main_files = [
-            'BlockList.txt', 'BlockList_clean.txt', 
-            'BlockList_unique.txt', 'Romanian_Complete_Blocklist.txt'
-        ]
+    except Exception as e:
+        if log_callback:
+            log_callback(f"Error: {str(e)}")
+        return 0, False
+
+
+def export_formats(input_file, output_folder, formats=None, progress_callback=None,
+                   log_callback=None, input_mode=None):
+    """
+    Write a blocklist in several output formats from a single parse
+    
+    Args:
+        input_file: Path to the (merged) blocklist, any supported rule format
+        output_folder: Folder for <name>_<format><extension> outputs
+        formats: Names from utils.formats.FORMATS (default: EXPORT['formats'])
+        progress_callback: Function(percent, status_message) for progress
+        log_callback: Function(message) for log updates
+        input_mode: 'buffered' or 'mmap' (default: PROCESSING['input_mode'])
+    
+    Returns:
+        tuple: (total_lines, domains_written, output_files, success)
+    """
+    try:
+        selected = get_formats(formats or EXPORT['formats'])
+        ensure_directory(output_folder)
         
-        total_files = len(main_files)
-        processed_files = 0
+        base_name = plain_name(input_file)
+        # Headers carry the input's time, so an unchanged input exports identical files
+        updated = None
+        if EXPORT['timestamp'] == 'source':
+            updated = datetime.fromtimestamp(os.path.getmtime(input_file))
+        sink = FormatSink(output_folder, base_name, selected, os.path.basename(input_file),
+                          updated)
         
-        for filename in main_files:
-            source_path = os.path.join(source_dir, filename)
-            if os.path.exists(source_path):
-                if log_callback:
-                    log_callback(filename)
-                
-                target_path = os.path.join(target_dir, filename)
-                
-                with open(source_path, 'r', encoding=PROCESSING['encoding'],
-                          errors=PROCESSING['errors']) as infile:
-                    with open(target_path, 'w', encoding=PROCESSING['encoding']) as outfile:
-                        for line in infile:
-                            domain = convert_pihole_to_adguard(line)
-                            if domain:
-                                outfile.write(domain + '\n')
-                
-                processed_files += 1
-                if progress_callback:
-                    percent = (processed_files / total_files) * 100
-                    progress_callback(percent, f"Converted {processed_files}/{total_files} files")
+        # Rules are parsed to domains once, duplicates across rule forms dropped
+        total_lines, domains_written = Pipeline(
+            Normalize(convert_adguard_to_pihole), Dedupe(key='line'), sink
+        ).run([input_file], progress_callback, log_callback, input_mode=input_mode)
+        
+        output_files = list(sink.paths.values())
+        if log_callback:
+            log_callback(f"Total lines: {total_lines:,}")
+            log_callback(f"Wrote {domains_written:,} domains in {len(output_files)} formats")
+            for path in output_files:
+                log_callback(f"  - {os.path.basename(path)}")
         
         if progress_callback:
             progress_callback(100, "Complete")
         
-        return processed_files, True
+        return total_lines, domains_written, output_files, True
         
     except Exception as e:
         if log_callback:
             log_callback(f"Error: {str(e)}")
-        return 0, False
+        return 0, 0, [], False
 
 
 def download_blocklists(repo_manager, progress_callback=None, log_callback=None):
     """
     Download blocklists from configured repositories
     
+    Lists are requested with the ETag / Last-Modified of the previous run
+    (DOWNLOAD['cache_file'] next to repos.json); unchanged ones are kept
+    and counted in the summary log line instead of downloaded_count.
+    
     Args:
         repo_manager: RepoManager instance with repository configurations
         progress_callback: Function(percent, status_message) for progress
@@ -250,7 +331,6 @@ def download_blocklists(repo_manager, progress_callback=None, log_callback=None)
     """
     headers = {'User-Agent': 'Python/BlocklistManager'}
     downloaded = 0
-    total_files_estimate = 0
     
     try:
         # Get enabled repositories
@@ -261,65 +341,26 @@ def download_blocklists(repo_manager, progress_callback=None, log_callback=None)
                 log_callback("No repositories enabled! Please enable at least one repository.", None)
             return 0, False
         
-        # Estimate total files for progress calculation
-        for repo in repos:
-            if repo.get("source") == "github_api":
-                total_files_estimate += 50  # Estimate for API sources
-            else:
-                total_files_estimate += 1  # Single file sources
-        
-        # Process each enabled repository
+        # Queue every repository; listings and files are then fetched concurrently
+        tasks = []
         for repo in repos:
             repo_name = repo.get("name", repo.get("id", "Unknown"))
             source_type = repo.get("source")
             
-            if log_callback:
-                log_callback(f"Processing {repo_name}...", None)
-            
             # Get destination path
             dest_folder = repo_manager.get_destination_path(repo)
             ensure_directory(dest_folder)
             
             if source_type == "github_api":
-                # GitHub API source - fetch file list and download
                 api_url = repo.get("api_url")
-                file_pattern = repo.get("file_pattern", ".*")
-                
-                try:
-                    req = urllib.request.Request(api_url, headers=headers)
-                    with urllib.request.urlopen(req, timeout=30) as response:
-                        data = json.loads(response.read().decode('utf-8'))
-                    
-                    import re
-                    files = [f for f in data if re.match(file_pattern, f['name'])]
-                    
-                    if log_callback:
-                        log_callback(f"Found {len(files)} files", None)
-                    
-                    for file_info in files:
-                        if log_callback:
-                            log_callback(f"Downloading {file_info['name']}...", file_info['name'])
-                        
-                        output_path = os.path.join(dest_folder, file_info['name'])
-                        req_file = urllib.request.Request(file_info['download_url'], headers=headers)
-                        
-                        with urllib.request.urlopen(req_file, timeout=30) as file_response:
-                            with open(output_path, 'wb') as f:
-                                f.write(file_response.read())
-                        
-                        downloaded += 1
-                        
-                        if progress_callback:
-                            percent = min((downloaded / total_files_estimate) * 100, 99)
-                            progress_callback(percent, f"Downloaded {file_info['name']}")
-                            
-                except Exception as e:
+                if not api_url:
                     if log_callback:
-                        log_callback(f"Error with {repo_name}: {str(e)}", None)
+                        log_callback(f"Missing API URL for {repo_name}", None)
                     continue
-                    
+                tasks.append(listing_task(repo_name, api_url, dest_folder,
+                                          repo.get("file_pattern", ".*")))
+                
             elif source_type in ("github_raw", "direct_url"):
-                # Direct URL source - download single file
                 url = repo.get("url")
                 filename = repo.get("filename")
                 
@@ -327,28 +368,24 @@ def download_blocklists(repo_manager, progress_callback=None, log_callback=None)
                     if log_callback:
                         log_callback(f"Missing URL or filename for {repo_name}", None)
                     continue
-                
-                try:
-                    if log_callback:
-                        log_callback(f"Downloading {filename}...", filename)
-                    
-                    output_path = os.path.join(dest_folder, filename)
-                    req = urllib.request.Request(url, headers=headers)
-                    
-                    with urllib.request.urlopen(req, timeout=30) as response:
-                        with open(output_path, 'wb') as f:
-                            f.write(response.read())
-                    
-                    downloaded += 1
-                    
-                    if progress_callback:
-                        percent = min((downloaded / total_files_estimate) * 100, 99)
-                        progress_callback(percent, f"Downloaded {filename}")
-                        
-                except Exception as e:
-                    if log_callback:
-                        log_callback(f"Error downloading {filename}: {str(e)}", None)
-                    continue
+                tasks.append(file_task(filename, url, os.path.join(dest_folder, filename)))
+        
+        max_concurrent = repo_manager.get_settings().get("max_concurrent_downloads")
+        if log_callback:
+            log_callback(f"Downloading from {len(repos)} repositories "
+                         f"({max_concurrent or DOWNLOAD['max_concurrent']} at a time)...", None)
+        
+        # Conditional requests skip lists that have not changed since the last run
+        cache_path = os.path.join(os.path.dirname(repo_manager.config_path), DOWNLOAD['cache_file'])
+        downloaded, unchanged, failed = download_all(tasks, max_concurrent=max_concurrent,
+                                                     headers=headers,
+                                                     cache=DownloadCache(cache_path),
+                                                     progress_callback=progress_callback,
+                                                     log_callback=log_callback)
+        
+        if log_callback:
+            log_callback(f"Downloaded {downloaded} files, {unchanged} unchanged, "
+                         f"{failed} failed", None)
         
         if progress_callback:
             progress_callback(100, "Complete")
@@ -362,7 +399,10 @@ def download_blocklists(repo_manager, progress_callback=None, log_callback=None)
 
 
 def merge_folder_dedupe(source_folder, output_file, file_pattern="*.txt",
-                        progress_callback=None, log_callback=None):
+                        progress_callback=None, log_callback=None, dedupe_mode=None,
+                        workers=1, dedupe_key=None, prune=False, incremental=False,
+                        input_mode=None, readers=None, allowlist=None, apply_exceptions=None,
+                        domain_set=False):
     """
     Merge all blocklist files from a folder and remove duplicates
     
@@ -372,11 +412,54 @@ def merge_folder_dedupe(source_folder, output_file, file_pattern="*.txt",
         file_pattern: Glob pattern to match files (default: "*.txt")
         progress_callback: Function(percent, status_message) for progress
         log_callback: Function(message) for log updates
+        dedupe_mode: 'exact', 'fingerprint', 'external', 'approximate' or
+                     'sorted' (default: DEDUPE['mode']); 'sorted' k-way merges
+                     sorted inputs into sorted output, sorting the unsorted
+                     ones first
+        workers: Worker processes; anything but 1 runs the sharded multi-core
+                 merge (0 = CPU count), dedupe_mode is then ignored. In
+                 'sorted' mode they sort the unsorted inputs instead
+        dedupe_key: 'line' or 'domain' (default: DEDUPE['key']); 'domain' keeps
+                    only the first rule blocking each domain in any format
+        prune: Also drop entries covered by a blocked ||parent^ rule
+        incremental: Keep a manifest/index next to output_file and only read
+                     sources that changed since the previous run
+                     (dedupe_mode and workers are then ignored)
+        input_mode: 'buffered' or 'mmap' (default: PROCESSING['input_mode'])
+        readers: Reader pool that loads and strips files ahead of the dedupe
+                 loop (default: PROCESSING['readers'], 1 = read inline,
+                 0 = CPU count); output order is unchanged
+        allowlist: Allowlist files; lines blocking a domain they allow are
+                   dropped (default: ALLOWLIST['files'])
+        apply_exceptions: Also drop lines covered by the @@||domain^ rules of
+                          the sources (default: ALLOWLIST['apply_exceptions'])
+        domain_set: Write output_file as a binary domain set of the blocked
+                    domains (not with incremental); domain-set sources are
+                    read in any case
     
     Returns:
         tuple: (files_processed, total_lines, unique_lines, success)
     """
     try:
+        if domain_set:
+            if incremental:
+                raise ValueError("Incremental merge cannot write a domain set")
+            # Merge to text with any engine, then pack the result
+            text_output = output_file + '.txt.tmp'
+            try:
+                files_processed, total_lines_all, _, success = merge_folder_dedupe(
+                    source_folder, text_output, file_pattern, progress_callback, log_callback,
+                    dedupe_mode, workers, dedupe_key, prune, False, input_mode, readers,
+                    allowlist, apply_exceptions
+                )
+                if not success:
+                    return 0, 0, 0, False
+                unique_lines = _write_domain_set(text_output, output_file, log_callback)
+            finally:
+                if os.path.exists(text_output):
+                    os.remove(text_output)
+            return files_processed, total_lines_all, unique_lines, True
+        
         import glob
         
         # Find all matching files
@@ -403,72 +486,97 @@ def merge_folder_dedupe(source_folder, output_file, file_pattern="*.txt",
             for f in files:
                 log_callback(f"  - {os.path.basename(f)}")
         
-        # First pass: count total lines across all files
-        total_lines_all = 0
-        file_line_counts = {}
-        
-        for filepath in files:
-            try:
-                count = 0
-                with open(filepath, 'rb') as f:
-                    for _ in f:
-                        count += 1
-                file_line_counts[filepath] = count
-                total_lines_all += count
-            except Exception as e:
-                if log_callback:
-                    log_callback(f"Warning: Could not count lines in {os.path.basename(filepath)}: {e}")
-                file_line_counts[filepath] = 0
+        allowed, apply_exceptions = _load_allowlist(allowlist, apply_exceptions, log_callback)
+        split_hosts = _splits_hosts(dedupe_key, prune, allowed)
+        allow = None
+        if allowed is not None:
+            # Allowlist before dedupe, allowed lines never reach the seen-set
+            allow = Allow(allowed, apply_exceptions, ALLOWLIST['keep_exceptions'])
+        
+        if incremental:
+            # Settings the output depends on beyond its sources; a change rebuilds it
+            options = {'prune': bool(prune)}
+            if allowed is not None:
+                options['allowlist'] = file_digests(
+                    ALLOWLIST['files'] if allowlist is None else allowlist)
+                options['apply_exceptions'] = apply_exceptions
+                options['keep_exceptions'] = ALLOWLIST['keep_exceptions']
+            total_lines_all, unique_lines = incremental_merge(
+                files, output_file, dedupe_key=dedupe_key, split_hosts=split_hosts, allow=allow,
+                options=options, progress_callback=progress_callback, log_callback=log_callback
+            )
+            if allowed is not None:
+                unique_lines -= _compact_allowed(allow, output_file, log_callback)
+                allowed.report(log_callback, ALLOWLIST['report_top'])
+            if prune:
+                unique_lines, _ = prune_subdomains(output_file, log_callback=log_callback)
+            if allowed is not None or prune:
+                stamp_output(output_file, unique_lines)
+            if progress_callback:
+                progress_callback(100, "Complete")
+            return len(files), total_lines_all, unique_lines, True
+        
+        if _is_sorted_mode(dedupe_mode, dedupe_key):
+            with LineWriter(output_file) as outfile:
+                total_lines_all, unique_lines = sorted_merge(
+                    files, outfile, workers=workers, split_hosts=split_hosts, allow=allow,
+                    progress_callback=progress_callback, log_callback=log_callback
+                )
+            if allowed is not None:
+                unique_lines -= _compact_allowed(allow, output_file, log_callback)
+                allowed.report(log_callback, ALLOWLIST['report_top'])
+            if prune:
+                unique_lines, _ = prune_subdomains(output_file, log_callback=log_callback)
+            if progress_callback:
+                progress_callback(100, "Complete")
+            return len(files), total_lines_all, unique_lines, True
+        
+        if workers != 1:
+            with LineWriter(output_file) as outfile:
+                total_lines_all, unique_lines = sharded_merge(
+                    files, outfile, workers=workers, dedupe_key=dedupe_key, split_hosts=split_hosts,
+                    allow=allow, progress_callback=progress_callback, log_callback=log_callback
+                )
+            if allowed is not None:
+                allowed.report(log_callback, ALLOWLIST['report_top'])
+            if prune:
+                unique_lines, _ = prune_subdomains(output_file, log_callback=log_callback)
+            if progress_callback:
+                progress_callback(100, "Complete")
+            return len(files), total_lines_all, unique_lines, True
+        
+        # Progress is reported against total input size, no line counting pass
+        if log_callback:
+            total_bytes_all = sum(os.path.getsize(filepath) for filepath in files)
+            log_callback(f"Total size to process: {total_bytes_all:,} bytes")
+        
+        # Single pass: process all files and deduplicate
+        if readers is None:
+            readers = PROCESSING['readers']
+        stages = [Strip(), Dedupe(dedupe_mode, dedupe_key), FileSink(output_file)]
+        if allow is not None:
+            stages.insert(1, allow)
+        if split_hosts:
+            stages.insert(1, SplitHosts())
+        total_lines_all, unique_lines = Pipeline(*stages).run(
+            files, progress_callback, log_callback, input_mode=input_mode,
+            readers=readers, skip_errors=True
+        )
         
         if log_callback:
-            log_callback(f"Total lines to process: {total_lines_all:,}")
-        
-        # Second pass: process all files and deduplicate
-        seen = set()
-        unique_lines = 0
-        files_processed = 0
-        total_processed = 0
-        
-        with open(output_file, 'w', encoding=PROCESSING['encoding']) as outfile:
-            for filepath in files:
-                files_processed += 1
-                filename = os.path.basename(filepath)
-                file_lines = file_line_counts.get(filepath, 0)
-                
-                if log_callback:
-                    log_callback(f"Processing {filename} ({file_lines:,} lines)...")
-                
-                try:
-                    with open(filepath, 'r', encoding=PROCESSING['encoding'],
-                             errors=PROCESSING['errors']) as infile:
-                        for line in infile:
-                            total_processed += 1
-                            stripped = line.strip()
-                            
-                            if not stripped:
-                                continue
-                            
-                            if stripped not in seen:
-                                seen.add(stripped)
-                                outfile.write(stripped + '\n')
-                                unique_lines += 1
-                            
-                            # Update progress periodically
-                            if total_processed % PROCESSING['batch_size'] == 0:
-                                if progress_callback and total_lines_all > 0:
-                                    percent = (total_processed / total_lines_all) * 100
-                                    progress_callback(percent, 
-                                        f"Processed {total_processed:,}/{total_lines_all:,} lines...")
-                                
-                except Exception as e:
-                    if log_callback:
-                        log_callback(f"Error reading {filename}: {e}")
-                    continue
+            log_callback(f"Total lines processed: {total_lines_all:,}")
+        
+        if allowed is not None:
+            unique_lines -= _compact_allowed(allow, output_file, log_callback)
+            allowed.report(log_callback, ALLOWLIST['report_top'])
+        
+        if prune:
+            unique_lines, _ = prune_subdomains(output_file, log_callback=log_callback)
         
         if progress_callback:
             progress_callback(100, "Complete")
         
-        return files_processed, total_lines_all, unique_lines, True
+        return len(files), total_lines_all, unique_lines, True
         
     except Exception as e:
         if log_callback:
@@ -477,7 +585,8 @@ def merge_folder_dedupe(source_folder, output_file, file_pattern="*.txt",
 
 
 def split_blocklist(input_file, output_folder, lines_per_file=500000,
-                    progress_callback=None, log_callback=None):
+                    progress_callback=None, log_callback=None, input_mode=None,
+                    max_bytes=None, shards=None):
     """
     Split a large blocklist into smaller files
     
@@ -487,87 +596,76 @@ def split_blocklist(input_file, output_folder, lines_per_file=500000,
         lines_per_file: Maximum lines per output file (default: 500000)
         progress_callback: Function(percent, status_message) for progress
         log_callback: Function(message) for log updates
+        input_mode: 'buffered' or 'mmap' (default: PROCESSING['input_mode'])
+        max_bytes: Split by size instead: parts of at most max_bytes (header
+                   included), cut at line ends and copied as raw byte ranges
+                   in parallel; lines_per_file is then ignored
+        shards: Split into this many stable shards instead: rules go to a
+                shard by the hash of their domain (comments are dropped),
+                and shards whose content did not change since the previous
+                run into output_folder are not rewritten (the input is read
+                a second time to write the changed ones)
     
     Returns:
-        tuple: (files_created, total_lines, success)
+        tuple: (files_created, total_lines, success); with max_bytes the
+               second value is the number of bytes split, lines are not counted
     """
     try:
         # Ensure output folder exists
         ensure_directory(output_folder)
         
-        # Count total lines
-        if log_callback:
-            log_callback("Counting lines...")
+        total_bytes = os.path.getsize(input_file)
         
-        total_lines = 0
-        with open(input_file, 'rb') as f:
-            for _ in f:
-                total_lines += 1
+        # Get base filename
+        base_name = plain_name(input_file)
         
-        if log_callback:
-            log_callback(f"Total lines: {total_lines:,}")
-            log_callback(f"Splitting into files of ~{lines_per_file:,} lines each...")
+        if max_bytes:
+            if is_domain_set(input_file):
+                raise ValueError("Splitting by size needs a text blocklist, not a domain set")
+            if log_callback:
+                log_callback(f"Input size: {total_bytes:,} bytes")
+                log_callback(f"Splitting into files of at most {max_bytes:,} bytes each...")
+            parts = split_by_bytes(input_file, output_folder, base_name, max_bytes,
+                                   progress_callback=progress_callback, log_callback=log_callback)
+            if log_callback:
+                log_callback(f"Created {len(parts)} files")
+            if progress_callback:
+                progress_callback(100, "Complete")
+            return len(parts), total_bytes, True
         
-        # Calculate number of files needed
-        files_needed = (total_lines + lines_per_file - 1) // lines_per_file
+        if shards:
+            if log_callback:
+                log_callback(f"Input size: {total_bytes:,} bytes")
+                log_callback(f"Splitting into {shards} stable shards...")
+            sink = ShardSink(output_folder, base_name, shards, os.path.basename(input_file))
+            total_lines, _ = Pipeline(Clean(), sink).run([input_file], progress_callback,
+                                                         log_callback, input_mode=input_mode)
+            if sink.changed:
+                # Second pass writes only the shards whose hash changed
+                if log_callback:
+                    log_callback(f"Writing {len(sink.changed)} changed shards...")
+                Pipeline(Clean(), sink).run([input_file], progress_callback, log_callback,
+                                            input_mode=input_mode)
+            if log_callback:
+                log_callback(f"Total lines: {total_lines:,}")
+                log_callback(f"Rewrote {len(sink.rewritten)} of {shards} shards "
+                             f"({sink.unchanged} unchanged)")
+            if progress_callback:
+                progress_callback(100, "Complete")
+            return shards, total_lines, True
         
         if log_callback:
-            log_callback(f"Will create {files_needed} files")
-        
-        # Get base filename
-        base_name = os.path.splitext(os.path.basename(input_file))[0]
+            log_callback(f"Input size: {total_bytes:,} bytes")
+            log_callback(f"Splitting into files of ~{lines_per_file:,} lines each...")
         
-        # Split the file
-        current_file = 1
-        current_line_count = 0
-        output_file = None
-        files_created = 0
-        lines_processed = 0
+        sink = SplitSink(output_folder, base_name, lines_per_file, os.path.basename(input_file))
+        total_lines, _ = Pipeline(sink).run([input_file], progress_callback, log_callback,
+                                            input_mode=input_mode)
+        files_created = len(sink.parts)
         
-        with open(input_file, 'r', encoding=PROCESSING['encoding'],
-                  errors=PROCESSING['errors']) as infile:
-            
-            for line in infile:
-                lines_processed += 1
-                
-                # Start new file if needed
-                if output_file is None or current_line_count >= lines_per_file:
-                    if output_file:
-                        output_file.close()
-                        files_created += 1
-                        if log_callback:
-                            log_callback(f"Created part {current_file-1}")
-                    
-                    # Create new output file
-                    output_filename = f"{base_name}_part{current_file:03d}.txt"
-                    output_path = os.path.join(output_folder, output_filename)
-                    output_file = open(output_path, 'w', encoding=PROCESSING['encoding'])
-                    
-                    # Add header
-                    output_file.write(f"# {base_name} - Part {current_file} of {files_needed}\n")
-                    output_file.write(f"# Generated from: {os.path.basename(input_file)}\n")
-                    output_file.write(f"# Lines: {min(lines_per_file, total_lines - lines_processed + 1):,}\n\n")
-                    
-                    current_file += 1
-                    current_line_count = 0
-                
-                # Write line
-                output_file.write(line)
-                current_line_count += 1
-                
-                # Update progress
-                if lines_processed % PROCESSING['batch_size'] == 0:
-                    if progress_callback and total_lines > 0:
-                        percent = (lines_processed / total_lines) * 100
-                        progress_callback(percent, 
-                            f"Processing... {lines_processed:,}/{total_lines:,} lines")
-        
-        # Close last file
-        if output_file:
-            output_file.close()
-            files_created += 1
-            if log_callback:
-                log_callback(f"Created part {current_file-1}")
+        if log_callback:
+            log_callback(f"Total lines: {total_lines:,}")
+            log_callback(f"Created {files_created} files")
         
         if progress_callback:
             progress_callback(100, "Complete")
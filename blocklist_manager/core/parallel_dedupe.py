@@ -0,0 +1,289 @@
+"""
+Multi-core sharded merge + deduplicate
+Lines are hash-partitioned into shards so every worker process owns a
+disjoint part of the key space and can dedupe it without coordination.
+The shards only decide which lines survive; the output is then written per
+input file in parallel and the file chunks are concatenated in input order,
+so there is no single-threaded merge of the unique lines.
+"""
+
+import os
+import zlib
+import shutil
+import tempfile
+from array import array
+from itertools import compress
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from config.settings import PROCESSING, DEDUPE
+from core.dedupe import DEDUPE_KEYS
+from core.pipeline import Allow
+from utils.lineio import iter_line_batches, strip_line, NEWLINE
+from utils.rules import split_hosts_lines
+
+
+def _keys_path(work_dir, file_index, shard):
+    return os.path.join(work_dir, f"f{file_index:05d}_s{shard:03d}.keys")
+
+
+def _numbers_path(work_dir, file_index, shard):
+    return os.path.join(work_dir, f"f{file_index:05d}_s{shard:03d}.nums")
+
+
+def _keep_path(work_dir, file_index, shard):
+    return os.path.join(work_dir, f"f{file_index:05d}_s{shard:03d}.keep")
+
+
+def _chunk_path(work_dir, file_index):
+    return os.path.join(work_dir, f"f{file_index:05d}.out")
+
+
+def _records(filepath, split_hosts):
+    """Yield (lines_read, records) batches: stripped non-empty lines, split if asked"""
+    for lines, _ in iter_line_batches(filepath):
+        records = [stripped for stripped in map(strip_line, lines) if stripped]
+        if split_hosts:
+            records = split_hosts_lines(records)
+        yield len(lines), records
+
+
+def _shard_file(file_index, filepath, work_dir, shards, dedupe_key, split_hosts,
+                collect_exceptions=False):
+    """
+    Worker: split the dedupe keys of one input file into per-shard spill files
+
+    Records are the stripped non-empty lines (multi-name hosts lines split
+    when split_hosts is set), numbered from 0. Per shard, the keys of the
+    file are written newline-separated, each once, and the number of the
+    record it first occurs in to an array of unsigned ints. With
+    collect_exceptions the @@ rules of the file are returned as well.
+
+    Returns:
+        tuple: (file_index, total_lines, record_count, exceptions, error_message)
+    """
+    key_func = DEDUPE_KEYS[dedupe_key]
+    keys = [[] for _ in range(shards)]
+    numbers = [array('I') for _ in range(shards)]
+    exceptions = set()
+    total_lines = 0
+    number = 0
+    try:
+        for lines_read, records in _records(filepath, split_hosts):
+            total_lines += lines_read
+            if collect_exceptions:
+                exceptions.update(record for record in records if record[:2] == b'@@')
+            if key_func:
+                records = [key_func(stripped) for stripped in records]
+            if shards == 1:
+                keys[0].extend(records)
+                numbers[0].extend(range(number, number + len(records)))
+                number += len(records)
+                continue
+            for key in records:
+                shard = zlib.crc32(key) % shards
+                keys[shard].append(key)
+                numbers[shard].append(number)
+                number += 1
+
+        for shard in range(shards):
+            # First record per key: later duplicates are overwritten by earlier ones
+            firsts = dict(zip(reversed(keys[shard]), reversed(numbers[shard])))
+            keys[shard] = numbers[shard] = None
+            with open(_keys_path(work_dir, file_index, shard), 'wb') as out:
+                out.write(b'\n'.join(firsts))
+            with open(_numbers_path(work_dir, file_index, shard), 'wb') as out:
+                array('I', firsts.values()).tofile(out)
+        return file_index, total_lines, number, exceptions, None
+    except Exception as e:
+        # A skipped file must not mark keys as seen for the others
+        for shard in range(shards):
+            for path in (_keys_path(work_dir, file_index, shard),
+                         _numbers_path(work_dir, file_index, shard)):
+                if os.path.exists(path):
+                    os.remove(path)
+        return file_index, total_lines, 0, set(), str(e)
+
+
+def _dedupe_shard(shard, file_count, work_dir):
+    """
+    Worker: dedupe one shard across all files in input order
+
+    Writes, per file, the numbers of the records whose key this shard sees
+    first (an array of unsigned ints).
+
+    Returns:
+        tuple: (shard, unique_lines)
+    """
+    seen = set()
+    for file_index in range(file_count):
+        keys_path = _keys_path(work_dir, file_index, shard)
+        numbers_path = _numbers_path(work_dir, file_index, shard)
+        if not os.path.exists(numbers_path):
+            continue
+        with open(keys_path, 'rb') as f:
+            data = f.read()
+        numbers = array('I')
+        with open(numbers_path, 'rb') as f:
+            numbers.frombytes(f.read())
+        os.remove(keys_path)
+        os.remove(numbers_path)
+        if numbers:
+            # Keys are unique within a file, so one membership test each is enough
+            keys = data.split(b'\n')
+            new = [key not in seen for key in keys]
+            seen.update(keys)
+            keep = array('I', compress(numbers, new))
+        else:
+            keep = numbers
+        with open(_keep_path(work_dir, file_index, shard), 'wb') as out:
+            keep.tofile(out)
+    return shard, len(seen)
+
+
+def _write_file(file_index, filepath, work_dir, shards, record_count, split_hosts,
+                allowlist=None, keep_exceptions=True):
+    """
+    Worker: write the kept records of one input file to its output chunk
+
+    With an allowlist the records are run through an Allow stage first;
+    it already holds every exception of the inputs, so none is collected.
+
+    Returns:
+        tuple: (file_index, lines_written, allowlist removal counts, error_message)
+    """
+    allow = None
+    if allowlist is not None:
+        allow = Allow(allowlist.copy(shared=True), keep_exceptions=keep_exceptions)
+    mask = bytearray(record_count)
+    try:
+        for shard in range(shards):
+            path = _keep_path(work_dir, file_index, shard)
+            keep = array('I')
+            with open(path, 'rb') as f:
+                keep.frombytes(f.read())
+            os.remove(path)
+            for number in keep:
+                mask[number] = 1
+
+        written = 0
+        start = 0
+        with open(_chunk_path(work_dir, file_index), 'wb') as out:
+            for _, records in _records(filepath, split_hosts):
+                end = start + len(records)
+                kept = list(compress(records, mask[start:end]))
+                start = end
+                if allow is not None:
+                    kept = allow.apply(kept)
+                if kept:
+                    out.write(NEWLINE.join(kept) + NEWLINE)
+                    written += len(kept)
+        return file_index, written, allow.allowlist.removed if allow else None, None
+    except Exception as e:
+        return file_index, 0, None, str(e)
+
+
+def sharded_merge(files, outfile, workers=None, shards=None, dedupe_key=None, split_hosts=False,
+                  allow=None, progress_callback=None, log_callback=None):
+    """
+    Merge and deduplicate files using a pool of worker processes
+
+    The output keeps the first-seen order of a sequential merge. Inputs are
+    read twice: once to find the first occurrence of every key and once,
+    per file in parallel, to write the lines that were kept.
+
+    Args:
+        files: Ordered list of input file paths
+        outfile: LineWriter to write unique lines to
+        workers: Number of worker processes (default: PROCESSING['workers'] or CPU count)
+        shards: Number of hash shards (default: DEDUPE['shards'] or workers)
+        dedupe_key: One of DEDUPE_KEYS (default: DEDUPE['key'])
+        split_hosts: Give every domain of a multi-name hosts line its own line
+        allow: core.pipeline.Allow stage applied by the workers that write the
+               output; the exceptions it collects are gathered from all
+               inputs first, so they also cover lines before them
+        progress_callback: Function(percent, status_message) for progress
+        log_callback: Function(message) for log updates
+
+    Returns:
+        tuple: (total_lines, lines_written)
+    """
+    workers = workers or PROCESSING['workers'] or os.cpu_count() or 1
+    shards = shards or DEDUPE['shards'] or workers
+    dedupe_key = dedupe_key or DEDUPE['key']
+
+    work_dir = tempfile.mkdtemp(prefix='blocklist_shards_', dir=DEDUPE['temp_dir'])
+    total_lines = 0
+    lines_written = 0
+    record_counts = [0] * len(files)
+    collect = allow is not None and allow.collect_exceptions
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # Stage 1: every file is split into shards in parallel
+            futures = [pool.submit(_shard_file, index, path, work_dir, shards, dedupe_key,
+                                   split_hosts, collect)
+                       for index, path in enumerate(files)]
+            exceptions = set()
+            for done, future in enumerate(as_completed(futures), 1):
+                file_index, file_lines, records, file_exceptions, error = future.result()
+                total_lines += file_lines
+                record_counts[file_index] = records
+                exceptions.update(file_exceptions)
+                filename = os.path.basename(files[file_index])
+                if log_callback:
+                    if error:
+                        log_callback(f"Error reading {filename}: {error}")
+                    else:
+                        log_callback(f"Sharded {filename} ({file_lines:,} lines)")
+                if progress_callback:
+                    progress_callback(done / len(files) * 40,
+                                      f"Sharded {done}/{len(files)} files...")
+
+            # Stage 2: every shard is deduplicated in parallel
+            futures = [pool.submit(_dedupe_shard, shard, len(files), work_dir)
+                       for shard in range(shards)]
+            for done, future in enumerate(as_completed(futures), 1):
+                future.result()
+                if progress_callback:
+                    progress_callback(40 + done / shards * 20,
+                                      f"Deduplicated {done}/{shards} shards...")
+
+            # Stage 3: every file writes its kept lines in parallel
+            allowlist = None
+            keep_exceptions = True
+            if allow is not None:
+                allowlist = allow.allowlist
+                keep_exceptions = allow.keep_exceptions
+                for line in sorted(exceptions):
+                    allowlist.add_exception(line.decode(PROCESSING['encoding'],
+                                                        PROCESSING['errors']))
+            futures = [pool.submit(_write_file, index, path, work_dir, shards,
+                                   record_counts[index], split_hosts, allowlist, keep_exceptions)
+                       for index, path in enumerate(files) if record_counts[index]]
+            for done, future in enumerate(as_completed(futures), 1):
+                file_index, written, removed, error = future.result()
+                if error:
+                    raise RuntimeError(f"Writing {os.path.basename(files[file_index])} "
+                                       f"failed: {error}")
+                lines_written += written
+                if removed:
+                    allowlist.removed.update(removed)
+                if progress_callback:
+                    progress_callback(60 + done / len(futures) * 35,
+                                      f"Wrote {done}/{len(futures)} files...")
+
+        # Concatenate the chunks in input order
+        if progress_callback:
+            progress_callback(95, f"Writing {lines_written:,} unique lines...")
+        for file_index in range(len(files)):
+            if not record_counts[file_index]:
+                continue
+            with open(_chunk_path(work_dir, file_index), 'rb') as chunk:
+                while True:
+                    data = chunk.read(PROCESSING['chunk_size'])
+                    if not data:
+                        break
+                    outfile.write_raw(data)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return total_lines, lines_written
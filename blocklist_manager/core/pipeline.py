@@ -0,0 +1,752 @@
+"""
+Streaming pipeline for line operations
+A pipeline is a chain of stages (clean, normalize, dedupe, sort...) ending
+in a sink. Batches of bytes lines are pushed through every stage in a single
+pass over the inputs, so chained operations need no intermediate files.
+"""
+
+import os
+import json
+import zlib
+import hashlib
+import tempfile
+from config.settings import PROCESSING, DEDUPE
+from core.dedupe import create_seen_set, BloomFilter, domain_key
+from core.external_sort import sort_records
+from core.ingest import ordered_ranges
+from utils.classify import is_rule
+from utils.rules import split_hosts_lines
+from utils.helpers import progress_percent
+from utils.lineio import (LineWriter, iter_line_batches, strip_line, clean_line,
+                          encode_text_block, NEWLINE)
+from utils.domainset import DomainSetWriter, reverse_domain
+from utils.compression import READ_ERRORS
+
+
+class Stage:
+    """
+    Base pipeline stage
+
+    Subclasses transform a batch in process() and may emit held-back lines
+    in finish(). lines_in / lines_out count the lines seen and passed on.
+    """
+
+    name = 'stage'
+
+    def __init__(self):
+        self.lines_in = 0
+        self.lines_out = 0
+        self.next = None
+        self.log_callback = None
+
+    def open(self, total_bytes):
+        """Called before the first batch; total_bytes is the size of all inputs"""
+
+    def push(self, lines):
+        self.lines_in += len(lines)
+        lines = self.process(lines)
+        if lines:
+            self.emit(lines)
+
+    def process(self, lines):
+        """Return the lines to pass on for one batch"""
+        return lines
+
+    def apply(self, lines):
+        """process() a batch for an engine that writes it itself, returns the lines kept"""
+        self.lines_in += len(lines)
+        lines = self.process(lines)
+        self.lines_out += len(lines)
+        return lines
+
+    def emit(self, lines):
+        self.lines_out += len(lines)
+        self.next.push(lines)
+
+    def finish(self):
+        """Called once after the last batch, may still emit lines"""
+
+    def close(self):
+        """Release resources, also called when the run fails"""
+
+    def log(self, message):
+        if self.log_callback:
+            self.log_callback(message)
+
+
+class Strip(Stage):
+    """Strip whitespace and drop empty lines"""
+
+    name = 'strip'
+
+    def process(self, lines):
+        return [stripped for stripped in map(strip_line, lines) if stripped]
+
+
+class Clean(Stage):
+    """Strip lines and drop comments and empty lines"""
+
+    name = 'clean'
+
+    def process(self, lines):
+        return [stripped for stripped in map(strip_line, lines) if is_rule(stripped)]
+
+
+class SplitHosts(Stage):
+    """Give every domain of a multi-name hosts line a line of its own (stripped input)"""
+
+    name = 'split-hosts'
+
+    def process(self, lines):
+        return split_hosts_lines(lines)
+
+
+class Normalize(Stage):
+    """
+    Apply a str -> str converter (e.g. convert_adguard_to_pihole) to every
+    line, dropping lines it returns None or '' for; it may return several
+    lines joined with '\n'
+
+    Every batch is decoded and encoded in one call.
+    """
+
+    name = 'normalize'
+
+    def __init__(self, convert):
+        super().__init__()
+        self.convert = convert
+
+    def process(self, lines):
+        encoding = PROCESSING['encoding']
+        text = b'\n'.join(lines).decode(encoding, PROCESSING['errors'])
+        converted = [line for line in map(self.convert, text.split('\n')) if line]
+        if not converted:
+            return []
+        return '\n'.join(converted).encode(encoding).split(b'\n')
+
+
+class Allow(Stage):
+    """
+    Drop lines blocking a domain the allowlist covers
+
+    Args:
+        allowlist: core.allowlist.Allowlist (user allowlist files)
+        collect_exceptions: Add @@||domain^ rules of the stream to the index
+        keep_exceptions: Pass the @@ rules on (AdGuard outputs)
+
+    An exception can only remove lines that come after it in the stream.
+    late is set when one was collected after lines were passed on already;
+    the caller then compacts the output with filter_file().
+    """
+
+    name = 'allowlist'
+
+    def __init__(self, allowlist, collect_exceptions=False, keep_exceptions=True):
+        super().__init__()
+        self.allowlist = allowlist
+        self.collect_exceptions = collect_exceptions
+        self.keep_exceptions = keep_exceptions
+        self.late = False
+
+    def process(self, lines):
+        allows = self.allowlist.allows
+        kept = []
+        for line in lines:
+            if line[:2] == b'@@':
+                if self.collect_exceptions and self.allowlist.add_exception(
+                        line.decode(PROCESSING['encoding'], PROCESSING['errors'])):
+                    self.late = self.late or self.lines_out > 0 or bool(kept)
+                if self.keep_exceptions:
+                    kept.append(line)
+            elif allows(line) is None:
+                kept.append(line)
+        return kept
+
+
+class _Emitter:
+    """File-like adapter that batches lines written by a seen-set flush"""
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.pending = []
+
+    def write(self, line):
+        self.pending.append(line)
+        if len(self.pending) >= PROCESSING['write_batch']:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.stage.emit(self.pending)
+            self.pending = []
+
+
+class Dedupe(Stage):
+    """
+    Keep the first line per dedupe key
+
+    Args:
+        mode: One of DEDUPE_MODES (default: DEDUPE['mode'])
+        key: One of DEDUPE_KEYS (default: DEDUPE['key'])
+    """
+
+    name = 'dedupe'
+
+    def __init__(self, mode=None, key=None):
+        super().__init__()
+        self.mode = mode
+        self.key = key
+        self.seen = None
+
+    def open(self, total_bytes):
+        self.seen = create_seen_set(self.mode, self.key,
+                                    expected_lines=total_bytes // DEDUPE['bloom_line_bytes'])
+
+    def process(self, lines):
+        add = self.seen.add
+        return [line for line in lines if add(line)]
+
+    def finish(self):
+        # Lines held back by deferred dedupe modes
+        emitter = _Emitter(self)
+        self.seen.flush(emitter)
+        emitter.flush()
+
+        if isinstance(self.seen, BloomFilter):
+            self.log(f"Approximate dedupe: ~{self.seen.expected_false_drops:,.1f} "
+                     f"unique lines expected to be wrongly dropped")
+            if len(self.seen) > self.seen.capacity:
+                self.log(f"Warning: {len(self.seen):,} unique lines exceed the filter "
+                         f"capacity of {self.seen.capacity:,}, raise bloom_memory_mb")
+
+
+class Sort(Stage):
+    """
+    Sort all lines in byte order with the external sorter
+
+    Lines are spilled to a temporary file while the inputs are read and
+    sorted in finish(), so memory stays within DEDUPE['memory_budget_mb'].
+
+    Args:
+        unique: Also drop adjacent duplicates (sorted dedupe)
+    """
+
+    name = 'sort'
+
+    def __init__(self, unique=False):
+        super().__init__()
+        self.unique = unique
+        self.spill_path = None
+        self.spill = None
+
+    def open(self, total_bytes):
+        fd, self.spill_path = tempfile.mkstemp(prefix='blocklist_pipeline_', suffix='.tmp',
+                                               dir=DEDUPE['temp_dir'])
+        self.spill = os.fdopen(fd, 'wb')
+
+    def process(self, lines):
+        self.spill.write(b'\n'.join(lines) + b'\n')
+        return []
+
+    def _spilled_lines(self):
+        for lines, _ in iter_line_batches(self.spill_path):
+            yield from lines
+
+    def finish(self):
+        self.spill.close()
+        batch = []
+        previous = None
+        for line in sort_records(self._spilled_lines()):
+            if self.unique and line == previous:
+                continue
+            previous = line
+            batch.append(line)
+            if len(batch) >= PROCESSING['write_batch']:
+                self.emit(batch)
+                batch = []
+        if batch:
+            self.emit(batch)
+
+    def close(self):
+        if self.spill is not None:
+            self.spill.close()
+            os.remove(self.spill_path)
+            self.spill = None
+
+
+class DomainSetSink(Sort):
+    """
+    Write domain lines to a binary domain-set file (utils.domainset)
+
+    Domains are spilled with their labels reversed and sorted like in
+    Sort, then front-coded into path (lines_out = domains written). An
+    allowlist given here is checked as the set is written, when every
+    exception in the stream has been collected, so late exceptions need
+    no second pass.
+
+    Args:
+        path: Output domain-set file
+        allowlist: core.allowlist.Allowlist to leave out, or None
+    """
+
+    name = 'domain set'
+
+    def __init__(self, path, allowlist=None):
+        super().__init__(unique=True)
+        self.path = path
+        self.allowlist = allowlist
+        self.writer = None
+
+    def open(self, total_bytes):
+        super().open(total_bytes)
+        self.writer = DomainSetWriter(self.path)
+
+    def process(self, lines):
+        return super().process([reverse_domain(line) for line in lines])
+
+    def emit(self, lines):
+        if self.allowlist is not None:
+            allows = self.allowlist.allows
+            lines = [key for key in lines if allows(reverse_domain(key)) is None]
+        self.writer.add_many(lines)
+
+    def finish(self):
+        super().finish()
+        self.writer.close()
+        self.lines_out = self.writer.count
+        if self.writer.skipped:
+            self.log(f"Skipped {self.writer.skipped:,} names too long for a domain")
+        self.writer = None
+
+    def close(self):
+        super().close()
+        if self.writer is not None:
+            self.writer.abort()
+            self.writer = None
+
+
+class FileSink(Stage):
+    """
+    Write lines to a file (lines_out = lines written), compressed for
+    .gz/.xz/.bz2 paths or as given by compression
+    """
+
+    name = 'write'
+
+    def __init__(self, path, append=False, compression=None):
+        super().__init__()
+        self.path = path
+        self.append = append
+        self.compression = compression
+        self.writer = None
+
+    def open(self, total_bytes):
+        self.writer = LineWriter(self.path, append=self.append, compression=self.compression)
+
+    def push(self, lines):
+        self.lines_in += len(lines)
+        self.lines_out += len(lines)
+        self.writer.write_many(lines)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+class SplitSink(Stage):
+    """
+    Write lines into numbered part files with a header each
+
+    Part and line counts are only known at the end, but every input line
+    takes at least one byte, which bounds the part count. Headers are
+    written with right-aligned fixed-width counts and patched in place in
+    finish().
+
+    Args:
+        output_folder: Folder for the parts
+        base_name: Part file prefix, parts are <base_name>_partNNN.txt
+        lines_per_file: Maximum lines per part
+        source_name: Input name shown in the headers
+    """
+
+    name = 'split'
+
+    def __init__(self, output_folder, base_name, lines_per_file, source_name):
+        super().__init__()
+        self.output_folder = output_folder
+        self.base_name = base_name
+        self.lines_per_file = lines_per_file
+        self.source_name = source_name
+        self.parts = []  # [output_path, part_number, line_count]
+        self.writer = None
+
+    def open(self, total_bytes):
+        max_parts = max(1, -(-total_bytes // self.lines_per_file))
+        self.parts_width = len(str(max_parts))
+        self.lines_width = len(f"{self.lines_per_file:,}")
+        self.max_parts = max_parts
+
+    def part_header(self, part_number, parts_total, part_lines):
+        return encode_text_block([
+            f"# {self.base_name} - Part {part_number} of {parts_total:>{self.parts_width}}",
+            f"# Generated from: {self.source_name}",
+            f"# Lines: {part_lines:>{self.lines_width},}",
+            "",
+        ])
+
+    def _close_part(self):
+        self.writer.close()
+        self.writer = None
+        self.log(f"Created part {self.parts[-1][1]}")
+
+    def push(self, lines):
+        self.lines_in += len(lines)
+        start = 0
+        while start < len(lines):
+            # Start new file if needed
+            if self.writer is None or self.parts[-1][2] >= self.lines_per_file:
+                if self.writer is not None:
+                    self._close_part()
+                part_number = len(self.parts) + 1
+                output_path = os.path.join(self.output_folder,
+                                           f"{self.base_name}_part{part_number:03d}.txt")
+                self.writer = LineWriter(output_path)
+                self.writer.write_raw(self.part_header(part_number, self.max_parts,
+                                                       self.lines_per_file))
+                self.parts.append([output_path, part_number, 0])
+
+            # Write as many lines as fit in the current part
+            part = self.parts[-1]
+            take = min(self.lines_per_file - part[2], len(lines) - start)
+            self.writer.write_many([clean_line(line) for line in lines[start:start + take]])
+            part[2] += take
+            self.lines_out += take
+            start += take
+
+    def finish(self):
+        if self.writer is not None:
+            self._close_part()
+
+        # Patch the real counts into the headers
+        for output_path, part_number, part_lines in self.parts:
+            with open(output_path, 'r+b') as f:
+                f.write(self.part_header(part_number, len(self.parts), part_lines))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+class FormatSink(Stage):
+    """
+    Write domain lines in several output formats at once
+
+    Every batch is decoded once and rendered by each format into its own
+    batched writer, so all formats come out of the same pass.
+
+    Args:
+        output_folder: Folder for the outputs, <base_name>_<format><extension>
+        base_name: Output file prefix, also the header title
+        formats: utils.formats.Format list
+        source_name: Input name shown in the headers
+        updated: datetime shown in the headers (default: now)
+    """
+
+    name = 'formats'
+
+    def __init__(self, output_folder, base_name, formats, source_name, updated=None):
+        super().__init__()
+        self.output_folder = output_folder
+        self.base_name = base_name
+        self.formats = formats
+        self.source_name = source_name
+        self.updated = updated
+        self.paths = {fmt.name: os.path.join(output_folder, f"{base_name}_{fmt.name}{fmt.extension}")
+                      for fmt in formats}
+        self.writers = []
+
+    def open(self, total_bytes):
+        for fmt in self.formats:
+            writer = LineWriter(self.paths[fmt.name], text=True)
+            header = fmt.header(self.base_name, self.source_name, self.updated)
+            writer.write_raw(encode_text_block(header))
+            self.writers.append((fmt, writer))
+
+    def push(self, lines):
+        self.lines_in += len(lines)
+        self.lines_out += len(lines)
+        domains = b'\n'.join(lines).decode(PROCESSING['encoding'], PROCESSING['errors']).split('\n')
+        for fmt, writer in self.writers:
+            writer.write_many(fmt.render(domains))
+
+    def close(self):
+        for _, writer in self.writers:
+            writer.close()
+        self.writers = []
+
+
+class ShardSink(Stage):
+    """
+    Write lines into a fixed number of content-addressed shard files
+
+    A line goes to shard crc32(domain) % shards (crc32 of the line when it
+    blocks no plain domain), so a domain keeps its shard from run to run and
+    an added or removed line only changes its own shard.
+
+    The sink takes two runs over the same input. The first only hashes
+    every shard's data; its finish() compares the hashes, line counts and
+    file states with the manifest of the previous run and sets changed to
+    the shards that differ. Only when that is not empty a second run is
+    needed, which writes just the changed shards. Unchanged shards are
+    never written, so output I/O follows the size of the change.
+
+    Args:
+        output_folder: Folder for the shards, <base_name>_shardNNN.txt
+        base_name: Shard file prefix
+        shards: Number of shards (changing it reshuffles every shard)
+        source_name: Input name shown in the headers
+    """
+
+    name = 'shard'
+
+    def __init__(self, output_folder, base_name, shards, source_name):
+        super().__init__()
+        self.output_folder = output_folder
+        self.base_name = base_name
+        self.shards = shards
+        self.source_name = source_name
+        self.paths = [os.path.join(output_folder, f"{base_name}_shard{index:03d}.txt")
+                      for index in range(shards)]
+        self.manifest_path = os.path.join(output_folder, f"{base_name}_shards.json")
+        self.changed = None
+        self.files = {}
+        self.writers = {}
+        self.rewritten = []
+        self.unchanged = 0
+
+    def open(self, total_bytes):
+        if self.changed is None:
+            self.digests = [hashlib.sha256() for _ in self.paths]
+            self.counts = [0] * self.shards
+            return
+        # Writing run
+        self.lines_in = self.lines_out = 0
+        for index in self.changed:
+            writer = open(self.paths[index] + '.tmp', 'wb')
+            self.writers[index] = writer
+            writer.write(self.shard_header(index, self.counts[index]))
+
+    def push(self, lines):
+        self.lines_in += len(lines)
+        self.lines_out += len(lines)
+        buckets = [[] for _ in range(self.shards)]
+        for line in lines:
+            buckets[zlib.crc32(domain_key(line)) % self.shards].append(line)
+        hashing = self.changed is None
+        for index, bucket in enumerate(buckets):
+            if not bucket:
+                continue
+            if hashing:
+                self.digests[index].update(NEWLINE.join(bucket) + NEWLINE)
+                self.counts[index] += len(bucket)
+            elif index in self.writers:
+                self.writers[index].write(NEWLINE.join(bucket) + NEWLINE)
+
+    def shard_header(self, index, lines):
+        return encode_text_block([
+            f"# {self.base_name} - Shard {index + 1} of {self.shards}",
+            f"# Generated from: {self.source_name}",
+            f"# Lines: {lines:,}",
+            "",
+        ])
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def finish(self):
+        if self.changed is None:
+            self._plan()
+            if not self.changed:
+                self._save_manifest()
+            return
+        for index, writer in sorted(self.writers.items()):
+            writer.close()
+            os.replace(self.paths[index] + '.tmp', self.paths[index])
+            self.rewritten.append(self.paths[index])
+        self.writers = {}
+        self._save_manifest()
+
+    def _plan(self):
+        """Compare the hashed shards with the previous run"""
+        manifest = self._load_manifest()
+        previous = {}
+        if manifest.get('shards') == self.shards and manifest.get('source') == self.source_name:
+            previous = manifest.get('files', {})
+        self.changed = []
+        for index, path in enumerate(self.paths):
+            name = os.path.basename(path)
+            entry = {'sha256': self.digests[index].hexdigest(), 'lines': self.counts[index]}
+            old = previous.get(name, {})
+            try:
+                stat = os.stat(path)
+                same_file = (stat.st_size, stat.st_mtime_ns) == (old.get('size'), old.get('mtime_ns'))
+            except OSError:
+                same_file = False
+            if same_file and old.get('sha256') == entry['sha256'] and old.get('lines') == entry['lines']:
+                self.unchanged += 1
+            else:
+                self.changed.append(index)
+            self.files[name] = entry
+
+        # Shards of a previous run with more shards
+        for name in manifest.get('files', {}):
+            stale = os.path.join(self.output_folder, name)
+            if name not in self.files and os.path.exists(stale):
+                os.remove(stale)
+                self.log(f"Removed stale shard {name}")
+
+    def _save_manifest(self):
+        for path in self.paths:
+            stat = os.stat(path)
+            entry = self.files[os.path.basename(path)]
+            entry['size'] = stat.st_size
+            entry['mtime_ns'] = stat.st_mtime_ns
+        temp_path = self.manifest_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'shards': self.shards, 'source': self.source_name, 'files': self.files},
+                      f, indent=2)
+        os.replace(temp_path, self.manifest_path)
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+            if os.path.exists(writer.name):
+                os.remove(writer.name)
+        self.writers = {}
+
+
+class Pipeline:
+    """
+    Chain of stages ending in a sink
+
+    Example:
+        Pipeline(Clean(), Normalize(convert_adguard_to_pihole), Dedupe(),
+                 FileSink('out.txt')).run(['list1.txt', 'list2.txt'])
+    """
+
+    def __init__(self, *stages):
+        self.stages = list(stages)
+        for stage, next_stage in zip(self.stages, self.stages[1:]):
+            stage.next = next_stage
+        self.total_lines = 0
+
+    @property
+    def lines_written(self):
+        return self.stages[-1].lines_out
+
+    def stats(self):
+        """(stage name, lines_in, lines_out) for every stage"""
+        return [(stage.name, stage.lines_in, stage.lines_out) for stage in self.stages]
+
+    def _read_files(self, files, sizes, skip_errors, input_mode,
+                    progress_callback, log_callback):
+        head = self.stages[0]
+        total_bytes = sum(sizes)
+        bytes_done = 0
+        for filepath, size in zip(files, sizes):
+            if log_callback:
+                log_callback(f"Processing {os.path.basename(filepath)} ({size:,} bytes)...")
+            try:
+                for lines, bytes_read in iter_line_batches(filepath, input_mode=input_mode):
+                    self.total_lines += len(lines)
+                    head.push(lines)
+                    if progress_callback:
+                        progress_callback(progress_percent(bytes_done + bytes_read, total_bytes),
+                                          f"Processed {self.total_lines:,} lines...")
+            except READ_ERRORS as e:
+                if not skip_errors:
+                    raise
+                if log_callback:
+                    log_callback(f"Error reading {os.path.basename(filepath)}: {e}")
+            bytes_done += size
+
+    def _read_ranges(self, files, sizes, readers, progress_callback, log_callback):
+        # The reader pool strips lines and drops empty ones already
+        head = self.stages[0]
+        total_bytes = sum(sizes)
+        bytes_done = 0
+        current = -1
+        failed = set()
+        for file_index, bytes_read, line_count, stripped_lines, error in ordered_ranges(files, readers):
+            if file_index != current:
+                if current >= 0:
+                    bytes_done += sizes[current]
+                current = file_index
+                if log_callback:
+                    log_callback(f"Processing {os.path.basename(files[file_index])} "
+                                 f"({sizes[file_index]:,} bytes)...")
+            if error:
+                if log_callback and file_index not in failed:
+                    log_callback(f"Error reading {os.path.basename(files[file_index])}: {error}")
+                failed.add(file_index)
+                continue
+
+            self.total_lines += line_count
+            if stripped_lines:
+                head.push(stripped_lines)
+            if progress_callback:
+                progress_callback(progress_percent(bytes_done + bytes_read, total_bytes),
+                                  f"Processed {self.total_lines:,} lines...")
+
+    def run(self, files, progress_callback=None, log_callback=None,
+            input_mode=None, readers=1, skip_errors=False):
+        """
+        Stream files through the pipeline in one pass
+
+        Args:
+            files: Ordered list of input file paths
+            progress_callback: Function(percent, status_message) for progress
+            log_callback: Function(message) for log updates
+            input_mode: 'buffered' or 'mmap' (default: PROCESSING['input_mode'])
+            readers: Reader pool size (1 = read inline, 0 = CPU count); the
+                     pool hands over stripped lines, so use it with
+                     whitespace-insensitive stages
+            skip_errors: Log unreadable files and go on instead of raising
+
+        Returns:
+            tuple: (total_lines, lines_written)
+        """
+        sizes = []
+        for filepath in files:
+            try:
+                sizes.append(os.path.getsize(filepath))
+            except OSError:
+                if not skip_errors:
+                    raise
+                sizes.append(0)
+
+        for stage in self.stages:
+            stage.log_callback = log_callback
+        try:
+            for stage in self.stages:
+                stage.open(sum(sizes))
+
+            if readers == 1:
+                self._read_files(files, sizes, skip_errors, input_mode,
+                                 progress_callback, log_callback)
+            else:
+                self._read_ranges(files, sizes, readers, progress_callback, log_callback)
+
+            for stage in self.stages:
+                stage.finish()
+        finally:
+            for stage in self.stages:
+                stage.close()
+
+        return self.total_lines, self.lines_written
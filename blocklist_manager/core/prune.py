@@ -0,0 +1,106 @@
+"""
+Subdomain redundancy pruning
+Drops entries whose domain is already blocked by an AdGuard ||parent^ rule
+"""
+
+import os
+from core.external_sort import sort_records
+from utils.helpers import canonical_domain, progress_percent
+from utils.lineio import LineWriter, iter_line_batches, strip_line
+from utils.compression import compression_for_path
+
+# Record layout: reversed labels, FIELD_SEP, ancestor flag, sequence number.
+# FIELD_SEP < LABEL_SEP makes every name sort directly before its subdomains,
+# so all descendants of a domain form one contiguous block after it.
+LABEL_SEP = '\x01'
+FIELD_SEP = '\x00'
+
+
+def reversed_domain(domain):
+    """'ads.example.com' -> 'com<LABEL_SEP>example<LABEL_SEP>ads'"""
+    return LABEL_SEP.join(reversed(domain.split('.')))
+
+
+def _domain_records(input_file, progress_callback):
+    """Yield sort records for every domain rule"""
+    total_bytes = os.path.getsize(input_file)
+    seq = 0
+    for lines, bytes_read in iter_line_batches(input_file, decode=True):
+        for line in lines:
+            stripped = line.strip()
+            domain = canonical_domain(stripped)
+            if domain:
+                # Only ||domain^ rules cover subdomains; hosts/plain entries are exact
+                flag = '0' if stripped.startswith('||') else '1'
+                yield f"{reversed_domain(domain)}{FIELD_SEP}{flag}{seq:012d}"
+            seq += 1
+
+        if progress_callback:
+            progress_callback(progress_percent(bytes_read, total_bytes) * 0.5,
+                              f"Indexing domains... {seq:,} lines")
+
+
+def prune_subdomains(input_file, output_file=None, progress_callback=None, log_callback=None):
+    """
+    Remove entries covered by a blocked ancestor domain
+
+    Domains are turned into reversed-label records and sorted with the
+    external sorter, so memory stays bounded by DEDUPE['memory_budget_mb']
+    plus one bit per input line for the removal bitmap.
+
+    Args:
+        input_file: Path to a merged/deduplicated blocklist
+        output_file: Path for the pruned list (default: rewrite input_file)
+        progress_callback: Function(percent, status_message) for progress
+        log_callback: Function(message) for log updates
+
+    Returns:
+        tuple: (kept_lines, pruned_lines)
+    """
+    records = sort_records(_domain_records(input_file, progress_callback))
+
+    # Scan the sorted records, marking every entry inside an ancestor's block
+    removed = bytearray()
+    pruned = 0
+    ancestor = None  # reversed domain of the current ||ancestor^ rule
+    for record in records:
+        rkey, _, tail = record.partition(FIELD_SEP)
+        if ancestor is not None and (rkey == ancestor or
+                                     rkey.startswith(ancestor + LABEL_SEP)):
+            seq = int(tail[1:])
+            if len(removed) <= seq >> 3:
+                removed.extend(bytes((seq >> 3) - len(removed) + 1))
+            removed[seq >> 3] |= 1 << (seq & 7)
+            pruned += 1
+        elif tail[0] == '0':
+            ancestor = rkey
+        else:
+            ancestor = None
+
+    if log_callback:
+        log_callback(f"Pruned {pruned:,} entries covered by a blocked parent domain")
+
+    if progress_callback:
+        progress_callback(75, "Writing pruned list...")
+
+    # Rewrite the list without the marked lines
+    target = output_file or input_file
+    temp_path = target + '.prune.tmp'
+    seq = 0
+    with LineWriter(temp_path, compression=compression_for_path(target)) as outfile:
+        for lines, _ in iter_line_batches(input_file):
+            for line in lines:
+                marked = seq >> 3 < len(removed) and removed[seq >> 3] & (1 << (seq & 7))
+                seq += 1
+                if marked:
+                    continue
+                stripped = strip_line(line)
+                if stripped:
+                    outfile.write(stripped)
+    kept = outfile.lines_written
+    os.replace(temp_path, target)
+
+    if progress_callback:
+        progress_callback(100, "Complete")
+
+    return kept, pruned
@@ -0,0 +1,186 @@
+"""
+Sorted-input merge + deduplicate
+Sorted inputs are merged with a heap and duplicates are dropped as adjacent
+equal lines, so no seen-set is needed and memory is O(number of files).
+Unsorted inputs are first sorted in parallel with the external sorter.
+"""
+
+import os
+import heapq
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from config.settings import PROCESSING, DEDUPE
+from core.external_sort import sort_records
+from utils.helpers import progress_percent
+from utils.lineio import LineWriter, iter_line_batches, strip_line
+from utils.rules import split_hosts_lines
+
+
+def is_sorted(filepath, split_hosts=False):
+    """True if the stripped non-empty lines of a file are in ascending byte order"""
+    previous = b''
+    for stripped in _stripped_lines(filepath, [(0, 0)], 0, split_hosts):
+        if stripped < previous:
+            return False
+        previous = stripped
+    return True
+
+
+def _stripped_lines(filepath, counts, index, split_hosts=False):
+    """
+    Yield stripped non-empty lines, tracking lines and bytes read in counts[index]
+
+    With split_hosts every domain of a multi-name hosts line gets its own line.
+    """
+    for lines, bytes_read in iter_line_batches(filepath):
+        counts[index] = (counts[index][0] + len(lines), bytes_read)
+        stripped_lines = [stripped for stripped in map(strip_line, lines) if stripped]
+        if split_hosts:
+            stripped_lines = split_hosts_lines(stripped_lines)
+        yield from stripped_lines
+
+
+def _sort_file(filepath, output_path, memory_budget_mb, split_hosts):
+    """
+    Worker: write the sorted, adjacent-deduplicated lines of one file
+
+    Returns:
+        tuple: (total_lines, error_message)
+    """
+    counts = [(0, 0)]
+    try:
+        with LineWriter(output_path) as outfile:
+            previous = None
+            for stripped in sort_records(_stripped_lines(filepath, counts, 0, split_hosts),
+                                         memory_budget_mb=memory_budget_mb):
+                if stripped != previous:
+                    outfile.write(stripped)
+                    previous = stripped
+        return counts[0][0], None
+    except Exception as e:
+        return counts[0][0], str(e)
+
+
+def sort_files(files, output_dir, workers=None, split_hosts=False, log_callback=None):
+    """
+    Sort files in parallel, one worker process per file
+
+    Each worker gets an equal share of DEDUPE['memory_budget_mb'] and spills
+    to DEDUPE['temp_dir'] when a file does not fit in it.
+
+    Args:
+        files: Input file paths
+        output_dir: Folder for the sorted copies
+        workers: Worker processes (default: PROCESSING['workers'] or CPU count)
+        split_hosts: Give every domain of a multi-name hosts line its own line
+        log_callback: Function(message) for log updates
+
+    Returns:
+        list: (sorted_path, total_lines) per input file, in input order
+    """
+    workers = workers or PROCESSING['workers'] or os.cpu_count() or 1
+    workers = max(1, min(workers, len(files)))
+    budget = DEDUPE['memory_budget_mb'] / workers
+    outputs = [os.path.join(output_dir, f"sorted_{index:05d}.txt") for index in range(len(files))]
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_sort_file, path, output, budget, split_hosts)
+                   for path, output in zip(files, outputs)]
+        results = []
+        for path, output, future in zip(files, outputs, futures):
+            total_lines, error = future.result()
+            if error:
+                raise RuntimeError(f"Sorting {os.path.basename(path)} failed: {error}")
+            if log_callback:
+                log_callback(f"Sorted {os.path.basename(path)} ({total_lines:,} lines)")
+            results.append((output, total_lines))
+    return results
+
+
+def _write_batch(outfile, batch, allow):
+    """Write a batch of merged lines (through allow, if given), returns the count"""
+    if allow is not None:
+        batch = allow.apply(batch)
+    outfile.write_many(batch)
+    return len(batch)
+
+
+def sorted_merge(files, outfile, assume_sorted=None, workers=None, split_hosts=False,
+                 allow=None, progress_callback=None, log_callback=None):
+    """
+    Merge and deduplicate files into sorted output with a k-way merge
+
+    Args:
+        files: Ordered list of input file paths
+        outfile: LineWriter to write unique lines to
+        assume_sorted: Skip the check and treat every input as sorted
+                       (default: DEDUPE['assume_sorted']); unsorted inputs
+                       are otherwise sorted first with sort_files()
+        workers: Worker processes for sorting (default: PROCESSING['workers'] or CPU count)
+        split_hosts: Give every domain of a multi-name hosts line its own line
+        allow: core.pipeline.Allow stage run on every batch before it is written
+        progress_callback: Function(percent, status_message) for progress
+        log_callback: Function(message) for log updates
+
+    Returns:
+        tuple: (total_lines, unique_lines)
+    """
+    if assume_sorted is None:
+        assume_sorted = DEDUPE['assume_sorted']
+
+    sources = list(files)
+    sorted_lines = 0  # lines of inputs that were sorted (counted by the sorter)
+    work_dir = None
+    try:
+        if not assume_sorted:
+            unsorted = [index for index, path in enumerate(files)
+                        if not is_sorted(path, split_hosts)]
+            if unsorted:
+                if log_callback:
+                    log_callback(f"Sorting {len(unsorted)} unsorted file(s)...")
+                if progress_callback:
+                    progress_callback(0, f"Sorting {len(unsorted)} file(s)...")
+                work_dir = tempfile.mkdtemp(prefix='blocklist_sorted_', dir=DEDUPE['temp_dir'])
+                results = sort_files([files[index] for index in unsorted], work_dir,
+                                     workers=workers, split_hosts=split_hosts,
+                                     log_callback=log_callback)
+                for index, (sorted_path, total_lines) in zip(unsorted, results):
+                    sources[index] = sorted_path
+                    sorted_lines += total_lines
+                unsorted = set(unsorted)
+            counted = [index not in unsorted for index in range(len(files))]
+        else:
+            counted = [True] * len(files)
+
+        sizes = [os.path.getsize(path) for path in sources]
+        total_bytes = sum(sizes)
+        counts = [(0, 0)] * len(sources)
+        streams = [_stripped_lines(path, counts, index, split_hosts and counted[index])
+                   for index, path in enumerate(sources)]
+
+        unique_lines = 0
+        merged = 0
+        batch = []
+        previous = None
+        for stripped in heapq.merge(*streams):
+            if stripped == previous:
+                continue
+            batch.append(stripped)
+            previous = stripped
+            merged += 1
+            if len(batch) >= PROCESSING['write_batch']:
+                unique_lines += _write_batch(outfile, batch, allow)
+                batch = []
+
+            if progress_callback and merged % PROCESSING['batch_size'] == 0:
+                bytes_read = sum(count[1] for count in counts)
+                progress_callback(progress_percent(bytes_read, total_bytes),
+                                  f"Merged {merged:,} unique lines...")
+        unique_lines += _write_batch(outfile, batch, allow)
+    finally:
+        if work_dir is not None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    total_lines = sorted_lines + sum(count[0] for count, use in zip(counts, counted) if use)
+    return total_lines, unique_lines
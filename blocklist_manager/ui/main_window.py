@@ -979,8 +979,8 @@ class MainWindow:
             self.convert_progress['value'] = percent
             self.set_status(status)
             
-        def log_cb(filename):
-            self.log(f"Converting {filename}...")
+        def log_cb(msg):
+            self.log(msg)
             
         def worker():
             processed, success = convert_to_pihole(source_dir, target_dir, progress_cb, log_cb)
@@ -1137,8 +1137,8 @@ class MainWindow:
             self.convert_rev_progress['value'] = percent
             self.set_status(status)
             
-        def log_cb(filename):
-            self.log(f"Converting {filename}...")
+        def log_cb(msg):
+            self.log(msg)
             
         def worker():
             processed, success = convert_to_adguard(source_dir, target_dir, progress_cb, log_cb)
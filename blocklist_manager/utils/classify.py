@@ -0,0 +1,77 @@
+"""
+Blocklist line classifier
+One precompiled regex tells the kind of a stripped line in a single match;
+its named groups are looked up in a table to get the kind
+"""
+
+import re
+
+# Line kinds
+BLANK = 'blank'
+COMMENT = 'comment'
+HOSTS = 'hosts'
+NETWORK = 'network'      # adblock network rule (||domain^, |url, /path...)
+EXCEPTION = 'exception'  # @@ allowlist rule
+COSMETIC = 'cosmetic'    # element hiding / scriptlet / HTML filtering rule
+REGEX = 'regex'          # /regular expression/ rule
+DOMAIN = 'domain'        # plain domain per line
+
+LINE_KINDS = (BLANK, COMMENT, HOSTS, NETWORK, EXCEPTION, COSMETIC, REGEX, DOMAIN)
+
+# Alternatives are tried in order at the start of the line; the cosmetic
+# one scans for a marker anywhere, so it comes last. Lines matching none of
+# them are network rules. A run of '#' before whitespace or the end of the
+# line ('## Section', '####') is a comment; a cosmetic marker needs a
+# selector right after it.
+_PATTERN = r'''
+    (?P<exception>@@)
+  | (?P<comment>[!\[] | \#+(?:\s|$) | \#(?![#@?$%]) | // | :.*:$)
+  | (?P<network>\|)
+  | (?P<regex>/.*/(?:\$[^/]*)?$)
+  | (?P<hosts>(?:\d{1,3}(?:\.\d{1,3}){3} | [0-9A-Fa-f]*:[0-9A-Fa-f:.]*(?:%\w+)?)\s)
+  | (?P<domain>[A-Za-z0-9][A-Za-z0-9._-]*\.[A-Za-z0-9._-]*$)
+  | (?P<cosmetic>\S*?(?:\#@?[?$%]{0,2}\# | \$@?\$)(?!\s|$))
+'''
+
+_CLASSIFIER = re.compile(_PATTERN, re.VERBOSE)
+_CLASSIFIER_BYTES = re.compile(_PATTERN.encode('ascii'), re.VERBOSE)
+
+_GROUP_KINDS = {
+    'exception': EXCEPTION,
+    'comment': COMMENT,
+    'network': NETWORK,
+    'regex': REGEX,
+    'hosts': HOSTS,
+    'domain': DOMAIN,
+    'cosmetic': COSMETIC,
+}
+
+
+def classify(stripped):
+    """
+    Return the kind of a stripped line (one of LINE_KINDS)
+
+    Works on str and bytes lines alike.
+    """
+    if not stripped:
+        return BLANK
+    if isinstance(stripped, bytes):
+        match = _CLASSIFIER_BYTES.match(stripped)
+    else:
+        match = _CLASSIFIER.match(stripped)
+    if match is None:
+        return NETWORK
+    return _GROUP_KINDS[match.lastgroup]
+
+
+# First characters a comment can start with, as str and as bytes items
+_COMMENT_LEADS = frozenset('!#[/:') | frozenset(b'!#[/:')
+
+
+def is_rule(stripped):
+    """True for anything but blank and comment lines"""
+    if not stripped:
+        return False
+    if stripped[0] not in _COMMENT_LEADS:
+        return True
+    return classify(stripped) != COMMENT
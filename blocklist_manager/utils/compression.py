@@ -0,0 +1,97 @@
+"""
+Transparent compression
+Compressed inputs are recognised by their magic bytes and compressed
+outputs by the extension of their path (.gz, .xz, .bz2). Both are streamed
+through the gzip, lzma and bz2 modules, nothing is unpacked to disk.
+"""
+
+import os
+import bz2
+import gzip
+import lzma
+import zlib
+from config.settings import COMPRESSION
+
+# Leading bytes of each supported format
+MAGIC_BYTES = (
+    (b'\x1f\x8b', 'gz'),
+    (b'\xfd7zXZ\x00', 'xz'),
+    (b'BZh', 'bz2'),
+)
+
+EXTENSIONS = {'.gz': 'gz', '.xz': 'xz', '.bz2': 'bz2'}
+
+# Errors a corrupt or truncated compressed stream raises besides OSError
+DECOMPRESSION_ERRORS = (OSError, EOFError, lzma.LZMAError, zlib.error)
+
+# Errors that skip one unreadable input file (ValueError: bad domain-set header)
+READ_ERRORS = DECOMPRESSION_ERRORS + (ValueError,)
+
+
+def detect_compression(filepath):
+    """'gz', 'xz' or 'bz2' from the file's magic bytes, None for plain files"""
+    try:
+        with open(filepath, 'rb') as f:
+            head = f.read(6)
+    except OSError:
+        return None
+    for magic, compression in MAGIC_BYTES:
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+def compression_for_path(path):
+    """'gz', 'xz' or 'bz2' from the path's extension, None otherwise"""
+    return EXTENSIONS.get(os.path.splitext(path)[1].lower())
+
+
+def plain_name(path):
+    """File name without its extension(s): 'lists/ads.txt.gz' -> 'ads'"""
+    name = os.path.basename(path)
+    if compression_for_path(name):
+        name = os.path.splitext(name)[0]
+    return os.path.splitext(name)[0]
+
+
+def open_reader(raw, compression):
+    """Decompressing binary reader over an open raw file (left open on close)"""
+    if compression == 'gz':
+        return gzip.GzipFile(fileobj=raw, mode='rb')
+    if compression == 'xz':
+        return lzma.LZMAFile(raw, 'rb')
+    if compression == 'bz2':
+        return bz2.BZ2File(raw, 'rb')
+    raise ValueError(f"Unknown compression: {compression}")
+
+
+def open_input(filepath):
+    """Binary reader for a file, decompressing it if its magic bytes say so"""
+    compression = detect_compression(filepath)
+    if compression is None:
+        return open(filepath, 'rb')
+    if compression == 'gz':
+        return gzip.open(filepath, 'rb')
+    if compression == 'xz':
+        return lzma.open(filepath, 'rb')
+    return bz2.open(filepath, 'rb')
+
+
+def open_output(path, append=False, compression=None):
+    """
+    Binary writer for path
+
+    compression ('gz', 'xz', 'bz2') defaults to the one of the path's
+    extension; the level is COMPRESSION['level']. gzip headers carry no
+    timestamp, so equal content gives equal files.
+    """
+    compression = compression or compression_for_path(path)
+    mode = 'ab' if append else 'wb'
+    level = COMPRESSION['level']
+    if compression == 'gz':
+        return gzip.GzipFile(path, mode, compresslevel=level, mtime=0)
+    if compression == 'xz':
+        return lzma.open(path, mode, preset=level)
+    if compression == 'bz2':
+        return bz2.open(path, mode, compresslevel=max(1, level))
+    return open(path, mode)
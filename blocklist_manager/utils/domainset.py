@@ -0,0 +1,264 @@
+"""
+Binary domain-set file format
+A deduplicated set of domains, stored with reversed labels (ads.example.com
+-> com.example.ads) in ascending order, so names of the same zone are
+neighbours. Keys are front-coded in blocks of DOMAIN_SET['block_size']:
+each entry is one byte of prefix shared with the previous key, one byte of
+suffix length and the suffix; the first key of a block is stored whole.
+An index of block offsets at the end lets a reader binary-search the
+memory-mapped file without loading it, so opening costs one header read.
+
+Layout (little endian):
+    header   MAGIC, version u16, block_size u16, count u64, blocks u64,
+             index_offset u64
+    blocks   entries as above
+    index    u64 offset of every block
+"""
+
+import os
+import sys
+import mmap
+import struct
+from array import array
+from config.settings import PROCESSING, DOMAIN_SET
+
+MAGIC = b'BLDOMSET'
+VERSION = 1
+_HEADER = struct.Struct('<8sHHQQQ')
+_OFFSET = struct.Struct('<Q')
+HEADER_SIZE = _HEADER.size
+
+# Entries store lengths in one byte; DNS names are at most 253 bytes
+MAX_KEY_LENGTH = 255
+
+
+def reverse_domain(domain):
+    """b'ads.example.com' -> b'com.example.ads' (bytes or str)"""
+    sep = b'.' if isinstance(domain, bytes) else '.'
+    return sep.join(reversed(domain.split(sep)))
+
+
+def _shared_prefix(key, previous):
+    """Length of the common prefix, from the highest differing byte of an XOR"""
+    length = min(len(key), len(previous))
+    diff = int.from_bytes(key[:length], 'big') ^ int.from_bytes(previous[:length], 'big')
+    return length - (diff.bit_length() + 7) // 8
+
+
+def is_domain_set(filepath):
+    """True if the file starts with the domain-set magic"""
+    try:
+        with open(filepath, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+class DomainSetWriter:
+    """
+    Write reversed-label keys, given in ascending order, to a domain-set file
+
+    The file is written under a temporary name and renamed over path by
+    close(), so readers never see a partial set. Repeated keys are skipped,
+    keys longer than MAX_KEY_LENGTH are counted in skipped.
+    """
+
+    def __init__(self, path, block_size=None):
+        self.path = path
+        self.block_size = block_size or DOMAIN_SET['block_size']
+        self.count = 0
+        self.skipped = 0
+        self._temp_path = path + '.tmp'
+        self._file = open(self._temp_path, 'wb')
+        self._file.write(bytes(HEADER_SIZE))
+        self._offsets = []
+        self._position = HEADER_SIZE
+        self._previous = None
+        self._pending = []
+
+    def add_many(self, keys):
+        """Append keys (bytes, ascending)"""
+        previous = self._previous
+        pending = self._pending
+        block_size = self.block_size
+        for key in keys:
+            if key == previous:
+                continue
+            if len(key) > MAX_KEY_LENGTH:
+                self.skipped += 1
+                continue
+            if previous is not None and key < previous:
+                raise ValueError("Domain-set keys must be added in ascending order")
+            if self.count % block_size == 0:
+                self._offsets.append(self._position)
+                shared = 0
+            else:
+                shared = _shared_prefix(key, previous)
+            suffix = key[shared:]
+            pending.append(bytes((shared, len(suffix))) + suffix)
+            self._position += 2 + len(suffix)
+            self.count += 1
+            previous = key
+        self._previous = previous
+        if len(pending) >= PROCESSING['write_batch']:
+            self._flush_pending()
+
+    def _flush_pending(self):
+        if self._pending:
+            self._file.write(b''.join(self._pending))
+            self._pending = []
+
+    def close(self):
+        """Write the index and header and move the file into place"""
+        if self._file is None:
+            return
+        self._flush_pending()
+        index_offset = self._position
+        self._file.write(b''.join(_OFFSET.pack(offset) for offset in self._offsets))
+        self._file.seek(0)
+        self._file.write(_HEADER.pack(MAGIC, VERSION, self.block_size, self.count,
+                                      len(self._offsets), index_offset))
+        self._file.close()
+        self._file = None
+        os.replace(self._temp_path, self.path)
+
+    def abort(self):
+        """Drop the partial file"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            os.remove(self._temp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class DomainSet:
+    """
+    Read-only, memory-mapped domain set
+
+    Supports len(), membership tests on domains (str or bytes) by binary
+    search over the block index, and iteration in key order.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            size = os.fstat(self._file.fileno()).st_size
+            if size < HEADER_SIZE:
+                raise ValueError(f"Not a domain-set file: {path}")
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self._file.close()
+            raise
+        magic, version, self.block_size, self.count, self.blocks, self.index_offset = \
+            _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"Not a domain-set file (or unsupported version): {path}")
+        # Block offsets plus the end of the last block (8 bytes per block)
+        self._offsets = array('Q')
+        self._offsets.frombytes(self._map[self.index_offset:self.index_offset + 8 * self.blocks])
+        if sys.byteorder != 'little':
+            self._offsets.byteswap()
+        self._offsets.append(self.index_offset)
+
+    def __len__(self):
+        return self.count
+
+    def _first_key(self, block):
+        offset = self._offsets[block]
+        length = self._map[offset + 1]
+        return self._map[offset + 2:offset + 2 + length]
+
+    def _block_keys(self, block):
+        data = self._map
+        pos = self._offsets[block]
+        end = self._offsets[block + 1]
+        keys = []
+        key = b''
+        while pos < end:
+            shared = data[pos]
+            length = data[pos + 1]
+            key = key[:shared] + data[pos + 2:pos + 2 + length]
+            keys.append(key)
+            pos += 2 + length
+        return keys
+
+    def __contains__(self, domain):
+        if isinstance(domain, str):
+            domain = domain.encode('ascii', 'ignore')
+        key = reverse_domain(domain.lower().rstrip(b'.'))
+        low, high = 0, self.blocks - 1
+        if high < 0 or key < self._first_key(0):
+            return False
+        # Last block whose first key is <= key
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self._first_key(middle) <= key:
+                low = middle
+            else:
+                high = middle - 1
+        data = self._map
+        pos = self._offsets[low]
+        end = self._offsets[low + 1]
+        current = b''
+        while pos < end:
+            length = data[pos + 1]
+            current = current[:data[pos]] + data[pos + 2:pos + 2 + length]
+            if current >= key:
+                return current == key
+            pos += 2 + length
+        return False
+
+    def _block_at(self, offset):
+        """First block starting at or after offset"""
+        low, high = 0, self.blocks
+        while low < high:
+            middle = (low + high) // 2
+            if self._offsets[middle] < offset:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def iter_batches(self, start=0, end=None):
+        """
+        Yield (domains, bytes_read) batches of the blocks starting in [start, end)
+
+        Domains are bytes in key order; a block belongs to the range its
+        first byte falls in, like a line in a byte range of a text file.
+        bytes_read is the file offset reached.
+        """
+        end = self.index_offset if end is None else end
+        per_batch = max(1, PROCESSING['write_batch'] // self.block_size)
+        batch = []
+        block = self._block_at(start)
+        stop = self._block_at(end)
+        while block < stop:
+            batch.extend([reverse_domain(key) for key in self._block_keys(block)])
+            block += 1
+            if len(batch) >= per_batch * self.block_size or block == stop:
+                yield batch, self._offsets[block]
+                batch = []
+
+    def __iter__(self):
+        for domains, _ in self.iter_batches():
+            yield from domains
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
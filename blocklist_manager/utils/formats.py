@@ -0,0 +1,93 @@
+"""
+Blocklist output formats
+A format renders a blocked domain into one or more lines of its target
+syntax, plus the header its files start with. Formats live in the FORMATS
+registry; adding one is a single register_format() call.
+"""
+
+from datetime import datetime
+
+DOMAIN_FIELD = '{domain}'
+
+
+class Format:
+    """
+    Output format
+
+    Args:
+        name: Registry name
+        template: Line written per domain, '{domain}' is replaced; a tuple
+                  of templates writes one line each
+        extension: Output file extension
+        comment: Comment prefix of the syntax
+        preamble: Lines written after the comment header (e.g. zone records)
+    """
+
+    def __init__(self, name, template, extension='.txt', comment='#', preamble=()):
+        self.name = name
+        self.template = template
+        self.templates = (template,) if isinstance(template, str) else tuple(template)
+        self.extension = extension
+        self.comment = comment
+        self.preamble = preamble
+        # Templates with a single {domain} render by concatenation
+        pieces = [line.split(DOMAIN_FIELD) for line in self.templates]
+        self._affixes = ([(prefix, suffix) for prefix, suffix in pieces]
+                         if all(len(piece) == 2 for piece in pieces) else None)
+
+    def header(self, title, source_name, updated=None):
+        """
+        Lines a file of this format starts with
+
+        updated is the datetime shown in the header and used for zone
+        serials (default: now)
+        """
+        updated = updated or datetime.now()
+        lines = [
+            f"{self.comment} {title}",
+            f"{self.comment} Format: {self.name}",
+            f"{self.comment} Generated from: {source_name}",
+            f"{self.comment} Updated: {updated.strftime('%Y-%m-%d %H:%M:%S')}",
+        ]
+        lines.extend(line.format(serial=updated.strftime('%Y%m%d%H')) for line in self.preamble)
+        lines.append("")
+        return lines
+
+    def render(self, domains):
+        """Lines for a batch of domains (str)"""
+        if self._affixes:
+            if len(self._affixes) == 1:
+                prefix, suffix = self._affixes[0]
+                return [prefix + domain + suffix for domain in domains]
+            return [prefix + domain + suffix
+                    for domain in domains for prefix, suffix in self._affixes]
+        return [line.format(domain=domain) for domain in domains for line in self.templates]
+
+
+FORMATS = {}
+
+
+def register_format(fmt):
+    """Add a Format to the registry (replacing one of the same name)"""
+    FORMATS[fmt.name] = fmt
+    return fmt
+
+
+def get_formats(names):
+    """Formats for a list of names, raises ValueError for unknown ones"""
+    unknown = [name for name in names if name not in FORMATS]
+    if unknown:
+        raise ValueError(f"Unknown output format(s): {', '.join(unknown)}")
+    return [FORMATS[name] for name in names]
+
+
+register_format(Format('adguard', '||{domain}^', comment='!'))
+register_format(Format('pihole', '{domain}'))
+register_format(Format('hosts', '0.0.0.0 {domain}'))
+register_format(Format('dnsmasq', 'local=/{domain}/', extension='.conf'))
+register_format(Format('unbound', 'local-zone: "{domain}." always_nxdomain', extension='.conf'))
+register_format(Format('rpz', ('{domain} CNAME .', '*.{domain} CNAME .'), extension='.rpz',
+                       comment=';',
+                       preamble=('$TTL 300',
+                                 '@ IN SOA localhost. root.localhost. {serial} 3600 600 86400 300',
+                                 '@ IN NS localhost.')))
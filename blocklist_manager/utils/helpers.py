@@ -3,8 +3,9 @@ Utility helper functions
 """
 
 import os
-import re
 from datetime import datetime
+from utils.classify import is_rule, HOSTS, DOMAIN
+from utils.rules import parse_rule, blocked_domain, hosts_domains, NO_DOMAIN_LEADS
 
 
 def ensure_directory(path):
@@ -13,15 +14,29 @@ def ensure_directory(path):
     return path
 
 
-def count_lines(filepath):
-    """Count total lines in a file efficiently"""
+def count_lines(filepath, chunk_size=1024 * 1024):
+    """Count total lines in a file efficiently (newlines counted per chunk)"""
     count = 0
+    last = b'\n'
     with open(filepath, 'rb') as f:
-        for _ in f:
-            count += 1
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            count += chunk.count(b'\n')
+            last = chunk[-1:]
+    if last != b'\n':
+        count += 1
     return count
 
 
+def progress_percent(done, total):
+    """Percentage of done/total, 100 when total is unknown or zero"""
+    if not total:
+        return 100
+    return min((done / total) * 100, 100)
+
+
 def format_number(num):
     """Format number with thousand separators"""
     return f"{num:,}"
@@ -34,85 +49,60 @@ def get_timestamp():
 
 def is_comment(line):
     """Check if a line is a comment or empty"""
-    stripped = line.strip()
-    if not stripped:
-        return True
-    if stripped.startswith('!'):
-        return True
-    if stripped.startswith('#'):
-        return True
-    if stripped.startswith('//'):
-        return True
-    if re.match(r'^:.*:$', stripped):
-        return True
-    return False
+    return not is_rule(line.strip())
+
+
+def canonical_domain(stripped):
+    """
+    Extract the normalized domain blocked by a rule
+    
+    Understands AdGuard (||domain^, ||domain^$important), hosts
+    (0.0.0.0 domain) and domain-per-line rules. The domain is lowercased
+    and a trailing dot is removed.
+    Returns None for anything else (exceptions, cosmetic rules, rules with
+    scope-changing modifiers, comments...)
+    """
+    return blocked_domain(stripped)
 
 
 def convert_adguard_to_pihole(line):
     """
     Convert AdGuard format to PiHole format
-    Returns None if line should be skipped
+    A hosts line with several names gives one domain per line
+    Returns None if line should be skipped (see Rule.unsupported_reason)
     """
     stripped = line.strip()
-    if not stripped or stripped.startswith('!'):
-        return None
-    
-    domain = stripped
-    if domain.startswith('||'):
-        domain = domain[2:]
-    if domain.endswith('^'):
-        domain = domain[:-1]
-    if '^$' in domain:
-        domain = domain.split('^$')[0]
-    
-    # Validate domain format
-    if re.match(r'^[a-zA-Z0-9]', domain) and '.' in domain:
-        return domain
-    return None
+    domain = blocked_domain(stripped)
+    if domain is None:
+        return '\n'.join(hosts_domains(stripped)) or None
+    return domain
 
 
 def convert_pihole_to_adguard(line):
     """
     Convert PiHole format to AdGuard format
-    Converts 'domain.com' to '||domain.com^'
+    Converts 'domain.com' and '0.0.0.0 domain.com' to '||domain.com^'
+    A hosts line with several names gives one rule per line
     Returns None if line should be skipped
     """
     stripped = line.strip()
     
-    # Skip comments and empty lines
-    if not stripped:
-        return None
-    if stripped.startswith('#'):
-        return None
-    if stripped.startswith('!'):
-        return None
-    if stripped.startswith('//'):
-        return None
-    
-    # Skip lines with spaces (likely not domains)
-    if ' ' in stripped:
-        return None
-    
-    # Skip IP addresses (PiHole hosts file format)
-    if re.match(r'^\d+\.\d+\.\d+\.\d+\s+', stripped):
-        # Extract domain after IP
-        parts = stripped.split()
-        if len(parts) >= 2:
-            stripped = parts[-1]
-        else:
-            return None
-    
     # Skip if already in AdGuard format
-    if stripped.startswith('||') and stripped.endswith('^'):
+    if stripped.startswith('||') and stripped.endswith('^') and ' ' not in stripped:
         return stripped
     
-    # Convert to AdGuard format
-    # Validate it's a domain-like string
-    if re.match(r'^[a-zA-Z0-9]', stripped) and '.' in stripped:
-        # Basic domain validation - reject if it has invalid characters
-        if re.match(r'^[a-zA-Z0-9\.\-_]+$', stripped):
-            return f'||{stripped}^'
+    # Comments, exceptions, cosmetic and regex rules have no domain to convert
+    if not stripped or stripped[0] in NO_DOMAIN_LEADS:
+        return None
+    
+    # Hosts fast path, split-based: '0.0.0.0 a.com b.com # comment'
+    domains = hosts_domains(stripped)
+    if domains:
+        return '\n'.join([f'||{domain}^' for domain in domains])
     
+    rule = parse_rule(stripped)
+    if rule.kind in (HOSTS, DOMAIN) and rule.domain:
+        return f'||{rule.domain}^'
     return None
 
 
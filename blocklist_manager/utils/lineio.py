@@ -0,0 +1,208 @@
+"""
+Buffered line I/O shared by all line operations
+Files are read in large binary chunks (or memory-mapped) and split on
+b'\\n'; lines stay bytes unless a transform needs text, and output is
+written in batches
+"""
+
+import os
+import mmap
+from config.settings import PROCESSING
+from utils.domainset import DomainSet, is_domain_set
+from utils.compression import detect_compression, open_reader, open_output
+
+# Same newline the text-mode writers of earlier versions produced
+NEWLINE = os.linesep.encode('ascii')
+TEXT_NEWLINE = os.linesep
+
+# ASCII characters str.strip() treats as whitespace
+WHITESPACE = b' \t\n\r\x0b\x0c\x1c\x1d\x1e\x1f'
+
+
+def iter_line_batches(filepath, decode=False, chunk_size=None, input_mode=None):
+    """
+    Read a file in large chunks, yielding (lines, bytes_read) batches
+
+    Lines do not include the b'\\n' terminator (a '\\r' before it is kept
+    and removed by strip_line / str.strip()). With decode=True every chunk
+    is decoded with the PROCESSING encoding in one call and str lines are
+    yielded instead of bytes.
+
+    input_mode 'mmap' maps the file instead of reading it (default:
+    PROCESSING['input_mode']), see _iter_mapped_batches().
+
+    Binary domain-set files (utils.domainset) are read as one domain per
+    line. gzip, xz and bz2 files are decompressed on the fly (never
+    mapped); bytes_read then counts compressed bytes, like the file size.
+    """
+    if is_domain_set(filepath):
+        yield from _iter_domain_set_batches(filepath, decode)
+        return
+
+    chunk_size = chunk_size or PROCESSING['chunk_size']
+    compression = detect_compression(filepath)
+    if compression is None and (input_mode or PROCESSING['input_mode']) == 'mmap':
+        yield from _iter_mapped_batches(filepath, decode, chunk_size)
+        return
+
+    encoding = PROCESSING['encoding']
+    errors = PROCESSING['errors']
+    bytes_read = 0
+    carry = b''
+
+    with open(filepath, 'rb') as raw:
+        f = open_reader(raw, compression) if compression else raw
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            bytes_read = raw.tell() if compression else bytes_read + len(chunk)
+
+            end = chunk.rfind(b'\n')
+            if end < 0:
+                carry += chunk
+                continue
+
+            block = carry + chunk[:end] if carry else chunk[:end]
+            carry = chunk[end + 1:]
+            if decode:
+                yield block.decode(encoding, errors).split('\n'), bytes_read
+            else:
+                yield block.split(b'\n'), bytes_read
+
+    if carry:
+        yield [carry.decode(encoding, errors) if decode else carry], bytes_read
+
+
+def _iter_domain_set_batches(filepath, decode):
+    """iter_line_batches() over a domain-set file"""
+    encoding = PROCESSING['encoding']
+    with DomainSet(filepath) as domain_set:
+        for domains, bytes_read in domain_set.iter_batches():
+            if decode:
+                yield [domain.decode(encoding) for domain in domains], bytes_read
+            else:
+                yield domains, bytes_read
+
+
+def _iter_mapped_batches(filepath, decode, chunk_size):
+    """
+    iter_line_batches() over a memory-mapped file
+
+    Batch boundaries are located with rfind/find directly on the mapping,
+    so no read buffer is filled or carried between chunks: each batch is a
+    single slice of the mapping, and the page cache does the buffering.
+    """
+    size = os.path.getsize(filepath)
+    if size == 0:
+        return  # empty files cannot be mapped
+    encoding = PROCESSING['encoding']
+    errors = PROCESSING['errors']
+
+    with open(filepath, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            pos = 0
+            while pos < size:
+                end = mapped.rfind(b'\n', pos, pos + chunk_size)
+                if end < 0:
+                    # A single line longer than the chunk size
+                    end = mapped.find(b'\n', pos + chunk_size)
+                    if end < 0:
+                        end = size
+                block = mapped[pos:end]
+                pos = end + 1
+                if decode:
+                    yield block.decode(encoding, errors).split('\n'), min(pos, size)
+                else:
+                    yield block.split(b'\n'), min(pos, size)
+
+
+def strip_line(line):
+    """
+    Strip a bytes line the way str.strip() strips the decoded line
+
+    ASCII lines never get decoded; other lines go through a decode/encode
+    round trip so invalid sequences and Unicode whitespace are handled as
+    the text-mode readers did.
+    """
+    stripped = line.strip(WHITESPACE)
+    if stripped.isascii():
+        return stripped
+    return (stripped.decode(PROCESSING['encoding'], PROCESSING['errors'])
+            .strip().encode(PROCESSING['encoding']))
+
+
+def clean_line(line):
+    """
+    Normalize a bytes line without stripping it: drop the '\r' of a CRLF
+    ending and invalid byte sequences (non-ASCII lines only)
+    """
+    if line.endswith(b'\r'):
+        line = line[:-1]
+    if line.isascii():
+        return line
+    return line.decode(PROCESSING['encoding'], PROCESSING['errors']).encode(PROCESSING['encoding'])
+
+
+def encode_text_block(lines):
+    """Encode str lines as one block terminated like LineWriter output"""
+    return (TEXT_NEWLINE.join(lines) + TEXT_NEWLINE).encode(PROCESSING['encoding'])
+
+
+class LineWriter:
+    """
+    Batched line writer
+
+    Lines are collected in a list and written with a single join once
+    PROCESSING['write_batch'] lines are pending. With text=True the lines
+    are str and are encoded per batch. Paths ending in .gz, .xz or .bz2
+    are written compressed, or pass compression for e.g. a temp file that
+    is renamed to such a path later.
+    """
+
+    def __init__(self, path, text=False, append=False, compression=None):
+        self.path = path
+        self.text = text
+        self.lines_written = 0
+        self._file = open_output(path, append=append, compression=compression)
+        self._pending = []
+        self._limit = PROCESSING['write_batch']
+        self._newline = TEXT_NEWLINE if text else NEWLINE
+
+    def write(self, line):
+        """Queue one line (without newline)"""
+        self._pending.append(line)
+        if len(self._pending) >= self._limit:
+            self.flush()
+
+    def write_many(self, lines):
+        """Queue several lines (without newlines)"""
+        self._pending.extend(lines)
+        if len(self._pending) >= self._limit:
+            self.flush()
+
+    def write_raw(self, data):
+        """Write bytes as they are, after any pending lines"""
+        self.flush()
+        self._file.write(data)
+
+    def flush(self):
+        """Write all pending lines to the file"""
+        if not self._pending:
+            return
+        data = self._newline.join(self._pending) + self._newline
+        if self.text:
+            data = data.encode(PROCESSING['encoding'])
+        self._file.write(data)
+        self.lines_written += len(self._pending)
+        self._pending = []
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,228 @@
+"""
+AdGuard / hosts rule parser
+Turns a stripped line into a compact Rule record (kind, domain, modifiers,
+exception flag). The common forms (||domain^, ||domain^$important,
+0.0.0.0 domain, plain domain) are matched by a single precompiled regex
+before any general parsing is done.
+"""
+
+import re
+from utils.classify import (classify, BLANK, COMMENT, HOSTS, NETWORK, EXCEPTION,
+                            COSMETIC, REGEX, DOMAIN)
+
+# Sink addresses used by hosts-format blocklists
+HOSTS_SINKS = ('0.0.0.0', '127.0.0.1', '::', '::1')
+
+# Dotted names stock hosts files map to the machine itself (dotless ones
+# like localhost or ip6-loopback are no domains anyway); never blocked
+HOSTS_LOCAL_NAMES = frozenset(['localhost.localdomain', 'localhost.local', '0.0.0.0'])
+
+# First characters of lines that never block a DNS name: comments, cosmetic
+# rules, exceptions, regex rules and [Adblock] headers
+NO_DOMAIN_LEADS = frozenset('!#@/[')
+
+# First characters of a sink address (IPv4 digits or IPv6 ':')
+_HOSTS_LEADS = frozenset('0123456789:')
+_HOSTS_SINK_SET = frozenset(HOSTS_SINKS)
+_HOSTS_LEAD_BYTES = frozenset(bytes([char]) for char in b'0123456789:')
+# normalize_domain()'s check in one match: DOMAIN_RE with a dot
+_DOTTED_DOMAIN = re.compile(r'[a-z0-9][a-z0-9._-]*\.[a-z0-9._-]*').fullmatch
+
+DOMAIN_RE = re.compile(r'^[a-z0-9][a-z0-9._-]*$')
+
+# Modifiers that do not change which DNS names a rule blocks
+DNS_NEUTRAL_MODIFIERS = frozenset(['important'])
+
+# Fast path: lowercase, dot-terminated-free domains in the common rule forms
+_FAST_DOMAIN = r'[a-z0-9][a-z0-9_-]*(?:\.[a-z0-9_-]+)+'
+_FAST_RULE = re.compile(rf'''
+    \|\|(?P<network>{_FAST_DOMAIN})\^(?:\$important)?$
+  | (?:0\.0\.0\.0|127\.0\.0\.1|::1?)[ \t]+(?P<hosts>{_FAST_DOMAIN})$
+  | (?P<domain>{_FAST_DOMAIN})$
+''', re.VERBOSE)
+_FAST_KINDS = {'network': NETWORK, 'hosts': HOSTS, 'domain': DOMAIN}
+_IMPORTANT = ('important',)
+_MODIFIER_SEP = re.compile(r'(?<!\\),')
+
+# Cosmetic markers that make a cosmetic rule an exception (#@#, #@$#, #@%#, #@?#)
+_COSMETIC_EXCEPTION = re.compile(r'#@[$%?]{0,2}#')
+
+
+class Rule:
+    """
+    Parsed rule
+
+    kind is one of utils.classify.LINE_KINDS (exceptions keep the kind of
+    the rule they allow, with exception=True). domain is the normalized
+    domain for ||domain^, hosts and plain domain rules, None otherwise.
+    modifiers is a tuple of the $options.
+    """
+
+    __slots__ = ('kind', 'domain', 'modifiers', 'exception')
+
+    def __init__(self, kind, domain=None, modifiers=(), exception=False):
+        self.kind = kind
+        self.domain = domain
+        self.modifiers = modifiers
+        self.exception = exception
+
+    def __repr__(self):
+        return (f"Rule({self.kind!r}, {self.domain!r}, {self.modifiers!r}, "
+                f"exception={self.exception!r})")
+
+    @property
+    def unsupported_reason(self):
+        """
+        Why the rule cannot be written to a DNS blocklist (hosts, PiHole...),
+        or None if it can
+
+        One of 'blank', 'comment', 'exception', 'cosmetic', 'regex',
+        'pattern' (not a plain domain: URL, wildcard, path...), 'badfilter'
+        or 'modifiers' (options that change the rule's scope).
+        """
+        if self.kind in (BLANK, COMMENT, COSMETIC, REGEX):
+            return self.kind
+        if self.exception:
+            return 'exception'
+        if self.domain is None:
+            return 'pattern'
+        if self.modifiers:
+            if 'badfilter' in self.modifiers:
+                return 'badfilter'
+            if not DNS_NEUTRAL_MODIFIERS.issuperset(self.modifiers):
+                return 'modifiers'
+        return None
+
+    @property
+    def blocks_dns(self):
+        """True if the rule is a plain block of self.domain"""
+        return self.unsupported_reason is None
+
+
+def normalize_domain(name):
+    """Lowercase a name and drop a trailing dot; None unless it is a dotted domain"""
+    domain = name.lower().rstrip('.')
+    if '.' in domain and DOMAIN_RE.match(domain):
+        return domain
+    return None
+
+
+def parse_modifiers(options):
+    """'important,dnstype=A' -> ('important', 'dnstype=A'); escaped commas are kept"""
+    return tuple(_MODIFIER_SEP.split(options))
+
+
+def _parse_network(text, exception):
+    pattern, dollar, options = text.rpartition('$')
+    if dollar:
+        modifiers = parse_modifiers(options)
+    else:
+        pattern, modifiers = text, ()
+
+    domain = None
+    if pattern.startswith('||') and pattern.endswith('^'):
+        domain = normalize_domain(pattern[2:-1])
+    return Rule(NETWORK, domain, modifiers, exception)
+
+
+def _parse_regex(text, exception):
+    modifiers = ()
+    if not text.endswith('/'):
+        _, _, options = text.rpartition('$')
+        modifiers = parse_modifiers(options)
+    return Rule(REGEX, None, modifiers, exception)
+
+
+def parse_rule(stripped):
+    """
+    Parse a stripped line into a Rule
+
+    Args:
+        stripped: Line without surrounding whitespace
+
+    Returns:
+        Rule
+    """
+    fast = _FAST_RULE.match(stripped)
+    if fast and not (fast.lastgroup == 'hosts' and fast.group('hosts') in HOSTS_LOCAL_NAMES):
+        group = fast.lastgroup
+        modifiers = _IMPORTANT if group == 'network' and stripped[-1] == 't' else ()
+        return Rule(_FAST_KINDS[group], fast.group(group), modifiers)
+
+    kind = classify(stripped)
+    if kind == NETWORK:
+        return _parse_network(stripped, False)
+    if kind == DOMAIN:
+        return Rule(DOMAIN, normalize_domain(stripped))
+    if kind == HOSTS:
+        domains = hosts_domains(stripped)
+        return Rule(HOSTS, domains[0] if len(domains) == 1 else None)
+    if kind == EXCEPTION:
+        text = stripped[2:]
+        if classify(text) == REGEX:
+            return _parse_regex(text, True)
+        return _parse_network(text, True)
+    if kind == REGEX:
+        return _parse_regex(stripped, False)
+    if kind == COSMETIC:
+        return Rule(COSMETIC, exception=_COSMETIC_EXCEPTION.search(stripped) is not None)
+    return Rule(kind)
+
+
+def hosts_domains(stripped):
+    """
+    Domains a hosts line points at a sink address, [] for any other line
+
+    '0.0.0.0 a.com b.com  # note' -> ['a.com', 'b.com']. Plain str.split
+    parsing: an inline comment is cut at '#', localhost names and entries
+    for other addresses are left out.
+    """
+    if not stripped or stripped[0] not in _HOSTS_LEADS:
+        return []
+    parts = stripped.partition('#')[0].split()
+    if len(parts) < 2 or parts[0] not in _HOSTS_SINK_SET:
+        return []
+    domains = []
+    for name in parts[1:]:
+        domain = name.lower().rstrip('.')
+        if _DOTTED_DOMAIN(domain) and domain not in HOSTS_LOCAL_NAMES:
+            domains.append(domain)
+    return domains
+
+
+def split_hosts_lines(lines):
+    """
+    Batch of stripped bytes lines with every hosts line naming several
+    domains replaced by one '<sink> <domain>' line per domain
+
+    b'0.0.0.0 a.com b.com' -> [b'0.0.0.0 a.com', b'0.0.0.0 b.com'], so
+    each line blocks a single domain that dedupe keys, the allowlist and
+    pruning can see. Any other line is passed on as it is.
+    """
+    split = []
+    for line in lines:
+        if line[:1] in _HOSTS_LEAD_BYTES:
+            parts = line.partition(b'#')[0].split()
+            if len(parts) > 2:
+                domains = hosts_domains(line.decode('ascii', 'ignore'))
+                if domains:
+                    split.extend(parts[0] + b' ' + domain.encode('ascii') for domain in domains)
+                    continue
+        split.append(line)
+    return split
+
+
+def blocked_domain(stripped):
+    """Domain a rule plainly blocks (Rule.blocks_dns), or None"""
+    # Cheap rejection before the regex for the common non-blocking lines
+    if not stripped or stripped[0] in NO_DOMAIN_LEADS:
+        return None
+
+    fast = _FAST_RULE.match(stripped)
+    if fast:
+        domain = fast.group(fast.lastgroup)
+        if fast.lastgroup != 'hosts' or domain not in HOSTS_LOCAL_NAMES:
+            return domain
+        return None
+    rule = parse_rule(stripped)
+    return rule.domain if rule.blocks_dns else None